@@ -3,13 +3,17 @@
 # admin.py
 # ==============================
 from django.contrib import admin
-from chatbot.models import ChatSession, ChatMessage, ChatSummary
+from chatbot.lifecycle import close_sessions
+from chatbot.models import ChatArchive, ChatSession, ChatMessage, ChatSummary
+from chatbot.search import search_messages
+from chatbot.utils.text_summary import rebuild_raw_text
 
 
 @admin.register(ChatSession)
 class ChatSessionAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "title", "is_open", "started_at", "ended_at")
+    list_display = ("id", "user", "title", "is_open", "started_at", "ended_at", "archive")
     list_filter = ("is_open", "started_at")
+    raw_id_fields = ("archive",)
     search_fields = ("title", "user__username", "user__email")
     actions = [
         "force_close_sessions",
@@ -17,9 +21,18 @@ class ChatSessionAdmin(admin.ModelAdmin):
 
     @admin.action(description="Force close selected sessions")
     def force_close_sessions(self, request, queryset):
-        for session in queryset:
-            session.end()
-        self.message_user(request, f"Closed {queryset.count()} sessions.")
+        closed = close_sessions(queryset)
+        self.message_user(request, f"Closed {len(closed)} sessions.")
+
+
+@admin.register(ChatArchive)
+class ChatArchiveAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "session_count", "message_count", "raw_bytes", "created_at")
+    search_fields = ("user__username",)
+    readonly_fields = (
+        "blob", "codec", "session_count", "message_count", "raw_bytes", "first_message_id", "last_message_id",
+        "created_at",
+    )
 
 
 @admin.register(ChatMessage)
@@ -27,8 +40,16 @@ class ChatMessageAdmin(admin.ModelAdmin):
     list_display = ("id", "session", "user", "is_bot", "short_msg", "created_at")
     list_filter = ("is_bot", "created_at")
     search_fields = ("message", "user__username")
+    search_help_text = "جستجوی تمام‌متن در پیام‌ها یا username دقیق"
     ordering = ("-created_at",)
 
+    def get_search_results(self, request, queryset, search_term):
+        # به‌جای LIKE '%x%' روی کل جدول، از ایندکس تمام‌متن استفاده می‌کنیم
+        if not search_term:
+            return queryset, False
+        hits = search_messages(queryset, search_term)
+        return hits | queryset.filter(user__username=search_term.strip()), False
+
     @admin.display(description="Message")
     def short_msg(self, obj):
         return (obj.message[:60] + "…") if len(obj.message) > 60 else obj.message
@@ -36,6 +57,12 @@ class ChatMessageAdmin(admin.ModelAdmin):
 
 @admin.register(ChatSummary)
 class ChatSummaryAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "session", "model_used", "updated_at")
+    list_display = ("id", "user", "session", "model_used", "raw_chars", "updated_at")
     list_filter = ("model_used", "updated_at")
-    search_fields = ("rewritten_text", "user__username")
\ No newline at end of file
+    search_fields = ("user__username",)  # rewritten_text فشرده ذخیره می‌شود
+    exclude = ("raw_text",)
+    readonly_fields = ("first_message_id", "last_message_id", "raw_layout", "raw_chars", "raw_sha256", "source_text")
+
+    @admin.display(description="Source text (rebuilt)")
+    def source_text(self, obj):
+        return rebuild_raw_text(obj) if obj.pk else ""
\ No newline at end of file
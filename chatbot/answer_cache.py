@@ -0,0 +1,115 @@
+# chatbot/answer_cache.py
+# کش پاسخ برای نوبت‌های «بی‌زمینه» (بدون تاریخچه، خلاصه و تصویر):
+# کلید = متن یکسان‌سازی‌شده + مدل + نسخهٔ پرامپت. در صورت فعال بودن NEAR_DUP، سؤالی که فقط در
+# واژه‌های دستوری (از، چه، باید، کنم...) فرق دارد هم از کش پاسخ می‌گیرد؛ اعداد و واژه‌های محتوایی
+# باید عیناً و به همان ترتیب یکسان باشند («کودک ۱۰ ساله» پاسخ «کودک ۲ ساله» را نمی‌گیرد).
+from __future__ import annotations
+
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from chatbot.utils.normalize import search_tokens
+
+logger = logging.getLogger(__name__)
+
+ENABLED = bool(getattr(settings, "CHAT_ANSWER_CACHE_ENABLED", True))
+TTL = int(getattr(settings, "CHAT_ANSWER_CACHE_TTL", 60 * 60 * 24))
+MAX_ANSWER_CHARS = int(getattr(settings, "CHAT_ANSWER_CACHE_MAX_CHARS", 4_000))
+MAX_QUESTION_CHARS = 300
+NEAR_DUP_ENABLED = bool(getattr(settings, "CHAT_ANSWER_CACHE_NEAR_DUP", False))
+
+# واژه‌هایی که حذفشان معنای سؤال پزشکی را عوض نمی‌کند؛ نفی، اعداد، سن، شدت و نام دارو/بیماری اینجا نیستند
+_STOP_WORDS = frozenset((
+    "از", "به", "با", "در", "تو", "برای", "که", "و", "یا", "را", "رو", "این", "اون", "آن", "هم",
+    "چه", "چی", "چیه", "چطور", "چطوری", "چگونه", "آیا", "ایا", "باید", "کنم", "بکنم", "کنیم", "بکنیم",
+    "است", "هست", "هستش", "لطفا", "سلام", "ممنون", "مرسی", "دکتر", "جان",
+))
+
+_STATS_KEYS = ("hits", "near_hits", "misses", "saved_ms", "saved_tokens")
+
+
+def _namespace(model: str, system_prompt: str) -> str:
+    version = hashlib.sha1(system_prompt.encode("utf-8")).hexdigest()[:10]
+    return f"{model}:{version}"
+
+
+def _entry_key(ns: str, normalized: str) -> str:
+    return "chat:answer:" + hashlib.sha1(f"{ns}|{normalized}".encode("utf-8")).hexdigest()
+
+
+def _near_key(ns: str, signature: Tuple[str, ...]) -> str:
+    return "chat:answer:near:" + hashlib.sha1(f"{ns}|{' '.join(signature)}".encode("utf-8")).hexdigest()
+
+
+# ==============================
+# Near-duplicate signature
+# ==============================
+def _signature(normalized: str) -> Tuple[str, ...]:
+    """واژه‌های محتوایی و اعداد به ترتیب؛ دو سؤال فقط وقتی هم‌ارزند که امضایشان عیناً برابر باشد."""
+    return tuple(t for t in search_tokens(normalized) if t not in _STOP_WORDS)
+
+
+# ==============================
+# Public API
+# ==============================
+def _bump(**counts) -> None:
+    for name, n in counts.items():
+        if not n:
+            continue
+        key = f"chat:answer:stats:{name}"
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, n)
+        except ValueError:
+            cache.set(key, n, None)
+
+
+def lookup(question: str, *, model: str, system_prompt: str) -> Optional[str]:
+    """پاسخ کش‌شده برای سؤال (دقیق یا تقریباً یکسان) یا None."""
+    if not ENABLED or not question or len(question) > MAX_QUESTION_CHARS:
+        return None
+    normalized = " ".join(search_tokens(question))  # بدون نشانه‌گذاری
+    ns = _namespace(model, system_prompt)
+    entry = cache.get(_entry_key(ns, normalized))
+    near = False
+    signature = _signature(normalized)
+    if entry is None and NEAR_DUP_ENABLED and signature:
+        key = cache.get(_near_key(ns, signature))
+        entry = cache.get(key) if key else None
+        near = entry is not None
+    if entry is None:
+        _bump(misses=1)
+        return None
+
+    _bump(hits=1, near_hits=int(near), saved_ms=entry["latency_ms"], saved_tokens=entry["tokens"])
+    logger.info(
+        "Answer cache %s hit: saved ~%sms and %s tokens (model=%s)",
+        "near" if near else "exact", entry["latency_ms"], entry["tokens"], model,
+    )
+    return entry["answer"]
+
+
+def store(question: str, answer: str, *, model: str, system_prompt: str, latency_ms: int, tokens: int = 0) -> bool:
+    """ذخیرهٔ پاسخ یک نوبت بی‌زمینه؛ پاسخ‌های بلندتر از MAX_ANSWER_CHARS کش نمی‌شوند."""
+    if not ENABLED or not question or not answer:
+        return False
+    if len(question) > MAX_QUESTION_CHARS or len(answer) > MAX_ANSWER_CHARS:
+        return False
+    normalized = " ".join(search_tokens(question))  # بدون نشانه‌گذاری
+    ns = _namespace(model, system_prompt)
+    key = _entry_key(ns, normalized)
+    cache.set(key, {"answer": answer, "latency_ms": int(latency_ms), "tokens": int(tokens or 0)}, TTL)
+
+    signature = _signature(normalized)
+    if NEAR_DUP_ENABLED and signature:
+        cache.set(_near_key(ns, signature), key, TTL)
+    return True
+
+
+def stats() -> Dict[str, int]:
+    values = cache.get_many([f"chat:answer:stats:{n}" for n in _STATS_KEYS])
+    return {n: int(values.get(f"chat:answer:stats:{n}", 0)) for n in _STATS_KEYS}
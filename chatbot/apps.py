@@ -8,4 +8,7 @@ class ChatBotConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chatbot"
 
+    def ready(self):
+        import chatbot.signals  # noqa: F401
+
 
@@ -0,0 +1,193 @@
+# chatbot/archive.py
+# بایگانی سرد: پیام‌های سشن‌هایی که مدت‌ها پیش بسته شده‌اند به‌صورت JSONL فشرده (gzip)
+# برای هر کاربر در storage ذخیره و از جدول داغ ChatMessage حذف می‌شوند؛
+# ChatSession.archive به فایل اشاره می‌کند و خواندن از طریق archived_messages شفاف است.
+from __future__ import annotations
+
+import gzip
+import heapq
+import itertools
+import json
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from itertools import groupby
+from typing import Dict, Iterator, List, Sequence
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from chatbot.models import ChatArchive, ChatMessage, ChatSession
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(getattr(settings, "CHAT_ARCHIVE_AFTER_DAYS", 90))
+ARCHIVE_MAX_SESSIONS = 500  # سقف سشن در هر فایل بایگانی
+CODEC = "gzip"  # zstandard در requirements نیست؛ gzip از کتابخانهٔ استاندارد
+_FIELDS = ("id", "session_id", "user_id", "is_bot", "message", "created_at")
+
+
+# ==============================
+# Encoding
+# ==============================
+def _encode(rows: List[Dict]) -> bytes:
+    lines = "\n".join(
+        json.dumps({**r, "created_at": r["created_at"].isoformat()}, ensure_ascii=False) for r in rows
+    )
+    return lines.encode("utf-8")
+
+
+def _decode(raw: bytes) -> List[ChatMessage]:
+    """هر خط JSONL یک ChatMessage ذخیره‌نشده (فقط‌خواندنی) می‌شود."""
+    out = []
+    for line in raw.decode("utf-8").splitlines():
+        if not line:
+            continue
+        d = json.loads(line)
+        d["created_at"] = parse_datetime(d["created_at"])
+        out.append(ChatMessage(**d))
+    return out
+
+
+def load_archive(archive: ChatArchive) -> List[ChatMessage]:
+    if archive.codec != CODEC:
+        raise ValueError(f"unsupported archive codec: {archive.codec}")
+    with archive.blob.open("rb") as fh:
+        return _decode(gzip.decompress(fh.read()))
+
+
+# ==============================
+# Write side
+# ==============================
+def archivable_sessions(days: int = ARCHIVE_AFTER_DAYS, *, now=None):
+    """سشن‌های بسته‌ای که بیش از days روز از پایانشان گذشته و هنوز بایگانی نشده‌اند."""
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return ChatSession.objects.filter(is_open=False, ended_at__lt=cutoff, archive__isnull=True)
+
+
+def archive_user_sessions(user_id: int, session_ids: Sequence[int]) -> ChatArchive:
+    """
+    پیام‌های سشن‌های یک کاربر را در یک فایل بایگانی می‌نویسد، سشن‌ها را به آن وصل و
+    پیام‌ها را از ChatMessage حذف می‌کند. اگر تراکنش شکست بخورد فایل هم پاک می‌شود.
+    """
+    session_ids = list(session_ids)
+    rows = list(ChatMessage.objects.filter(session_id__in=session_ids).order_by("id").values(*_FIELDS))
+    raw = _encode(rows)
+
+    archive = ChatArchive(
+        user_id=user_id,
+        codec=CODEC,
+        session_count=len(session_ids),
+        message_count=len(rows),
+        raw_bytes=len(raw),
+        first_message_id=rows[0]["id"] if rows else None,
+        last_message_id=rows[-1]["id"] if rows else None,
+    )
+    archive.blob.save(f"{user_id}.jsonl.gz", ContentFile(gzip.compress(raw)), save=False)
+    try:
+        with transaction.atomic():
+            archive.save()
+            ChatSession.objects.filter(pk__in=session_ids, archive__isnull=True).update(archive=archive)
+            if rows:
+                ChatMessage.objects.filter(session_id__in=session_ids, id__lte=rows[-1]["id"]).delete()
+    except Exception:
+        archive.blob.delete(save=False)
+        raise
+    return archive
+
+
+def archive_sessions(qs) -> Dict[str, int]:
+    """
+    qs را (پس از ثابت کردن لیست id) به تفکیک کاربر و در دسته‌های ARCHIVE_MAX_SESSIONS بایگانی می‌کند.
+    خروجی: {"archives", "sessions", "messages"}.
+    """
+    from chatbot.history import forget_session_headers
+
+    pairs = list(qs.order_by("user_id", "id").values_list("user_id", "id"))
+    stats = {"archives": 0, "sessions": 0, "messages": 0}
+    for user_id, group in groupby(pairs, key=lambda p: p[0]):
+        ids = [sid for _, sid in group]
+        for i in range(0, len(ids), ARCHIVE_MAX_SESSIONS):
+            chunk = ids[i:i + ARCHIVE_MAX_SESSIONS]
+            archive = archive_user_sessions(user_id, chunk)
+            forget_session_headers(chunk)
+            stats["archives"] += 1
+            stats["sessions"] += len(chunk)
+            stats["messages"] += archive.message_count
+    return stats
+
+
+# ==============================
+# Read side
+# ==============================
+def _wanted_sessions(sessions) -> Dict[int, set]:
+    """{archive_id: {session_id, ...}} برای سشن‌های بایگانی‌شدهٔ ورودی."""
+    if isinstance(sessions, QuerySet):
+        pairs = sessions.filter(archive__isnull=False).values_list("id", "archive_id")
+    elif all(isinstance(s, ChatSession) for s in sessions):
+        pairs = [(s.pk, s.archive_id) for s in sessions if s.archive_id]  # بدون کوئری
+    else:
+        pairs = ChatSession.objects.filter(
+            pk__in=[getattr(s, "pk", s) for s in sessions], archive__isnull=False
+        ).values_list("id", "archive_id")
+    wanted: Dict[int, set] = defaultdict(set)
+    for sid, archive_id in pairs:
+        wanted[archive_id].add(sid)
+    return wanted
+
+
+def _archive_messages(archive: ChatArchive, session_ids: set) -> List[ChatMessage]:
+    try:
+        msgs = load_archive(archive)
+    except Exception:
+        logger.exception("Failed to read chat archive #%s", archive.pk)
+        return []
+    return [m for m in msgs if m.session_id in session_ids]
+
+
+def archived_messages(sessions) -> List[ChatMessage]:
+    """
+    پیام‌های بایگانی‌شدهٔ سشن‌های داده‌شده (QuerySet یا لیست id/نمونه) به ترتیب id؛
+    سشن‌های بایگانی‌نشده نادیده گرفته می‌شوند.
+    """
+    wanted = _wanted_sessions(sessions)
+    if not wanted:
+        return []
+    out: List[ChatMessage] = []
+    for archive in ChatArchive.objects.filter(pk__in=wanted):
+        out.extend(_archive_messages(archive, wanted[archive.pk]))
+    out.sort(key=lambda m: m.id)
+    return out
+
+
+def iter_archived_messages_desc(sessions) -> Iterator[ChatMessage]:
+    """
+    مثل archived_messages ولی از جدید به قدیم و تنبل: هر فایل فقط وقتی باز می‌شود که
+    last_message_id آن به جلوی صف برسد؛ مصرف‌کننده‌ای که زود می‌ایستد (سقف متن خلاصه)
+    فایل‌های قدیمی را از حافظه/storage نمی‌خواند. فایل‌های بدون بازهٔ id اول خوانده می‌شوند.
+    """
+    wanted = _wanted_sessions(sessions)
+    if not wanted:
+        return
+    tie = itertools.count()
+    # (کلید مرتب‌سازی، شمارنده، پیام یا None، فایل یا iterator)
+    heap = [
+        (-(a.last_message_id if a.last_message_id is not None else float("inf")), next(tie), None, a)
+        for a in ChatArchive.objects.filter(pk__in=wanted)
+    ]
+    heapq.heapify(heap)
+    while heap:
+        _, _, message, source = heapq.heappop(heap)
+        if message is None:
+            msgs = _archive_messages(source, wanted[source.pk])
+            msgs.sort(key=lambda m: m.id, reverse=True)
+            source = iter(msgs)
+        else:
+            yield message
+        nxt = next(source, None)
+        if nxt is not None:
+            heapq.heappush(heap, (-nxt.id, next(tie), nxt, source))
@@ -0,0 +1,69 @@
+# chatbot/fields.py
+# فیلد متنی فشرده: متن در ستون باینری با هدر کوچک و zlib ذخیره می‌شود.
+# ردیف‌های قدیمی (UTF-8 خام بدون هدر) بدون تبدیل قابل خواندن‌اند.
+from __future__ import annotations
+
+import zlib
+
+from django.db import models
+
+MAGIC = b"\x00CZ"          # هیچ متن UTF-8 عادی‌ای با NUL شروع نمی‌شود
+CODEC_ZLIB = b"z"
+CODEC_PLAIN = b"p"          # فقط برای متنی که خودش با MAGIC شروع شود
+MIN_COMPRESS_BYTES = 256    # متن‌های کوتاه‌تر ارزش فشرده‌سازی ندارند
+ZLIB_LEVEL = 6
+
+
+def compress_text(text: str) -> bytes:
+    raw = text.encode("utf-8")
+    if len(raw) >= MIN_COMPRESS_BYTES:
+        packed = zlib.compress(raw, ZLIB_LEVEL)
+        if len(packed) + len(MAGIC) + 1 < len(raw):
+            return MAGIC + CODEC_ZLIB + packed
+    if raw.startswith(MAGIC):
+        return MAGIC + CODEC_PLAIN + raw
+    return raw
+
+
+def decompress_text(value) -> str:
+    """bytes/memoryview (با یا بدون هدر) یا str قدیمی را به متن برمی‌گرداند."""
+    if value is None or isinstance(value, str):
+        return value
+    data = bytes(value)
+    if not data.startswith(MAGIC):
+        return data.decode("utf-8")
+    codec, body = data[len(MAGIC):len(MAGIC) + 1], data[len(MAGIC) + 1:]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(body).decode("utf-8")
+    if codec == CODEC_PLAIN:
+        return body.decode("utf-8")
+    raise ValueError(f"unknown compressed text codec: {codec!r}")
+
+
+class CompressedTextField(models.TextField):
+    """
+    TextField که در دیتابیس به‌صورت باینری فشرده ذخیره می‌شود.
+    در پایتون، فرم‌ها و سریالایزرها مثل TextField رفتار می‌کند؛ lookupهای متنی
+    (icontains و ...) روی آن معنا ندارند و جستجو باید از ستون جدا (مثل search_text) برود.
+    """
+
+    description = "Text (zlib-compressed)"
+
+    def get_internal_type(self):
+        return "BinaryField"
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decompress_text(value)
+        return super().to_python(value)
+
+    def from_db_value(self, value, expression, connection):
+        return decompress_text(value)
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        return None if value is None else compress_text(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = super().get_db_prep_value(value, connection, prepared)
+        return None if value is None else connection.Database.Binary(value)
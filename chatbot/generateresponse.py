@@ -14,14 +14,18 @@ import time
 from typing import Dict, List, Optional, Sequence, Tuple
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
 
+from chatbot.lifecycle import close_sessions
 from chatbot.models import ChatMessage, ChatSession
+from chatbot import answer_cache
 from chatbot.cleaner import clean_bot_message
-from chatbot.utils.text_summary import (
-    get_or_create_global_summary,
-    get_or_update_session_summary,
-)
+from chatbot.intents import answer_locally
+from chatbot.retrieval import format_turns, relevant_turns
+from chatbot.routing import choose_route, record_latency
+from chatbot.utils.profile import build_patient_profile
+from chatbot.utils.text_summary import get_global_summary
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +81,12 @@ MAX_IMAGE_BYTES_TARGET_FALLBACK = 900_000
 
 ALLOW_HEIC = True
 
+# حذف تصاویر تکراری (dHash ۶۴بیتی): فاصلهٔ همینگ تا این مقدار «همان عکس» حساب می‌شود
+IMAGE_DUP_MAX_DISTANCE = 6
+SESSION_IMAGES_TTL = 60 * 60 * 24
+SESSION_IMAGES_CAP = 16
+SEEN_IMAGE_NOTE_CHARS = 300
+
 # ==============================
 # Utils
 # ==============================
@@ -121,6 +131,17 @@ _PIL_READY = False
 _HEIF_READY = False
 try:
     from PIL import Image
+    from telemedicine.imaging import (
+        ImageBudget,
+        ImageRejected,
+        decode_image,
+        decoded_size,
+        image_job_result,
+        job_source,
+        probe_image,
+        submit_image_job,
+        target_size,
+    )
     _PIL_READY = True
     if ALLOW_HEIC:
         try:
@@ -132,15 +153,6 @@ try:
 except Exception:
     _PIL_READY = False
 
-def _downscale_to_megapixels(im, max_mp: float):
-    w, h = im.size
-    mp = (w * h) / 1_000_000.0
-    if mp <= max_mp:
-        return im
-    scale = (max_mp / mp) ** 0.5
-    new_size = (max(1, int(w * scale)), max(1, int(h * scale)))
-    return im.resize(new_size, Image.LANCZOS)
-
 def _jpeg_bytes(im: "Image.Image", quality: int) -> bytes:
     buf = io.BytesIO()
     im.save(
@@ -153,34 +165,57 @@ def _jpeg_bytes(im: "Image.Image", quality: int) -> bytes:
     )
     return buf.getvalue()
 
-def _process_image_to_budget(
-    data: bytes, mime: str, *, target_mp: float, target_bytes: int
-) -> Tuple[bytes, str]:
-    if not _PIL_READY:
-        return data, mime
-    try:
-        with Image.open(io.BytesIO(data)) as im:
-            if im.mode not in ("RGB", "L"):
-                im = im.convert("RGB")
-            im = _downscale_to_megapixels(im, target_mp)
-            q_lo, q_hi = 45, 88
-            best = _jpeg_bytes(im, q_hi)
-            if len(best) <= target_bytes:
-                return best, "image/jpeg"
-            for _ in range(5):
-                mid = (q_lo + q_hi) // 2
-                cand = _jpeg_bytes(im, mid)
-                if len(cand) <= target_bytes:
-                    best = cand
-                    q_lo = mid + 1
-                else:
-                    q_hi = mid - 1
-                if q_lo > q_hi:
-                    break
-            return best, "image/jpeg"
-    except Exception as exc:
-        logger.warning("Image process failed; fallback original. err=%s", exc)
-        return data, mime
+def _jpeg_to_budget(im: "Image.Image", target_bytes: int) -> bytes:
+    q_lo, q_hi = 45, 88
+    best = _jpeg_bytes(im, q_hi)
+    if len(best) <= target_bytes:
+        return best
+    for _ in range(5):
+        mid = (q_lo + q_hi) // 2
+        cand = _jpeg_bytes(im, mid)
+        if len(cand) <= target_bytes:
+            best = cand
+            q_lo = mid + 1
+        else:
+            q_hi = mid - 1
+        if q_lo > q_hi:
+            break
+    return best
+
+def _image_dhash(im: "Image.Image") -> int:
+    """dHash ۶۴بیتی روی نسخهٔ ۹×۸ خاکستریِ تصویر decodeشده."""
+    px = list(im.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return bits
+
+def _prepare_image(data, target_mp: float, target_bytes: int) -> Tuple[bytes, int]:
+    """کار استخر پروسهٔ تصویر (data: بایت یا مسیر فایل موقت): decode (با draft) ← dHash ← JPEG در سقف حجم."""
+    with decode_image(data, max_pixels=target_mp * 1_000_000) as im:
+        return _jpeg_to_budget(im, target_bytes), _image_dhash(im)
+
+def _near(h: int, others) -> Optional[int]:
+    for o in others:
+        if bin(h ^ o).count("1") <= IMAGE_DUP_MAX_DISTANCE:
+            return o
+    return None
+
+def _session_images_key(session_id: int) -> str:
+    return f"chat:session-images:{session_id}"
+
+def _seen_session_images(session_id: int) -> Dict[int, str]:
+    """{dhash: خلاصهٔ پاسخی که برای آن تصویر داده شد} برای تصاویر قبلی سشن باز."""
+    return dict(cache.get(_session_images_key(session_id)) or [])
+
+def _remember_session_images(session_id: int, hashes: Sequence[int], bot_msg: str) -> None:
+    if not hashes:
+        return
+    note = _clip_text(bot_msg, SEEN_IMAGE_NOTE_CHARS)
+    seen = list(cache.get(_session_images_key(session_id)) or [])
+    seen = [(h, note) for h in hashes] + [e for e in seen if e[0] not in hashes]
+    cache.set(_session_images_key(session_id), seen[:SESSION_IMAGES_CAP], SESSION_IMAGES_TTL)
 
 def _b64_to_bytes(b64: str) -> Optional[bytes]:
     try:
@@ -200,57 +235,125 @@ def _build_user_content_with_images(
     max_images: int = MAX_IMAGES,
     target_mp: float = MAX_IMAGE_MEGAPIXELS,
     target_bytes: int = MAX_IMAGE_BYTES_TARGET,
+    seen_images: Optional[Dict[int, str]] = None,
+    sent_hashes: Optional[List[int]] = None,
+    budget: Optional["ImageBudget"] = None,
 ) -> List[Dict]:
     """
     خروجی سازگار با OpenAI: آرایه‌ای از پارت‌های متن/عکس:
     [{"type":"image_url","image_url":{"url":...}}, {"type":"text","text":"..."}]
+
+    تصاویر تقریباً یکسان در همین درخواست حذف می‌شوند؛ تصویری که قبلاً در سشن فرستاده شده
+    (seen_images: dhash → خلاصهٔ پاسخ قبلی) به‌جای ارسال دوباره با یک ارجاع متنی جایگزین می‌شود.
+    dhash تصاویر ارسال‌شده به sent_hashes اضافه می‌شود. تصاویری که از روی هدر رد می‌شوند
+    (ابعاد/فرمت غیرمجاز یا عبور از بودجهٔ حافظهٔ درخواست) decode نمی‌شوند و فقط یادداشتی از آن‌ها می‌ماند.
+    پردازش تصاویر هم‌زمان در استخر پروسهٔ تصویر (telemedicine.imaging) انجام می‌شود، نه روی ترد درخواست.
     """
     parts: List[Dict] = []
+    notes: List[str] = []
     count = 0
+    kept: List[int] = []
+    sent_urls = set()
+    seen_images = seen_images or {}
+    budget = budget or (ImageBudget() if _PIL_READY else None)
+    # ("url", url) | ("raw", data, mime) | ("job", future, data, mime) به ترتیب ورود
+    pending: List[Tuple] = []
+
+    def _is_duplicate(h: int) -> bool:
+        if _near(h, kept) is not None:
+            return True
+        prev = _near(h, seen_images)
+        if prev is not None:
+            note = f"[این تصویر قبلاً در همین گفتگو ارسال و بررسی شده است. پاسخ قبلی: {seen_images[prev]}]"
+            if note not in notes:
+                notes.append(note)
+            return True
+        kept.append(h)
+        if sent_hashes is not None:
+            sent_hashes.append(h)
+        return False
+
+    def _queue(data, mime: str) -> None:
+        if not _PIL_READY:
+            pending.append(("raw", data, mime))
+            return
+        try:
+            # فقط هدر خوانده می‌شود؛ حافظهٔ decode (پس از draft) پیش از صف شدن از بودجهٔ درخواست کسر می‌شود
+            info = probe_image(data)
+            budget.reserve(*decoded_size(info, target_size(info, max_pixels=target_mp * 1_000_000)))
+            pending.append(("job", submit_image_job(_prepare_image, data, target_mp, target_bytes), data, mime))
+        except ImageRejected as exc:
+            logger.info("Image rejected before decode: %s", exc)
+            notes.append(f"[یکی از تصاویر بررسی نشد: {exc}]")
+
+    max_candidates = max_images * 2  # جا برای تکراری‌هایی که حذف می‌شوند
+    for b64 in image_b64_list or []:
+        if len(pending) >= max_candidates:
+            break
+        if not isinstance(b64, str) or not b64.strip():
+            continue
+        raw = _b64_to_bytes(b64)
+        if raw is None:  # احتمالا dataURL است
+            if not b64.startswith("data:"):
+                b64 = f"data:image/jpeg;base64,{b64}"
+            pending.append(("url", b64))
+        else:
+            _queue(raw, "image/jpeg")
 
-    if image_b64_list:
-        for b64 in image_b64_list:
-            if count >= max_images:
-                break
-            if not isinstance(b64, str) or not b64.strip():
-                continue
-            raw = _b64_to_bytes(b64)
-            if raw is None:  # احتمالا dataURL است
-                if not b64.startswith("data:"):
-                    b64 = f"data:image/jpeg;base64,{b64}"
-                parts.append({"type": "image_url", "image_url": {"url": b64}})
-            else:
-                data, mime = _process_image_to_budget(
-                    raw, "image/jpeg", target_mp=target_mp, target_bytes=target_bytes
-                )
-                parts.append({"type": "image_url", "image_url": {"url": _to_data_url(data, mime)}})
+    for f in image_files or []:
+        if len(pending) >= max_candidates:
+            break
+        try:
+            # فایل موقت روی دیسک فقط با مسیرش به استخر می‌رود و در این پروسه خوانده نمی‌شود
+            data = job_source(f) if _PIL_READY else f.read()
+        except Exception:
+            continue
+        _queue(data, getattr(f, "content_type", None) or _guess_mime(getattr(f, "name", "")))
+
+    # همهٔ تصاویر هم‌زمان در استخر پردازش شده‌اند؛ نتیجه‌ها به ترتیب ورود جمع می‌شوند
+    for entry in pending:
+        if count >= max_images:
+            if entry[0] == "job":
+                entry[1].cancel()
+            continue
+        if entry[0] == "url":
+            parts.append({"type": "image_url", "image_url": {"url": entry[1]}})
             count += 1
-
-    if image_files:
-        for f in image_files:
-            if count >= max_images:
-                break
+            continue
+        data, mime = entry[-2:]
+        if entry[0] == "job":
             try:
-                data = f.read()
-            except Exception:
+                jpeg, h = image_job_result(entry[1])
+            except ImageRejected as exc:
+                logger.info("Image skipped: %s", exc)
+                notes.append(f"[یکی از تصاویر بررسی نشد: {exc}]")
                 continue
-            mime = getattr(f, "content_type", None) or _guess_mime(getattr(f, "name", ""))
-            data, mime = _process_image_to_budget(
-                data, mime, target_mp=target_mp, target_bytes=target_bytes
-            )
-            parts.append({"type": "image_url", "image_url": {"url": _to_data_url(data, mime)}})
-            count += 1
+            except Exception as exc:
+                logger.warning("Image process failed; fallback original. err=%s", exc)
+                if isinstance(data, str):
+                    with open(data, "rb") as fh:
+                        data = fh.read()
+            else:
+                if _is_duplicate(h):
+                    continue
+                data, mime = jpeg, "image/jpeg"
+        parts.append({"type": "image_url", "image_url": {"url": _to_data_url(data, mime)}})
+        count += 1
 
     if image_urls:
         for url in image_urls:
             if count >= max_images:
                 break
-            if not isinstance(url, str) or not url.strip():
+            if not isinstance(url, str) or not url.strip() or url.strip() in sent_urls:
                 continue
+            sent_urls.add(url.strip())
             parts.append({"type": "image_url", "image_url": {"url": url.strip()}})
             count += 1
 
-    parts.append({"type": "text", "text": _ensure_text(text)})
+    text = _ensure_text(text)
+    if notes:
+        text = "\n".join(notes + [text]).strip()
+    parts.append({"type": "text", "text": text})
     return parts
 
 # ==============================
@@ -262,12 +365,33 @@ def _get_or_create_open_session(user) -> ChatSession:
         return session
     return ChatSession.objects.create(user=user)
 
-def _get_recent_history(session: ChatSession, max_len: int) -> List[Dict]:
-    recent = session.messages.order_by("-created_at")[:max_len]
-    return [
+def _save_turn(session: ChatSession, user, user_message: Optional[str], bot_msg: str) -> None:
+    try:
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create([
+                ChatMessage(session=session, user=user, message=_ensure_text(user_message or ""), is_bot=False),
+                ChatMessage(session=session, user=user, message=bot_msg, is_bot=True),
+            ])
+    except Exception as exc:
+        logger.exception("DB save failed: %s", exc)
+
+def _get_recent_history(session: ChatSession, max_len: int) -> Tuple[List[Dict], List[int]]:
+    recent = list(session.messages.order_by("-created_at")[:max_len])
+    history = [
         {"role": "assistant" if m.is_bot else "user", "content": _ensure_text(m.message)}
         for m in reversed(recent)
     ]
+    return history, [m.id for m in recent]
+
+def _patient_context(summary) -> str:
+    """پروفایل فشرده از structured_json؛ برای ردیف‌های قدیمی بدون آن، همان متن خلاصه."""
+    if summary is None:
+        return ""
+    profile = build_patient_profile(summary.structured_json)
+    if profile:
+        return "[PATIENT PROFILE]\n" + profile
+    txt = _summary_or_self(summary)
+    return "[GLOBAL SUMMARY]\n" + txt if txt else ""
 
 def _summary_or_self(obj) -> str:
     txt = _ensure_text(getattr(obj, "rewritten_text", "")).strip()
@@ -290,39 +414,49 @@ def generate_gpt_response(
     image_b64_list: Optional[Sequence[str]] = None,
     image_files: Optional[Sequence] = None,
     image_urls: Optional[Sequence[str]] = None,
-    max_history_length: int = 5,
+    max_history_length: int = 2,
     force_model: Optional[str] = None,
 ) -> str:
     t0 = time.monotonic()
     try:
-        client = _get_client()
-        model_name = force_model or getattr(settings, "VISION_MODEL_NAME", "gpt-4o")
-        max_tokens = int(getattr(settings, "RESPONSE_MAX_TOKENS", 1500))
-
         # Session
         if new_session:
-            ChatSession.objects.filter(user=request_user, is_open=True).update(is_open=False)
+            close_sessions(ChatSession.objects.filter(user=request_user, is_open=True))
             session = ChatSession.objects.create(user=request_user)
         else:
             session = _get_or_create_open_session(request_user)
 
+        # سؤال‌های عملیاتی اپ (اشتراک، کیف پول، نوبت، آپدیت، پزشک آنکال) بدون LLM
+        has_images = bool(image_b64_list or image_files or image_urls)
+        local = None if has_images else answer_locally(request_user, user_message or "")
+        if local:
+            intent, bot_msg = local
+            _save_turn(session, request_user, user_message, bot_msg)
+            logger.info("generate_gpt_response answered locally (intent=%s) in %sms",
+                        intent, int((time.monotonic() - t0) * 1000))
+            return bot_msg
+
+        client = _get_client()
+
         # Summaries & History
-        global_sum = get_or_create_global_summary(request_user)
-        session_sum = get_or_update_session_summary(session)
-        history = _get_recent_history(session, max_history_length)
+        # خلاصه‌ها فقط هنگام بسته شدن سشن ساخته می‌شوند؛ اینجا فقط خوانده می‌شوند.
+        # سشن باز هنوز خلاصه ندارد و تاریخچهٔ اخیر جای آن را می‌گیرد.
+        # به‌جای N پیام آخر: فقط نوبت قبلی سشن + نوبت‌های مرتبط گذشته (BM25، chatbot.retrieval)
+        global_sum = get_global_summary(request_user)
+        history, recent_ids = _get_recent_history(session, max_history_length)
+        related = relevant_turns(request_user, user_message or "", exclude_ids=recent_ids)
 
         # Base messages
         messages: List[Dict] = [{"role": "system", "content": SYSTEM_PROMPT}] + history
 
-        gtxt = _summary_or_self(global_sum)
-        if gtxt:
-            messages.append({"role": "system", "content": "[GLOBAL SUMMARY]\n" + gtxt})
-        stxt = _summary_or_self(session_sum)
-        if stxt:
-            messages.append({"role": "system", "content": "[SESSION SUMMARY]\n" + stxt})
+        patient_ctx = _patient_context(global_sum)
+        if patient_ctx:
+            messages.append({"role": "system", "content": patient_ctx})
+        if related:
+            messages.append({"role": "system", "content": "[RELEVANT PAST CONVERSATION]\n" + format_turns(related)})
 
         # Build user turn
-        has_images = bool(image_b64_list or image_files or image_urls)
+        sent_hashes: List[int] = []
         if has_images:
             user_content = _build_user_content_with_images(
                 user_message or "",
@@ -332,6 +466,8 @@ def generate_gpt_response(
                 max_images=MAX_IMAGES,
                 target_mp=MAX_IMAGE_MEGAPIXELS,
                 target_bytes=MAX_IMAGE_BYTES_TARGET,
+                seen_images=_seen_session_images(session.pk),
+                sent_hashes=sent_hashes,
             )
             messages_with_user = messages + [{"role": "user", "content": user_content}]
         else:
@@ -339,33 +475,62 @@ def generate_gpt_response(
                 return "لطفاً متن سؤال یا تصویر را ارسال کنید."
             messages_with_user = messages + [{"role": "user", "content": _ensure_text(user_message)}]
 
-        # Call API
-        resp = client.chat.completions.create(
-            model=model_name,
-            messages=messages_with_user,
-            max_tokens=max_tokens,
-            temperature=0.2,
-            top_p=0.9,
+        # مدل بر اساس تصویر، اندازهٔ پرامپت، پلن کاربر و تأخیر فعلی مدل‌ها (chatbot.routing)
+        route = choose_route(
+            request_user,
+            has_images=has_images,
+            prompt_chars=sum(len(m["content"]) for m in messages_with_user if isinstance(m["content"], str)),
+            force_model=force_model,
         )
+        model_name = route.model
+
+        # نوبت بی‌زمینه (بدون تاریخچه، پروفایل، نوبت‌های مرتبط و تصویر): پاسخ فقط به متن سؤال بستگی دارد
+        cacheable = not has_images and len(messages) == 1
+        if cacheable:
+            cached = answer_cache.lookup(user_message, model=model_name, system_prompt=SYSTEM_PROMPT)
+            if cached:
+                _save_turn(session, request_user, user_message, cached)
+                return clean_bot_message(cached)
+
+        # Call API
+        t_api = time.monotonic()
+        try:
+            resp = client.chat.completions.create(
+                model=model_name,
+                messages=messages_with_user,
+                max_tokens=route.max_tokens,
+                temperature=0.2,
+                top_p=0.9,
+                timeout=route.timeout,
+            )
+        except Exception:
+            # خطا/timeout هم در تأخیر مدل حساب می‌شود تا مسیریاب به fallback برود
+            record_latency(model_name, int((time.monotonic() - t_api) * 1000))
+            raise
+        api_ms = int((time.monotonic() - t_api) * 1000)
+        record_latency(model_name, api_ms)
         bot_msg = (resp.choices[0].message.content or "").strip()
         if not bot_msg:
             logger.error("Empty response from model.")
             return "🤔 پاسخ نامعتبر از سرویس دریافت شد."
 
         bot_msg = _remove_repeated(bot_msg)
+        if cacheable:
+            answer_cache.store(
+                user_message, bot_msg, model=model_name, system_prompt=SYSTEM_PROMPT,
+                latency_ms=api_ms,
+                tokens=getattr(getattr(resp, "usage", None), "total_tokens", 0) or 0,
+            )
 
         # Save to DB
-        try:
-            with transaction.atomic():
-                ChatMessage.objects.bulk_create([
-                    ChatMessage(session=session, user=request_user, message=_ensure_text(user_message or ""), is_bot=False),
-                    ChatMessage(session=session, user=request_user, message=bot_msg, is_bot=True),
-                ])
-        except Exception as exc:
-            logger.exception("DB save failed: %s", exc)
+        _save_turn(session, request_user, user_message, bot_msg)
+        _remember_session_images(session.pk, sent_hashes, bot_msg)
 
         elapsed_ms = int((time.monotonic() - t0) * 1000)
-        logger.info("generate_gpt_response done in %sms (has_images=%s)", elapsed_ms, has_images)
+        logger.info(
+            "generate_gpt_response done in %sms (has_images=%s route=%s model=%s api=%sms)",
+            elapsed_ms, has_images, route.route, model_name, api_ms,
+        )
 
         return clean_bot_message(bot_msg)
 
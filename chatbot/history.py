@@ -0,0 +1,93 @@
+# chatbot/history.py
+# خواندن تاریخچهٔ چت: صفحه‌بندی keyset روی (زمان، id) و کش هدر سشن‌ها
+from __future__ import annotations
+
+import base64
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from chatbot.models import ChatSession
+
+HEADER_CACHE_TTL = 300
+HEADER_FIELDS = ("id", "user_id", "archive_id", "title", "is_open", "started_at", "ended_at")
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+# ==============================
+# Session headers (cached)
+# ==============================
+def _header_key(session_id: int) -> str:
+    return f"chat:session-header:{session_id}"
+
+
+def get_session_header(session_id: int) -> Optional[dict]:
+    """هدر سشن (بدون پیام‌ها) از کش؛ در صورت نبود، یک کوئری values() روی ChatSession."""
+    key = _header_key(session_id)
+    header = cache.get(key)
+    if header is None:
+        header = ChatSession.objects.filter(pk=session_id).values(*HEADER_FIELDS).first()
+        if header is None:
+            return None
+        cache.set(key, header, HEADER_CACHE_TTL)
+    return header
+
+
+def forget_session_headers(session_ids: Iterable[int]) -> None:
+    cache.delete_many([_header_key(pk) for pk in session_ids])
+
+
+# ==============================
+# Keyset pagination
+# ==============================
+def encode_cursor(ts: datetime, pk: int) -> str:
+    return base64.urlsafe_b64encode(f"{ts.isoformat()}|{pk}".encode()).decode()
+
+
+def decode_cursor(raw: str) -> Tuple[datetime, int]:
+    """ValueError برای cursor نامعتبر."""
+    try:
+        ts, pk = base64.urlsafe_b64decode(raw.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(ts), int(pk)
+    except Exception as exc:
+        raise ValueError("invalid cursor") from exc
+
+
+def keyset_page(qs, ts_field: str, cursor: Optional[str], limit: int) -> Tuple[List, Optional[str]]:
+    """
+    یک صفحه از qs به ترتیب (ts_field, id) نزولی؛ هزینهٔ هر صفحه مستقل از طول تاریخچه است.
+    خروجی: (ردیف‌ها، cursor صفحهٔ بعد یا None).
+    """
+    if cursor:
+        ts, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(**{f"{ts_field}__lt": ts}) | Q(**{ts_field: ts, "id__lt": pk}))
+    return _cut(list(qs.order_by(f"-{ts_field}", "-id")[: limit + 1]), ts_field, limit)
+
+
+def keyset_page_rows(rows, ts_field: str, cursor: Optional[str], limit: int) -> Tuple[List, Optional[str]]:
+    """همان keyset_page برای ردیف‌های درون حافظه (مثلاً پیام‌های بایگانی‌شده)؛ cursorها یکسان‌اند."""
+    rows = sorted(rows, key=lambda r: (getattr(r, ts_field), r.id), reverse=True)
+    if cursor:
+        ts, pk = decode_cursor(cursor)
+        rows = [r for r in rows if (getattr(r, ts_field), r.id) < (ts, pk)]
+    return _cut(rows[: limit + 1], ts_field, limit)
+
+
+def _cut(rows: List, ts_field: str, limit: int) -> Tuple[List, Optional[str]]:
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, ts_field), last.id)
+
+
+def page_size(raw) -> int:
+    try:
+        n = int(raw)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(n, MAX_PAGE_SIZE))
@@ -0,0 +1,299 @@
+# chatbot/intents.py
+# مسیریاب محلی نیت (intent) برای سؤال‌های عملیاتی اپ (اشتراک، کیف پول، نوبت ویزیت، آپدیت، پزشک آنکال)
+# که بدون فراخوانی LLM و از روی داده‌های خودمان پاسخ داده می‌شوند.
+# فقط سؤال کوتاه جواب محلی می‌گیرد. ترتیب: پیام بلند، واژهٔ پزشکی (تطبیق پیشوندی) یا شکایت/نفی ← LLM؛
+# قواعد عبارتی روی توکن کامل که جز لنگر و واژه‌های پرسشی چیزی در پیام نباشد ← مدل خطی کوچک
+# (پرسپترون میانگین‌گیری‌شده) که فقط با فاصلهٔ اطمینان کافی تصمیم می‌گیرد؛ در غیر این صورت پیام به LLM می‌رود.
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import jdatetime
+from django.utils import timezone
+
+from chatbot.utils.normalize import normalize_persian, search_tokens
+
+logger = logging.getLogger(__name__)
+
+MAX_QUERY_CHARS = 120        # سؤال‌های بلندتر تقریباً همیشه پزشکی‌اند
+MAX_LOCAL_TOKENS = 8         # پاسخ محلی فقط برای سؤال کوتاه؛ بیشتر یعنی محتوای اضافه ← LLM
+MIN_MARGIN = 2.0             # حداقل فاصلهٔ امتیاز برچسب اول و دوم در مدل خطی؛ کمتر ← LLM
+_MEDICAL = "medical"
+_EPOCHS = 10
+
+# ==============================
+# Token/phrase matching
+# ==============================
+# عبارت‌ها روی توکن کامل تطبیق داده می‌شوند (نه زیررشته): «فعال» با «فعالیت» جور نمی‌شود.
+# آخرین کلمهٔ عبارت فقط این پسوندهای محاوره‌ای/ملکی را می‌پذیرد (اشتراکم، فعاله، پولمو).
+_SUFFIXES = ("", "م", "ت", "ش", "ه", "و", "مو", "مون", "تون", "شون", "ام", "ای", "مه")
+
+
+def _phrase_positions(tokens: List[str], phrase: str) -> Set[int]:
+    """اندیس توکن‌هایی که عبارت روی آن‌ها تطبیق خورده (خالی یعنی عبارت در پیام نیست)."""
+    words = phrase.split()
+    n = len(words)
+    found: Set[int] = set()
+    for i in range(len(tokens) - n + 1):
+        if tokens[i:i + n - 1] != words[:-1]:
+            continue
+        last = tokens[i + n - 1]
+        if last.startswith(words[-1]) and last[len(words[-1]):] in _SUFFIXES:
+            found.update(range(i, i + n))
+    return found
+
+
+def _covered(tokens: List[str], phrases: Tuple[str, ...]) -> Set[int]:
+    found: Set[int] = set()
+    for phrase in phrases:
+        found |= _phrase_positions(tokens, phrase)
+    return found
+
+
+def _has_prefix(tokens: List[str], stems: Tuple[str, ...]) -> bool:
+    return any(token.startswith(stems) for token in tokens)
+
+
+# واژه‌های پزشکی: اگر در پیام باشند، پیام به LLM می‌رود (پاسخ آماده‌ی اپ برایش مناسب نیست).
+# ریشه‌ها پیشوندی تطبیق می‌خورند (واکس ← واکسن/واکسیناسیونش، غذا ← غذایی)؛ واژه‌های کوتاه که
+# پیشوندشان واژه‌های دیگر را هم می‌گیرد (تب ← تبلت) فقط به‌صورت توکن کامل.
+_MEDICAL_STEMS = (
+    "درد", "سردرد", "قرص", "دارو", "واکس", "آمپول", "تزریق", "دوز", "مصرف", "سرف", "اسهال", "استفراغ",
+    "تهوع", "فشار", "آزمایش", "سونو", "علائم", "علامت", "بیمار", "عفونت", "حساسیت", "آلرژ", "زخم",
+    "خونریز", "قلب", "تنفس", "نفس", "سرگیج", "باردار", "پریود", "قاعدگ", "خارش", "سرماخورد", "آنتی",
+    "شربت", "پماد", "کپسول", "ورزش", "خواب", "بیخواب", "استرس", "اضطراب", "افسرد", "جراح",
+    "دیابت", "انسولین", "غذا", "رژیم", "کالری", "ویتامین", "کودک", "نوزاد", "شیرده", "شیرخوار", "سرطان",
+    "تیروئید", "کلسترول", "چربی", "وزن", "مسموم", "دندان", "معده", "کبد", "کلیه", "ریه", "آسم", "میگرن",
+    "التهاب", "ویروس", "کرونا", "آنفولانزا", "پزشکی", "درمان", "تجویز",
+)
+_MEDICAL_WORDS = ("تب", "قند", "جوش", "عمل", "عکس", "شیر", "بی خوابی", "حالت تهوع", "دل درد")
+
+# شکایت، نفی یا گزارش کاری که کاربر انجام داده («آپدیت کردم ولی باز نمیشه»، «موجودی اضافه نشد»):
+# پاسخ آمادهٔ وضعیت به آن‌ها جواب نمی‌دهد ← LLM
+_COMPLAINT_STEMS = ("نمی", "نشد", "نکرد", "ندار", "نداد", "نیومد", "نیامد", "نیست", "نرسید")
+_COMPLAINT_WORDS = frozenset((
+    "ولی", "اما", "ولیکن", "چرا", "مشکل", "خطا", "ارور", "باگ", "خراب", "اشتباه", "کار", "کردم", "کرده",
+    "کردیم", "زدم", "شارژ", "اضافه", "کم", "کسر", "برگشت", "پس", "باز", "بسته", "قطع", "هنگ", "شکایت",
+))
+
+# واژه‌های پرسشی/ربطی که در کنار لنگر قاعده مجازند؛ هر توکن دیگری یعنی محتوای اضافه ← LLM
+_FILLER = frozenset((
+    "چقدر", "چقدره", "چند", "چنده", "کی", "کیه", "کیست", "کیا", "چی", "چیه", "چه", "چطور", "چطوری",
+    "چگونه", "کجا", "کجاست", "کدوم", "کدام", "آیا", "ایا", "من", "ما", "شما", "هست", "است", "هستش",
+    "داره", "دارم", "داریم", "دارید", "الان", "هنوز", "فعلا", "فعلی", "امروز", "جدید", "اومده", "آمده",
+    "اومد", "منتشر", "شده", "میشه", "میشود", "تا", "روز", "بگو", "بگید", "بگین", "لطفا", "رو", "را",
+    "از", "در", "تو", "برای", "به", "با", "و", "یا", "هلسا", "اپ", "برنامه", "اپلیکیشن", "کنم", "کنیم",
+    "بگیرم", "بگیریم", "میخوام", "میخواستم", "میتونم", "باید", "کسی", "کنید", "بدید", "بدونم", "سلام",
+))
+
+# ==============================
+# Rules
+# ==============================
+# فقط عبارت‌های خاص اپ (لنگر) قاعده را فعال می‌کنند؛ «نوبت» تنها (دفعهٔ مصرف دارو) یا «کشیک» تنها
+# (داروخانهٔ کشیک) کافی نیست.
+_RULES: List[Tuple[str, Tuple[str, ...], Tuple[str, ...]]] = [
+    # (intent, حداقل یکی از این عبارت‌ها, و حداقل یکی از این‌ها — خالی یعنی شرط دوم ندارد)
+    ("wallet_balance", ("کیف پول", "موجودی حساب", "موجودی کیف", "موجودی", "موجودی من"), ()),
+    ("subscription_status", ("اشتراک", "اشتراک من"), (
+        "تا کی", "تموم", "تمام", "وضعیت", "فعال", "باقی", "مونده", "مانده", "انقضا", "منقضی", "چند روز",
+    )),
+    ("book_visit", ("نوبت ویزیت", "وقت ویزیت", "ثبت ویزیت", "درخواست ویزیت", "ویزیت آنلاین"), ()),
+    ("book_visit", ("ویزیت",), ("بگیرم", "بگیریم", "رزرو", "ثبت کنم")),
+    ("app_update", ("آپدیت", "اپدیت", "بروزرسانی", "به روز رسانی"), ()),
+    ("app_update", ("نسخه جدید", "ورژن", "آخرین نسخه"), ("اپ", "برنامه", "اپلیکیشن", "هلسا")),
+    ("oncall_doctor", ("پزشک کشیک هلسا", "دکتر کشیک هلسا", "پزشک آنکال", "دکتر آنکال", "آنکال", "انکال"), ()),
+]
+
+
+def _is_medical(tokens: List[str]) -> bool:
+    return _has_prefix(tokens, _MEDICAL_STEMS) or bool(_covered(tokens, _MEDICAL_WORDS))
+
+
+def _is_complaint(tokens: List[str]) -> bool:
+    return _has_prefix(tokens, _COMPLAINT_STEMS) or any(t in _COMPLAINT_WORDS for t in tokens)
+
+
+def _match_rules(tokens: List[str]) -> Optional[str]:
+    for intent, first, second in _RULES:
+        anchor = _covered(tokens, first)
+        extra = _covered(tokens, second) if second else set()
+        if not anchor or (second and not extra):
+            continue
+        # لنگر پیدا شد؛ بقیهٔ پیام باید فقط واژهٔ پرسشی باشد (وگرنه سؤال چیز دیگری است ← LLM)
+        rest = [t for i, t in enumerate(tokens) if i not in anchor | extra]
+        if all(t in _FILLER for t in rest):
+            return intent
+    return None
+
+
+# ==============================
+# Linear model
+# ==============================
+_EXAMPLES: Dict[str, Tuple[str, ...]] = {
+    "wallet_balance": (
+        "چقدر پول تو حسابم دارم", "اعتبارم چقدره", "شارژ حسابم چقدر است", "مانده حسابم را بگو",
+        "چقدر اعتبار دارم", "حسابم چقدر پول داره",
+    ),
+    "subscription_status": (
+        "پلن من کی تموم میشه", "تا کی میتونم از چت استفاده کنم", "اعتبار پلنم چند روزه",
+        "پلنم هنوز فعاله", "عضویتم کی منقضی میشه", "چند روز از پلنم مونده",
+    ),
+    "book_visit": (
+        "چطور وقت دکتر بگیرم", "رزرو وقت پزشک", "چطوری تو هلسا دکتر ببینم",
+        "وقت ملاقات با دکتر میخوام", "از کجا وقت دکتر رزرو کنم", "وقت پزشک تو اپ چطوری میگیرن",
+    ),
+    "app_update": (
+        "برنامه رو چطور آپگرید کنم", "نسخه اپلیکیشن چنده", "اپ جدید اومده", "برنامه جدید منتشر شده",
+        "اپلیکیشن رو باید به روز کنم", "آخرین نسخه برنامه چیه",
+    ),
+    "oncall_doctor": (
+        "الان کدوم دکتر هلسا در دسترسه", "دکتر امروز هلسا کیه", "پزشک امروز اپ چه کسی است",
+        "کدوم پزشک هلسا الان جواب میده", "دکتر فعال الان کیه", "پزشک در دسترس اپ کیست",
+    ),
+    _MEDICAL: (
+        "سرم درد میکنه چیکار کنم", "تب دارم و بدنم درد میکنه", "این قرص رو چطور مصرف کنم",
+        "فشار خونم بالاست", "دکتر گفته آزمایش بدم جوابش چیه", "بچم سرفه میکنه", "معده ام میسوزه",
+        "دوز استامینوفن برای کودک چقدره", "جواب آزمایش خونم رو تفسیر کن", "حساسیت پوستی دارم",
+        "چند روزه اسهال دارم", "دارو رو تا کی مصرف کنم", "پزشکم گفت استراحت کنم",
+        "روزی چند نوبت دارو بخورم", "نوبت دوم واکسن کی هست", "با پزشک درباره بیماریم صحبت کنم",
+        "میخوام با پزشک صحبت کنم درباره دردم", "دکتر گفت چند نوبت بخورم", "بعد از ورزش نفسم تنگ میشه",
+        "فعالیت بدنی برای دیابت خوبه", "تا کی باید استراحت کنم", "داروخانه شبانه روزی کجاست",
+        "بیمارستان کشیک کجاست", "نوبت سونوگرافی کی باید بدم", "ضربان قلبم تند میزنه",
+        "کجا میتونم آزمایش بدم", "چطور وزن کم کنم", "چند وقت یکبار چکاپ کنم", "خوابم نمیبره چیکار کنم",
+        "پزشک متخصص پوست خوب معرفی کن", "کی باید پیش دکتر برم", "دکتر برای بچم چی تجویز میکنه",
+    ),
+}
+
+
+def _features(text: str) -> List[str]:
+    tokens = search_tokens(text)
+    return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+
+@lru_cache(maxsize=1)
+def _model() -> Dict[str, Dict[str, float]]:
+    """پرسپترون میانگین‌گیری‌شده روی _EXAMPLES؛ یک بار در هر پروسه آموزش داده می‌شود."""
+    labels = list(_EXAMPLES)
+    data = [(_features(t), label) for label in labels for t in _EXAMPLES[label]]
+    weights = {lab: defaultdict(float) for lab in labels}
+    totals = {lab: defaultdict(float) for lab in labels}
+    step = 1
+    for _ in range(_EPOCHS):
+        for feats, gold in data:
+            guess = max(labels, key=lambda lab: sum(weights[lab][f] for f in feats))
+            if guess != gold:
+                for f in feats:
+                    weights[gold][f] += 1.0
+                    weights[guess][f] -= 1.0
+                    totals[gold][f] += step
+                    totals[guess][f] -= step
+            step += 1
+    # میانگین‌گیری: w - totals/step
+    return {
+        lab: {f: w - totals[lab][f] / step for f, w in weights[lab].items() if w - totals[lab][f] / step}
+        for lab in labels
+    }
+
+
+def _classify(text: str) -> Optional[str]:
+    feats = _features(text)
+    if not feats:
+        return None
+    scores = sorted(
+        ((sum(w.get(f, 0.0) for f in feats), lab) for lab, w in _model().items()), reverse=True
+    )
+    (best, label), (second, _) = scores[0], scores[1]
+    if label == _MEDICAL or best <= 0 or best - second < MIN_MARGIN:
+        return None  # مطمئن نیستیم ← LLM
+    return label
+
+
+# ==============================
+# Answers (from our own data)
+# ==============================
+def _jalali(dt) -> str:
+    return jdatetime.datetime.fromgregorian(datetime=timezone.localtime(dt)).strftime("%Y/%m/%d")
+
+
+def _answer_wallet(user) -> str:
+    from telemedicine.models import BoxMoney
+
+    box = BoxMoney.objects.filter(user=user).only("amount").first()
+    amount = box.amount if box else 0
+    return f"موجودی کیف پول شما {amount:,} تومان است. برای افزایش موجودی از بخش کیف پول اپلیکیشن هلسا اقدام کنید."
+
+
+def _answer_subscription(user) -> str:
+    from sub.models import Subscription
+
+    sub = Subscription.objects.filter(user=user).select_related("plan").first()
+    if sub is None:
+        return "شما اشتراک فعالی ندارید. می‌توانید از بخش اشتراک در اپلیکیشن هلسا یک پلن تهیه کنید."
+    if not sub.is_active:
+        return f"اشتراک شما در تاریخ {_jalali(sub.end_date)} به پایان رسیده است. برای تمدید به بخش اشتراک بروید."
+    days = max(0, (sub.end_date - timezone.now()).days)
+    return f"اشتراک شما (پلن {sub.plan.name}) تا تاریخ {_jalali(sub.end_date)} فعال است ({days} روز باقی‌مانده)."
+
+
+def _answer_book_visit(user) -> str:
+    return (
+        "برای گرفتن نوبت ویزیت، در اپلیکیشن هلسا وارد بخش «ویزیت» شوید، شرح حال و علائم را وارد کنید "
+        "و درخواست را ثبت کنید؛ پزشک پس از بررسی با شما در ارتباط خواهد بود."
+    )
+
+
+def _answer_app_update(user) -> str:
+    from down.models import AppUpdate
+
+    update = AppUpdate.objects.only("version", "is_update_available", "force_update", "release_notes").first()
+    if update is None or not update.is_update_available:
+        return "در حال حاضر نسخهٔ جدیدی برای اپلیکیشن منتشر نشده است."
+    text = f"نسخهٔ {update.version} اپلیکیشن هلسا منتشر شده است"
+    text += " و به‌روزرسانی آن الزامی است." if update.force_update else "."
+    if update.release_notes:
+        text += f"\n{update.release_notes.strip()}"
+    return text
+
+
+def _answer_oncall(user) -> str:
+    from doctor_online.models import Doctor
+
+    doctor = Doctor.objects.filter(is_oncall=True).only("first_name", "last_name", "specialty").first()
+    if doctor is None:
+        return "در حال حاضر پزشک آنکالی ثبت نشده است؛ می‌توانید از بخش «ویزیت» درخواست خود را ثبت کنید."
+    return f"پزشک آنکال فعلی: دکتر {doctor.full_name} ({doctor.specialty})."
+
+
+ANSWERS: Dict[str, Callable] = {
+    "wallet_balance": _answer_wallet,
+    "subscription_status": _answer_subscription,
+    "book_visit": _answer_book_visit,
+    "app_update": _answer_app_update,
+    "oncall_doctor": _answer_oncall,
+}
+
+
+def detect_intent(message: str) -> Optional[str]:
+    """نیت عملیاتی پیام یا None (یعنی سؤال پزشکی/نامشخص که باید به LLM برود)."""
+    if not message or len(message) > MAX_QUERY_CHARS:
+        return None
+    text = normalize_persian(message)
+    tokens = search_tokens(text)
+    if len(tokens) > MAX_LOCAL_TOKENS or _is_medical(tokens) or _is_complaint(tokens):
+        return None
+    return _match_rules(tokens) or _classify(text)
+
+
+def answer_locally(user, message: str) -> Optional[Tuple[str, str]]:
+    """(intent، پاسخ) برای سؤال‌های عملیاتی؛ None اگر باید به LLM برود."""
+    intent = detect_intent(message)
+    if intent is None:
+        return None
+    try:
+        return intent, ANSWERS[intent](user)
+    except Exception:
+        logger.exception("Local intent answer failed (intent=%s)", intent)
+        return None
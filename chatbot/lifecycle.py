@@ -0,0 +1,59 @@
+# chatbot/lifecycle.py
+# چرخهٔ عمر سشن‌ها: بستن سشن‌های بیکار بر اساس زمان آخرین پیام با UPDATE دسته‌ای
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import List
+
+from django.conf import settings
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from chatbot.models import ChatMessage, ChatSession
+from chatbot.signals import sessions_closed
+
+IDLE_MINUTES = int(getattr(settings, "CHAT_SESSION_IDLE_MINUTES", 60))
+CLOSE_CHUNK = 500
+
+
+def _last_activity():
+    """زمان آخرین پیام سشن؛ برای سشن بدون پیام، زمان شروع."""
+    latest = (
+        ChatMessage.objects.filter(session=OuterRef("pk"))
+        .order_by("-created_at")
+        .values("created_at")[:1]
+    )
+    return Coalesce(Subquery(latest), F("started_at"))
+
+
+def idle_sessions(idle_minutes: int = IDLE_MINUTES, *, now=None):
+    cutoff = (now or timezone.now()) - timedelta(minutes=idle_minutes)
+    return (
+        ChatSession.objects.filter(is_open=True)
+        .annotate(last_activity=_last_activity())
+        .filter(last_activity__lt=cutoff)
+    )
+
+
+def close_sessions(qs) -> List[int]:
+    """
+    سشن‌های باز qs را در دسته‌های CLOSE_CHUNK تایی با یک UPDATE می‌بندد؛ ended_at برابر
+    زمان آخرین پیام هر سشن می‌شود. در پایان سیگنال sessions_closed ارسال می‌شود.
+    """
+    # شناسه‌ها را اول کامل می‌خوانیم؛ آپدیتِ همان جدول حین پیمایش cursor امن نیست
+    ids = list(qs.filter(is_open=True).order_by().values_list("id", flat=True))
+    for i in range(0, len(ids), CLOSE_CHUNK):
+        ChatSession.objects.filter(pk__in=ids[i:i + CLOSE_CHUNK], is_open=True).update(
+            is_open=False, ended_at=_last_activity()
+        )
+    if ids:
+        sessions_closed.send(sender=ChatSession, session_ids=ids)
+    return ids
+
+
+def close_idle_sessions(idle_minutes: int = IDLE_MINUTES, *, user=None, now=None) -> List[int]:
+    qs = idle_sessions(idle_minutes, now=now)
+    if user is not None:
+        qs = qs.filter(user=user)
+    return close_sessions(qs)
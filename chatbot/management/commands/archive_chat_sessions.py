@@ -0,0 +1,46 @@
+# ==============================
+# chatbot/management/commands/archive_chat_sessions.py
+# ==============================
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.archive import ARCHIVE_AFTER_DAYS, archivable_sessions, archive_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        "انتقال پیام‌های سشن‌هایی که بیش از --days روز بسته بوده‌اند به بایگانی فشرده (gzip JSONL) "
+        "برای هر کاربر و حذف آن‌ها از جدول ChatMessage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=ARCHIVE_AFTER_DAYS,
+            help=f"حداقل عمر سشن بسته (روز) از ended_at؛ پیش‌فرض: {ARCHIVE_AFTER_DAYS}.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="فقط شمارش/نمایش؛ تغییری روی دیتابیس اعمال نمی‌شود.",
+        )
+
+    def handle(self, *args, **options):
+        days = options["days"]
+        if days <= 0:
+            raise CommandError("--days باید بزرگ‌تر از صفر باشد.")
+
+        qs = archivable_sessions(days)
+        if options["dry_run"]:
+            self.stdout.write(
+                self.style.NOTICE(f"[DRY-RUN] {qs.count()} سشن قدیمی‌تر از {days} روز برای بایگانی یافت شد.")
+            )
+            return
+
+        stats = archive_sessions(qs)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {stats['messages']} messages from {stats['sessions']} sessions "
+                f"into {stats['archives']} archives."
+            )
+        )
@@ -0,0 +1,43 @@
+# ==============================
+# chatbot/management/commands/backfill_chat_search.py
+# ==============================
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.models import ChatMessage
+from chatbot.search import ensure_search_index
+from chatbot.utils.normalize import normalize_persian
+
+
+class Command(BaseCommand):
+    help = "ساخت ایندکس تمام‌متن پیام‌ها و پر کردن search_text برای پیام‌های قدیمی (دسته‌ای)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="تعداد ردیف در هر دسته (پیش‌فرض: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size <= 0:
+            raise CommandError("--batch-size باید بزرگ‌تر از صفر باشد.")
+
+        if not ensure_search_index():
+            self.stdout.write(self.style.WARNING("این بک‌اند ایندکس تمام‌متن ندارد؛ فقط search_text پر می‌شود."))
+
+        qs = ChatMessage.objects.filter(search_text="").exclude(message="").order_by("pk")
+        done = 0
+        last_pk = 0
+        while True:
+            batch = list(qs.filter(pk__gt=last_pk).only("id", "message")[:batch_size])
+            if not batch:
+                break
+            for m in batch:
+                m.search_text = normalize_persian(m.message)
+            ChatMessage.objects.bulk_update(batch, ["search_text"])
+            done += len(batch)
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {done} messages."))
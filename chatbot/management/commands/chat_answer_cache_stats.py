@@ -0,0 +1,20 @@
+# ==============================
+# chatbot/management/commands/chat_answer_cache_stats.py
+# ==============================
+from django.core.management.base import BaseCommand
+
+from chatbot.answer_cache import stats
+
+
+class Command(BaseCommand):
+    help = "گزارش کش پاسخ نوبت‌های بی‌زمینه: تعداد hit/miss و زمان و توکن صرفه‌جویی‌شده."
+
+    def handle(self, *args, **options):
+        s = stats()
+        lookups = s["hits"] + s["misses"]
+        rate = 100 * s["hits"] / lookups if lookups else 0.0
+        avg_ms = s["saved_ms"] / s["hits"] if s["hits"] else 0
+        self.stdout.write(
+            f"hits={s['hits']} (near={s['near_hits']}) misses={s['misses']} hit_rate={rate:.1f}%\n"
+            f"saved: {s['saved_ms'] / 1000:.1f}s total (~{avg_ms:.0f}ms per hit), {s['saved_tokens']} tokens"
+        )
@@ -2,22 +2,24 @@
 # chatbot/management/commands/close_open_sessions.py
 # ==============================
 from django.core.management.base import BaseCommand, CommandError
-from django.utils import timezone
 from django.contrib.auth import get_user_model
-from chatbot.models import ChatSession
+from chatbot.lifecycle import IDLE_MINUTES, close_sessions, idle_sessions
 
 User = get_user_model()
 
 
 class Command(BaseCommand):
-    help = "بستن همه‌ی سشن‌های باز قدیمی‌تر از --hours (پیش‌فرض: 12)."
+    help = (
+        "بستن سشن‌های بازی که بیش از --idle-minutes از آخرین پیامشان گذشته است. "
+        "خلاصهٔ نهایی سشن‌ها با سیگنال sessions_closed ساخته می‌شود."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument(
-            "--hours",
+            "--idle-minutes",
             type=int,
-            default=12,
-            help="حداکثر سن سشن (ساعت) برای باز ماندن؛ قدیمی‌تر از این بسته می‌شود.",
+            default=IDLE_MINUTES,
+            help=f"حداکثر زمان بیکاری سشن (دقیقه) از آخرین پیام؛ پیش‌فرض: {IDLE_MINUTES}.",
         )
         parser.add_argument(
             "--dry-run",
@@ -31,49 +33,34 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
-        hours = options["hours"]
+        idle_minutes = options["idle_minutes"]
         dry_run = options["dry_run"]
         username = options.get("username")
 
-        if hours <= 0:
-            raise CommandError("--hours باید بزرگ‌تر از صفر باشد.")
+        if idle_minutes <= 0:
+            raise CommandError("--idle-minutes باید بزرگ‌تر از صفر باشد.")
 
-        user = None
+        qs = idle_sessions(idle_minutes)
         if username:
             try:
-                user = User.objects.get(username=username)
+                qs = qs.filter(user=User.objects.get(username=username))
             except User.DoesNotExist:
                 raise CommandError(f"کاربری با username='{username}' یافت نشد.")
 
-        cutoff = timezone.now() - timezone.timedelta(hours=hours)
-        qs = ChatSession.objects.filter(is_open=True, started_at__lt=cutoff)
-        if user:
-            qs = qs.filter(user=user)
-
-        total = qs.count()
-        if total == 0:
-            scope = f"کاربر '{username}'" if user else "همهٔ کاربران"
-            self.stdout.write(self.style.WARNING(f"هیچ سشنِ بازِ قدیمی برای {scope} پیدا نشد."))
-            return
-
         if dry_run:
             self.stdout.write(
                 self.style.NOTICE(
-                    f"[DRY-RUN] {total} سشن باز قدیمی‌تر از {hours} ساعت یافت شد؛ تغییری اعمال نشد."
+                    f"[DRY-RUN] {qs.count()} سشن باز بیکارتر از {idle_minutes} دقیقه یافت شد؛ تغییری اعمال نشد."
                 )
             )
             return
 
-        closed = 0
-        for s in qs.iterator():
-            try:
-                s.end(cutoff)
-                closed += 1
-            except Exception as e:
-                self.stderr.write(self.style.ERROR(f"خطا در بستن سشن #{s.pk}: {e}"))
+        closed = close_sessions(qs)
+        if not closed:
+            scope = f"کاربر '{username}'" if username else "همهٔ کاربران"
+            self.stdout.write(self.style.WARNING(f"هیچ سشنِ بازِ بیکاری برای {scope} پیدا نشد."))
+            return
 
         self.stdout.write(
-            self.style.SUCCESS(
-                f"Closed {closed} sessions (older than {hours}h; cutoff={cutoff.isoformat()})."
-            )
-        )
\ No newline at end of file
+            self.style.SUCCESS(f"Closed {len(closed)} sessions (idle > {idle_minutes} min).")
+        )
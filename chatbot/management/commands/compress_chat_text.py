@@ -0,0 +1,206 @@
+# ==============================
+# chatbot/management/commands/compress_chat_text.py
+# ==============================
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from django.db.models import BinaryField, ExpressionWrapper, F
+
+from chatbot.fields import MAGIC, compress_text, decompress_text
+from chatbot.models import ChatMessage, ChatSummary
+
+# ChatMessage.message فشرده نمی‌شود: search_text کنارش کپی کامل متن است و صرفه‌ای نمی‌ماند
+TARGETS = (
+    (ChatSummary, ("raw_text", "rewritten_text")),
+)
+# ستون‌های فشرده‌نشده‌ای که در همان ردیف کنار ستون فشرده ذخیره می‌شوند؛
+# صرفه‌جویی واقعی فقط با احتساب این‌ها (کل ردیف) معنا دارد.
+COMPANIONS = {
+    ChatSummary: ("structured_json",),
+}
+
+
+def _raw(field_name):
+    # مقدار خام ستون، بدون from_db_value
+    return ExpressionWrapper(F(field_name), output_field=BinaryField())
+
+
+def _is_legacy(raw) -> bool:
+    if raw is None:
+        return False
+    if isinstance(raw, str):  # SQLite: مقدار TEXT قدیمی در ستون BLOB
+        return True
+    return not bytes(raw).startswith(MAGIC)
+
+
+def _text_bytes(value) -> int:
+    if not value:
+        return 0
+    if not isinstance(value, str):
+        value = json.dumps(value, ensure_ascii=False)
+    return len(value.encode("utf-8"))
+
+
+class Command(BaseCommand):
+    help = (
+        "فشرده‌سازی دسته‌ای ردیف‌های قدیمی (UTF-8 خام) در ستون‌های CompressedTextField "
+        "(ChatSummary.raw_text/rewritten_text). "
+        "با --benchmark فقط نسبت فشرده‌سازی، اندازهٔ کل ردیف (با ستون‌های کناری مثل structured_json)، "
+        "اندازهٔ جدول و هزینهٔ CPU روی نمونهٔ واقعی گزارش می‌شود. "
+        "--restore-messages پیام‌هایی را که قبلاً فشرده شده‌اند به متن ساده برمی‌گرداند."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="تعداد ردیف در هر دسته (پیش‌فرض: 1000).",
+        )
+        parser.add_argument(
+            "--benchmark",
+            action="store_true",
+            help="بدون تغییر دیتابیس، روی --sample ردیف آخر هر ستون اندازه و زمان را می‌سنجد.",
+        )
+        parser.add_argument(
+            "--sample",
+            type=int,
+            default=2000,
+            help="تعداد ردیف نمونه برای --benchmark (پیش‌فرض: 2000).",
+        )
+        parser.add_argument(
+            "--restore-messages",
+            action="store_true",
+            help="برگرداندن ChatMessage.message فشرده به UTF-8 ساده (پیش از تغییر نوع ستون به متن).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size <= 0 or options["sample"] <= 0:
+            raise CommandError("--batch-size و --sample باید بزرگ‌تر از صفر باشند.")
+
+        if options["restore_messages"]:
+            self._restore(ChatMessage, "message", batch_size)
+            return
+
+        for model, fields in TARGETS:
+            if options["benchmark"]:
+                self._benchmark(model, fields, options["sample"])
+                continue
+            for name in fields:
+                self._convert(model, name, batch_size)
+
+    # ------------------------------------------------------------------
+    def _convert(self, model, name, batch_size):
+        label = f"{model.__name__}.{name}"
+        converted = before = after = 0
+        last_pk = 0
+        qs = model.objects.annotate(_raw=_raw(name)).order_by("pk")
+        while True:
+            rows = list(qs.filter(pk__gt=last_pk).values_list("pk", "_raw")[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            batch = []
+            for pk, raw in rows:
+                if not _is_legacy(raw):
+                    continue
+                text = decompress_text(raw)
+                before += len(text.encode("utf-8"))
+                after += len(compress_text(text))
+                batch.append(model(pk=pk, **{name: text}))
+            if batch:
+                model.objects.bulk_update(batch, [name])
+                converted += len(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"{label}: converted {converted} rows ({before} -> {after} bytes).")
+        )
+
+    def _restore(self, model, name, batch_size):
+        label = f"{model.__name__}.{name}"
+        restored = 0
+        last_pk = 0
+        qs = model.objects.annotate(_raw=_raw(name)).order_by("pk")
+        while True:
+            rows = list(qs.filter(pk__gt=last_pk).values_list("pk", "_raw")[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+            batch = [
+                model(pk=pk, **{name: decompress_text(raw)})
+                for pk, raw in rows
+                if raw is not None and not isinstance(raw, str) and bytes(raw).startswith(MAGIC)
+            ]
+            if batch:
+                model.objects.bulk_update(batch, [name])
+                restored += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"{label}: restored {restored} compressed rows to plain text."))
+
+    def _benchmark(self, model, fields, sample):
+        companions = COMPANIONS.get(model, ())
+        rows = list(model.objects.order_by("-pk").values_list(*fields, *companions)[:sample])
+        if not rows:
+            self.stdout.write(self.style.WARNING(f"{model.__name__}: no rows to sample."))
+            return
+        n = len(rows)
+
+        raw_total = stored_total = 0
+        for i, name in enumerate(fields):
+            texts = [r[i] for r in rows if r[i]]
+            if not texts:
+                continue
+            t0 = time.perf_counter()
+            packed = [compress_text(t) for t in texts]
+            t1 = time.perf_counter()
+            for p in packed:
+                decompress_text(p)
+            t2 = time.perf_counter()
+            raw_bytes = sum(len(t.encode("utf-8")) for t in texts)
+            stored = sum(len(p) for p in packed)
+            raw_total += raw_bytes
+            stored_total += stored
+            self.stdout.write(
+                f"{model.__name__}.{name}: rows={len(texts)} raw={raw_bytes}B stored={stored}B "
+                f"column_saved={100 * (1 - stored / raw_bytes):.1f}% "
+                f"write={1e6 * (t1 - t0) / len(texts):.1f}us/row read={1e6 * (t2 - t1) / len(texts):.1f}us/row"
+            )
+
+        # کل ردیف: ستون‌های فشرده + ستون‌های متنی کناری که فشرده نمی‌شوند
+        extra = sum(_text_bytes(r[len(fields) + j]) for r in rows for j in range(len(companions)))
+        before, after = raw_total + extra, stored_total + extra
+        if before:
+            note = f" (includes {extra}B uncompressed {'/'.join(companions)})" if companions else ""
+            self.stdout.write(
+                f"{model.__name__} row text: rows={n} uncompressed={before}B stored={after}B "
+                f"row_saved={100 * (1 - after / before):.1f}%{note}"
+            )
+        size = _table_bytes(model)
+        if size is not None:
+            self.stdout.write(f"{model.__name__} table on disk (data+indexes): {size}B")
+
+
+def _table_bytes(model):
+    """اندازهٔ واقعی جدول (داده + ایندکس‌ها) در صورت پشتیبانی بک‌اند؛ وگرنه None."""
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cur:
+            if connection.vendor == "mysql":
+                cur.execute(
+                    "SELECT data_length + index_length FROM information_schema.tables "
+                    "WHERE table_schema = DATABASE() AND table_name = %s",
+                    [table],
+                )
+            elif connection.vendor == "postgresql":
+                cur.execute("SELECT pg_total_relation_size(%s)", [table])
+            elif connection.vendor == "sqlite":
+                cur.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = %s", [table])
+            else:
+                return None
+            row = cur.fetchone()
+    except DatabaseError:  # مثلاً SQLite بدون ماژول dbstat
+        return None
+    return int(row[0]) if row and row[0] is not None else None
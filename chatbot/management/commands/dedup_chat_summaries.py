@@ -0,0 +1,51 @@
+# ==============================
+# chatbot/management/commands/dedup_chat_summaries.py
+# ==============================
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+
+from chatbot.models import ChatSummary
+
+
+class Command(BaseCommand):
+    help = (
+        "پر کردن ستون scope و حذف خلاصه‌های تکراری (user, session) با نگه‌داشتن جدیدترین. "
+        "پیش از اعمال مایگریشنِ قید یکتای (user, scope) در ChatSummary اجرا شود."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="فقط شمارش/نمایش؛ تغییری روی دیتابیس اعمال نمی‌شود.",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+
+        # ردیف‌های قدیمی پیش از افزودن ستون scope (همه با مقدار پیش‌فرض 0)
+        stale = ChatSummary.objects.filter(session__isnull=False).exclude(scope=F("session_id"))
+        backfilled = stale.count() if dry_run else stale.update(scope=F("session_id"))
+
+        groups = (
+            ChatSummary.objects.values("user_id", "session_id")
+            .annotate(n=Count("id"))
+            .filter(n__gt=1)
+        )
+
+        deleted = 0
+        for g in groups.iterator():
+            ids = list(
+                ChatSummary.objects.filter(user_id=g["user_id"], session_id=g["session_id"])
+                .order_by("-updated_at", "-id")
+                .values_list("id", flat=True)
+            )
+            extra = ids[1:]
+            if not dry_run:
+                ChatSummary.objects.filter(id__in=extra).delete()
+            deleted += len(extra)
+
+        prefix = "[DRY-RUN] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Backfilled scope on {backfilled} summaries; removed {deleted} duplicate summaries."
+        ))
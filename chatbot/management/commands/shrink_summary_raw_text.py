@@ -0,0 +1,77 @@
+# ==============================
+# chatbot/management/commands/shrink_summary_raw_text.py
+# ==============================
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.models import ChatSummary
+from chatbot.utils.text_summary import infer_message_range, raw_text_digest
+
+
+class Command(BaseCommand):
+    help = (
+        "خالی کردن raw_text در ردیف‌های قدیمی ChatSummary به‌صورت دسته‌ای؛ "
+        "پیش از حذف، بازهٔ پیام‌ها (first/last_message_id) پیدا و با بازسازی متن سنجیده می‌شود "
+        "و طول و هش متن در raw_chars/raw_sha256 نگه داشته می‌شود. ردیف‌هایی که بازه‌شان پیدا نشود دست نمی‌خورند."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="تعداد ردیف در هر دسته (پیش‌فرض: 500).",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="فقط شمارش/نمایش؛ تغییری روی دیتابیس اعمال نمی‌شود.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+
+        if batch_size <= 0:
+            raise CommandError("--batch-size باید بزرگ‌تر از صفر باشد.")
+
+        qs = ChatSummary.objects.exclude(raw_text="").order_by("pk")
+        if dry_run:
+            self.stdout.write(self.style.NOTICE(f"[DRY-RUN] {qs.count()} خلاصه با raw_text پر یافت شد."))
+            return
+
+        shrunk = 0
+        freed = 0
+        skipped = []
+        last_pk = 0
+        fields = ["raw_text", "raw_chars", "raw_sha256", "first_message_id", "last_message_id", "raw_layout"]
+        while True:
+            batch = list(
+                qs.filter(pk__gt=last_pk)
+                .only("id", "user_id", "session_id", "updated_at", "raw_text", *fields[3:])[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            ready = []
+            for obj in batch:
+                if obj.first_message_id is None or obj.last_message_id is None:
+                    found = infer_message_range(obj)
+                    if found is None:
+                        # بدون بازه، متن دیگر قابل بازسازی نیست؛ raw_text نگه داشته می‌شود
+                        skipped.append(obj.pk)
+                        continue
+                    obj.first_message_id, obj.last_message_id, obj.raw_layout = found
+                freed += len(obj.raw_text)
+                obj.raw_chars = len(obj.raw_text)
+                obj.raw_sha256 = raw_text_digest(obj.raw_text)
+                obj.raw_text = ""
+                ready.append(obj)
+            ChatSummary.objects.bulk_update(ready, fields)
+            shrunk += len(ready)
+
+        self.stdout.write(self.style.SUCCESS(f"Shrunk {shrunk} summaries ({freed} chars freed)."))
+        if skipped:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped {len(skipped)} summaries whose message range could not be determined: "
+                + ", ".join(map(str, skipped))
+            ))
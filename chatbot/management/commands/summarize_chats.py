@@ -1,12 +1,47 @@
 # ==============================
 # chatbot/management/commands/summarize_chats.py
 # ==============================
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.cache import cache
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
-from chatbot.utils.text_summary import summarize_user_chats
+from django.db import connection
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from chatbot.models import ChatSession, ChatSummary
+from chatbot.utils.text_summary import (
+    sessions_needing_summary,
+    summarize_sessions_batch,
+    summarize_user_chats,
+    users_with_new_messages,
+)
 
 User = get_user_model()
 
+# زمان شروع آخرین اجرای --all --full که تمام نشده؛ اجرای بعدی از همان‌جا ادامه می‌دهد
+FULL_RUN_CHECKPOINT_KEY = "summarize_chats:full_run_started"
+
+
+def _summarize_one(user, limit, full):
+    try:
+        summarize_user_chats(user, limit_sessions=limit, full=full)
+        return "ok", None
+    except ValueError as e:
+        return "no_data", e
+    except Exception as e:
+        return "failed", e
+
+
+def _summarize_in_thread(user, limit, full):
+    try:
+        return _summarize_one(user, limit, full)
+    finally:
+        # هر thread کانکشن مخصوص خودش را دارد؛ نگذاریم باز بماند
+        connection.close()
+
 
 class Command(BaseCommand):
     help = (
@@ -24,13 +59,29 @@ class Command(BaseCommand):
             "--limit",
             type=int,
             default=None,
-            help="محدود کردن به N سشن آخر (اختیاری).",
+            help="محدود کردن به N سشن آخر (اختیاری؛ به معنای بازسازی کامل است).",
         )
         parser.add_argument(
             "--all",
             action="store_true",
             dest="for_all",
-            help="خلاصه‌سازی برای همهٔ کاربران فعال.",
+            help="خلاصه‌سازی برای کاربران فعالی که از آخرین خلاصه پیام جدید دارند (فعال‌ترها اول).",
+        )
+        parser.add_argument(
+            "--sessions",
+            action="store_true",
+            help="پیش از خلاصهٔ سراسری، خلاصهٔ سشن‌های بستهٔ عقب‌مانده را در حالت batch بساز (فقط با --all).",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="بازسازی کامل از کل تاریخچه به‌جای به‌روزرسانی افزایشی (فقط پیام‌های جدید).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=int(getattr(settings, "SUMMARY_NIGHTLY_WORKERS", 4)),
+            help="حداکثر تعداد خلاصه‌سازی هم‌زمان در حالت --all (سقف سراسری فراخوانی‌های LLM).",
         )
         parser.add_argument(
             "--model",
@@ -42,6 +93,7 @@ class Command(BaseCommand):
         username = options.get("username")
         limit = options.get("limit")
         for_all = options.get("for_all")
+        full = options.get("full")
 
         if for_all and username:
             raise CommandError("یا username بده یا --all؛ هر دو با هم قابل استفاده نیستند.")
@@ -53,33 +105,12 @@ class Command(BaseCommand):
             raise CommandError("--limit باید مثبت باشد.")
 
         if for_all:
-            qs = User.objects.filter(is_active=True).only("id", "username")
-            total = qs.count()
-            if total == 0:
-                self.stdout.write(self.style.WARNING("هیچ کاربر فعالی یافت نشد."))
-                return
-
-            summarized = 0
-            skipped_no_data = 0
-            failed = 0
-
-            for u in qs.iterator():
-                try:
-                    summarize_user_chats(u, limit_sessions=limit)
-                    summarized += 1
-                except ValueError as e:
-                    skipped_no_data += 1
-                    self.stdout.write(self.style.WARNING(f"'{u.username}': {e}"))
-                except Exception as e:
-                    failed += 1
-                    self.stderr.write(self.style.ERROR(f"خطا برای کاربر '{u.username}': {e}"))
-
-            msg = f"خلاصه‌سازی موفق برای {summarized} کاربر."
-            if skipped_no_data:
-                msg += f" (بدون داده: {skipped_no_data})"
-            if failed:
-                msg += f" (ناموفق: {failed})"
-            self.stdout.write(self.style.SUCCESS(msg))
+            workers = options.get("workers")
+            if workers <= 0:
+                raise CommandError("--workers باید بزرگ‌تر از صفر باشد.")
+            if options.get("sessions"):
+                self._summarize_closed_sessions()
+            self._summarize_all(limit=limit, full=full, workers=workers)
             return
 
         # حالت تک‌کاربره
@@ -89,7 +120,7 @@ class Command(BaseCommand):
             raise CommandError(f"کاربری با username='{username}' یافت نشد.")
 
         try:
-            summary = summarize_user_chats(user, limit_sessions=limit)
+            summary = summarize_user_chats(user, limit_sessions=limit, full=full)
         except ValueError as e:
             self.stdout.write(self.style.WARNING(f"{e}"))
             return
@@ -100,4 +131,80 @@ class Command(BaseCommand):
         if pk:
             self.stdout.write(self.style.SUCCESS(f"Summary #{pk} برای کاربر '{username}' ایجاد/به‌روزرسانی شد."))
         else:
-            self.stdout.write(self.style.SUCCESS(f"خلاصه برای کاربر '{username}' ایجاد/به‌روزرسانی شد."))
\ No newline at end of file
+            self.stdout.write(self.style.SUCCESS(f"خلاصه برای کاربر '{username}' ایجاد/به‌روزرسانی شد."))
+
+    # ------------------------------------------------------------------
+    def _summarize_closed_sessions(self):
+        ids = sessions_needing_summary(ChatSession.objects.filter(is_open=False)).values_list("id", flat=True)
+        stats = summarize_sessions_batch(ids.iterator())
+        self.stdout.write(
+            f"Session summaries: packed={stats['packed']}, single={stats['single']}, requests={stats['requests']}."
+        )
+
+    def _candidates(self, full):
+        """
+        حالت عادی: فقط کاربرانی که پیامی جدیدتر از خلاصهٔ سراسری دارند؛ خودِ همین شرط
+        نقطهٔ بازیابی است و اجرای دوباره پس از crash فقط باقی‌مانده‌ها را برمی‌دارد.
+        حالت --full: همهٔ کاربران دارای پیام، منهای آن‌هایی که از شروع اجرای ناتمام قبلی
+        خلاصه‌شان نوشته شده است.
+        """
+        if not full:
+            return users_with_new_messages().only("id", "username")
+
+        started = cache.get(FULL_RUN_CHECKPOINT_KEY)
+        if started is None:
+            started = timezone.now()
+            cache.set(FULL_RUN_CHECKPOINT_KEY, started, timeout=None)
+        else:
+            self.stdout.write(self.style.NOTICE(f"ادامهٔ اجرای --full از {started.isoformat()}"))
+
+        done = ChatSummary.objects.filter(user=OuterRef("pk"), session__isnull=True, updated_at__gte=started)
+        return (
+            User.objects.filter(is_active=True)
+            .annotate(newest_msg=Max("chatmessage__id"))
+            .filter(newest_msg__isnull=False)
+            .exclude(Exists(done))
+            .order_by("-newest_msg")
+            .only("id", "username")
+        )
+
+    def _summarize_all(self, *, limit, full, workers):
+        counts = {"ok": 0, "no_data": 0, "failed": 0}
+
+        def report(u, outcome, err):
+            counts[outcome] += 1
+            if outcome == "no_data":
+                self.stdout.write(self.style.WARNING(f"'{u.username}': {err}"))
+            elif outcome == "failed":
+                self.stderr.write(self.style.ERROR(f"خطا برای کاربر '{u.username}': {err}"))
+
+        users = self._candidates(full)
+        if workers == 1:
+            for u in users.iterator():
+                report(u, *_summarize_one(u, limit, full))
+        else:
+            # حداکثر workers*2 کار در صف تا کل لیست کاربران در حافظه نماند
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                inflight = {}
+                for u in users.iterator():
+                    inflight[pool.submit(_summarize_in_thread, u, limit, full)] = u
+                    if len(inflight) >= workers * 2:
+                        finished, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                        for f in finished:
+                            report(inflight.pop(f), *f.result())
+                for f in wait(inflight).done:
+                    report(inflight.pop(f), *f.result())
+
+        if full:
+            cache.delete(FULL_RUN_CHECKPOINT_KEY)
+
+        if not any(counts.values()):
+            self.stdout.write(self.style.WARNING("هیچ کاربری پیام جدیدی برای خلاصه‌سازی ندارد."))
+            return
+
+        msg = f"خلاصه‌سازی موفق برای {counts['ok']} کاربر."
+        if counts["no_data"]:
+            msg += f" (بدون داده: {counts['no_data']})"
+        if counts["failed"]:
+            msg += f" (ناموفق: {counts['failed']})"
+        self.stdout.write(self.style.SUCCESS(msg))
@@ -3,12 +3,39 @@
 # ==============================
 # models.py
 # ==============================
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
+from chatbot.fields import CompressedTextField
+from chatbot.signals import sessions_closed
+from chatbot.utils.normalize import normalize_persian
+
 User = get_user_model()
 
+class ChatArchive(models.Model):
+    """Cold-storage blob: messages of a user's long-closed sessions as gzip-compressed JSONL."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chat_archives")
+    blob = models.FileField(upload_to="chat_archive/%Y/%m/")
+    codec = models.CharField(max_length=16, default="gzip")
+    session_count = models.PositiveIntegerField(default=0)
+    message_count = models.PositiveIntegerField(default=0)
+    raw_bytes = models.PositiveBigIntegerField(default=0, help_text="Uncompressed JSONL size.")
+    # بازهٔ id پیام‌های فایل؛ خواندن «جدیدترین‌ها» بدون باز کردن همهٔ فایل‌ها (chatbot.archive)
+    first_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = "Chat archive"
+        verbose_name_plural = "Chat archives"
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"Archive #{self.pk} – {self.user} ({self.session_count} sessions)"
+
+
 class ChatSession(models.Model):
     """Represents a logical conversation ("session") between a user and the bot."""
 
@@ -17,11 +44,19 @@ class ChatSession(models.Model):
     started_at = models.DateTimeField(default=timezone.now)
     ended_at = models.DateTimeField(null=True, blank=True)
     is_open = models.BooleanField(default=True)
+    # پیام‌های سشن‌های بایگانی‌شده در ChatArchive هستند، نه در ChatMessage (chatbot.archive)
+    archive = models.ForeignKey(
+        ChatArchive, null=True, blank=True, on_delete=models.SET_NULL, related_name="sessions"
+    )
 
     class Meta:
         ordering = ["-started_at"]
         verbose_name = "Chat session"
         verbose_name_plural = "Chat sessions"
+        indexes = [
+            # صفحه‌بندی keyset تاریخچه روی (started_at, id)
+            models.Index(fields=["user", "-started_at", "-id"], name="chatsession_user_started_idx"),
+        ]
 
     def __str__(self) -> str:  # pragma: no cover
         status = "open" if self.is_open else "closed"
@@ -29,12 +64,27 @@ class ChatSession(models.Model):
 
     # ------------------------------------------------------------------
     def end(self, when: timezone.datetime | None = None) -> None:
-        """Mark session as ended (idempotent)."""
+        """Mark session as ended (idempotent) and emit ``sessions_closed``."""
         if not self.is_open:
             return
         self.is_open = False
         self.ended_at = when or timezone.now()
         self.save(update_fields=["is_open", "ended_at"])
+        sessions_closed.send(sender=ChatSession, session_ids=[self.pk])
+
+
+class ChatMessageQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create از save() رد می‌شود؛ متن ایندکس جستجو را همین‌جا پر کن
+        objs = list(objs)
+        for obj in objs:
+            obj.search_text = normalize_persian(obj.message)
+        created = super().bulk_create(objs, *args, **kwargs)
+        # ایندکس BM25 بازیابی نوبت‌های گذشته (chatbot.retrieval) پس از commit به‌روز می‌شود
+        from chatbot.retrieval import index_messages
+
+        transaction.on_commit(lambda: index_messages(created), using=self.db)
+        return created
 
 
 class ChatMessage(models.Model):
@@ -43,13 +93,31 @@ class ChatMessage(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name="messages")
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     is_bot = models.BooleanField(default=False)
+    # متن ساده (نه CompressedTextField): search_text کنارش کپی کامل پیام است و فشرده‌سازی یکی از
+    # دو ستون صرفه‌ای نمی‌داد، ولی ستون را برای دیتابیس BLOB ناخوانا می‌کرد.
+    # مایگریشن: پیش از برگرداندن نوع ستون به متن، compress_chat_text --restore-messages را اجرا کنید.
     message = models.TextField()
+    # نسخهٔ یکسان‌سازی‌شدهٔ message برای ایندکس تمام‌متن (chatbot.search)
+    search_text = models.TextField(blank=True, default="", editable=False)
     created_at = models.DateTimeField(default=timezone.now)
 
+    objects = ChatMessageQuerySet.as_manager()
+
     class Meta:
         ordering = ["created_at"]
         verbose_name = "Chat message"
         verbose_name_plural = "Chat messages"
+        indexes = [
+            # صفحه‌بندی keyset پیام‌های یک سشن روی (created_at, id)
+            models.Index(fields=["session", "-created_at", "-id"], name="chatmsg_session_created_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.search_text = normalize_persian(self.message)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "message" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "search_text"}
+        super().save(*args, **kwargs)
 
     def __str__(self) -> str:  # pragma: no cover
         role = "BOT" if self.is_bot else "USER"
@@ -59,22 +127,70 @@ class ChatMessage(models.Model):
 class ChatSummary(models.Model):
     """Stores AI-generated rewrites / summaries of one session or the whole history."""
 
+    LAYOUT_BY_ID = "by_id"
+    LAYOUT_SESSIONS = "sessions"
+    LAYOUT_CHOICES = [
+        (LAYOUT_BY_ID, "Messages by id"),
+        # ردیف‌های سراسری قدیمی: جدیدترین سشن اول، پیام‌های هر سشن به ترتیب زمان
+        (LAYOUT_SESSIONS, "Legacy: newest session first"),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chat_summaries")
-    session = models.ForeignKey(ChatSession, null=True, blank=True, on_delete=models.SET_NULL, related_name="summaries")
+    session = models.ForeignKey(ChatSession, null=True, blank=True, on_delete=models.CASCADE, related_name="summaries")
+    # session_id یا 0 برای خلاصهٔ سراسری؛ قید یکتای (user, scope) روی MySQL هم اعمال می‌شود
+    # (MySQL قید یکتای شرطی روی session=NULL را پشتیبانی نمی‌کند)
+    scope = models.BigIntegerField(default=0, editable=False, help_text="Session id, or 0 for the global summary.")
 
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=0, help_text="Bumped on every refresh; used for optimistic writes.")
 
     model_used = models.CharField(max_length=32, default="zarin-1.0")
 
-    raw_text = models.TextField(help_text="Full concatenated conversation text sent to rewriter API.")
-    rewritten_text = models.TextField(help_text="Output produced by rewriter API.")
+    raw_text = CompressedTextField(
+        blank=True, default="",
+        help_text="Legacy copy of the text sent to rewriter API; new rows keep only the pointers below.",
+    )
+    rewritten_text = CompressedTextField(help_text="Output produced by rewriter API.")
     structured_json = models.JSONField(default=dict, blank=True)
 
+    # بازهٔ پیام‌هایی که متن ورودی از روی آن‌ها ساخته شد (قابل بازسازی از ChatMessage)
+    first_message_id = models.BigIntegerField(
+        null=True, blank=True, help_text="Oldest ChatMessage id in the text sent to rewriter API."
+    )
+    last_message_id = models.BigIntegerField(
+        null=True, blank=True, help_text="Newest ChatMessage id folded into this summary (for delta refresh)."
+    )
+    raw_chars = models.PositiveIntegerField(default=0, help_text="Length of the text sent to rewriter API.")
+    raw_sha256 = models.CharField(max_length=64, blank=True, default="")
+    raw_layout = models.CharField(
+        max_length=16, choices=LAYOUT_CHOICES, default=LAYOUT_BY_ID,
+        help_text="Message order used to rebuild the text sent to rewriter API.",
+    )
+
     class Meta:
         ordering = ["-updated_at"]
         verbose_name = "Chat summary"
         verbose_name_plural = "Chat summaries"
+        constraints = [
+            # یک خلاصه برای هر سشن و فقط یک خلاصهٔ سراسری (scope=0) برای هر کاربر.
+            # مایگریشن: ستون scope را بدون قید اضافه کنید، dedup_chat_summaries را اجرا کنید
+            # (scope را هم پر می‌کند)، سپس این قید را اضافه کنید.
+            models.UniqueConstraint(fields=["user", "scope"], name="uniq_chatsummary_user_scope"),
+        ]
+
+    @staticmethod
+    def scope_for(session) -> int:
+        if session is None:
+            return 0
+        return session if isinstance(session, int) else session.pk
+
+    def save(self, *args, **kwargs):
+        self.scope = self.session_id or 0
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "session" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "scope"}
+        super().save(*args, **kwargs)
 
     def __str__(self) -> str:  # pragma: no cover
         tgt = f"session {self.session_id}" if self.session_id else "global"
@@ -0,0 +1,230 @@
+# chatbot/parsers.py
+# پارسر JSON جریانی برای ChatView: رشته‌های base64 بزرگ (تصاویر) در حین خواندن بدنهٔ درخواست
+# تکه‌تکه decode و مستقیم در فایل آپلود (حافظه تا FILE_UPLOAD_MAX_MEMORY_SIZE، بعد فایل موقت) نوشته می‌شوند؛
+# فقط «اسکلت» کوچک JSON در حافظه می‌ماند و json.loads روی آن اجرا می‌شود.
+# فقط مقدارهای جایگاه تصویر (_IMAGE_KEYS / _IMAGE_ITEM_KEYS) spool می‌شوند؛ متن بلند پیام (مثلاً فینگلیش که
+# ظاهر base64 دارد) همیشه str می‌ماند.
+from __future__ import annotations
+
+import base64
+import binascii
+import io
+import json
+import re
+from typing import List, Optional
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile, UploadedFile
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.utils import json as drf_json
+
+CHUNK_BYTES = 64 * 1024
+SPOOL_MIN_BYTES = 16 * 1024           # رشته‌های base64 کوتاه‌تر از این عادی پارس می‌شوند
+MAX_BODY_BYTES = int(getattr(settings, "CHAT_UPLOAD_MAX_BYTES", 40 * 1024 * 1024))
+MAX_SKELETON_BYTES = 1024 * 1024      # بقیهٔ JSON (پیام، کلیدها، URLها)
+_PLACEHOLDER = "\x00spooled:%d"
+
+# جاهایی که ChatView تصویر را از آن‌ها می‌خواند: images/images[] در ریشه و {image|b64|data} داخل آن‌ها
+_IMAGE_KEYS = frozenset((b"images", b"images[]"))
+_IMAGE_ITEM_KEYS = frozenset((b"image", b"b64", b"data"))
+
+_SPECIAL = re.compile(rb'["\\]')
+_STRUCTURE = re.compile(rb"[{}\[\]:,]")
+_B64_HEAD = re.compile(rb"^(?:data:[\w.+/-]+(?:;[\w=.+-]+)*;base64,)?[A-Za-z0-9+/\\\s]*$")
+_B64_NOISE = re.compile(rb"\\[nrt]|\s")   # شکستن خط در رشتهٔ JSON (\/ جدا به / تبدیل می‌شود)
+
+
+class _Base64Sink:
+    """decode تدریجی base64 به یک UploadedFile؛ تا FILE_UPLOAD_MAX_MEMORY_SIZE در حافظه، بعد روی دیسک."""
+
+    def __init__(self, index: int, head: bytes):
+        self.content_type = "image/jpeg"
+        if head.startswith(b"data:"):
+            header, head = head.split(b",", 1)
+            self.content_type = header[5:].split(b";", 1)[0].decode("ascii") or self.content_type
+        self.name = "json-image-%d.%s" % (index, self.content_type.rsplit("/", 1)[-1])
+        self.file = io.BytesIO()
+        self.size = 0
+        self._pending = b""
+        self.write(head)
+
+    def write(self, raw: bytes) -> None:
+        raw = self._pending + raw
+        keep = len(raw) - len(raw.rstrip(b"\\"))  # بک‌اسلش انتهای تکه ممکن است شروع escape باشد
+        raw, self._pending = raw[: len(raw) - keep], raw[len(raw) - keep:]
+        chars = _B64_NOISE.sub(b"", raw.replace(b"\\/", b"/"))
+        cut = len(chars) - len(chars) % 4
+        self._pending = chars[cut:] + self._pending
+        self._emit(chars[:cut])
+
+    def _emit(self, chars: bytes) -> None:
+        if not chars:
+            return
+        try:
+            data = base64.b64decode(chars, validate=True)
+        except binascii.Error:
+            raise ParseError("JSON parse error - invalid base64 image data")
+        if isinstance(self.file, io.BytesIO) and self.size + len(data) > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            disk = TemporaryUploadedFile(self.name, self.content_type, 0, None)
+            disk.write(self.file.getbuffer())
+            self.file = disk
+        self.file.write(data)
+        self.size += len(data)
+
+    def finish(self) -> UploadedFile:
+        tail = _B64_NOISE.sub(b"", self._pending.replace(b"\\/", b"/"))
+        if len(tail) % 4:
+            raise ParseError("JSON parse error - truncated base64 image data")
+        self._emit(tail)
+        self.file.seek(0)
+        if isinstance(self.file, TemporaryUploadedFile):
+            self.file.size = self.size
+            return self.file
+        return InMemoryUploadedFile(self.file, "images", self.name, self.content_type, self.size, None)
+
+
+class _Path:
+    """جای مقدار جاری در ساختار JSON (بیرون از رشته‌ها) برای تشخیص جایگاه تصویر."""
+
+    def __init__(self):
+        # هر سطح: [آبجکت است؟، آرایهٔ images یا آبجکتِ عضو آن است؟]
+        self.stack: List[List[bool]] = []
+        self.key: Optional[bytes] = None
+        self.expect_key = False
+
+    def feed(self, segment: bytes) -> None:
+        for c in _STRUCTURE.findall(segment):
+            if c == b"{":
+                self.stack.append([True, self._in_images_array()])
+                self.expect_key, self.key = True, None
+            elif c == b"[":
+                self.stack.append([False, self.in_image()])
+            elif c in (b"}", b"]"):
+                if self.stack:
+                    self.stack.pop()
+                self.expect_key = False
+            elif c == b":":
+                self.expect_key = False
+            elif c == b",":
+                self.expect_key = bool(self.stack) and self.stack[-1][0]
+                if self.expect_key:
+                    self.key = None
+
+    def _in_images_array(self) -> bool:
+        return bool(self.stack) and not self.stack[-1][0] and self.stack[-1][1]
+
+    def in_image(self) -> bool:
+        """مقدار بعدی جایگاه تصویر است: images در ریشه، عضو آرایهٔ آن، یا image/b64/data عضو آن."""
+        if not self.stack:
+            return False
+        is_object, image_item = self.stack[-1]
+        if not is_object:
+            return image_item
+        if self.expect_key:
+            return False
+        if len(self.stack) == 1:
+            return self.key in _IMAGE_KEYS
+        return image_item and self.key in _IMAGE_ITEM_KEYS
+
+
+class StreamingJSONParser(JSONParser):
+    """
+    مثل JSONParser، با این تفاوت که رشته‌های base64 بزرگ (حتی با پیشوند data:) زیر کلیدهای تصویر
+    به‌جای str به صورت UploadedFile در داده ظاهر می‌شوند و هیچ‌وقت کامل در حافظه قرار نمی‌گیرند.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get("encoding", settings.DEFAULT_CHARSET)
+        skeleton, files = _scan(stream)
+        try:
+            parse_constant = drf_json.strict_constant if self.strict else None
+            data = json.loads(skeleton.decode(encoding), parse_constant=parse_constant)
+        except ValueError as exc:
+            raise ParseError("JSON parse error - %s" % str(exc))
+        return _substitute(data, files)
+
+
+def _scan(stream):
+    out = bytearray()
+    files: List[UploadedFile] = []
+    in_str = False
+    escaped = False              # بک‌اسلش آخر تکهٔ قبلی
+    text = bytearray()           # محتوای خام رشتهٔ جاری (تا وقتی spool نشده)
+    sink: Optional[_Base64Sink] = None
+    path = _Path()
+    spoolable = False            # رشتهٔ جاری مقدار یک کلید تصویر است
+    total = 0
+
+    while True:
+        chunk = stream.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > MAX_BODY_BYTES:
+            raise ParseError("حجم درخواست بیش از حد مجاز است.")
+        i, n = 0, len(chunk)
+        while i < n:
+            if not in_str:
+                j = chunk.find(b'"', i)
+                segment = chunk[i:] if j < 0 else chunk[i:j]
+                out += segment
+                path.feed(segment)
+                if j < 0:
+                    break
+                in_str, i = True, j + 1
+                spoolable = path.in_image()
+                text.clear()
+                continue
+
+            if sink is not None:  # base64 شامل " نیست؛ پایان رشته همان " بعدی است
+                j = chunk.find(b'"', i)
+                sink.write(chunk[i:] if j < 0 else chunk[i:j])
+                if j < 0:
+                    break
+                files.append(sink.finish())
+                out += json.dumps(_PLACEHOLDER % (len(files) - 1)).encode()
+                sink, in_str, i = None, False, j + 1
+                continue
+
+            if escaped:
+                text += chunk[i:i + 1]
+                escaped, i = False, i + 1
+                continue
+            m = _SPECIAL.search(chunk, i)
+            end = m.start() if m else n
+            text += chunk[i:end]
+            i = end
+            if m is None:
+                pass
+            elif chunk[end:end + 1] == b"\\":
+                text += b"\\"
+                escaped, i = True, end + 1
+            else:
+                out += b'"' + text + b'"'
+                if path.expect_key:
+                    path.key = bytes(text)
+                in_str, i = False, end + 1
+
+            if in_str and spoolable and len(text) >= SPOOL_MIN_BYTES and _B64_HEAD.match(text):
+                sink = _Base64Sink(len(files), bytes(text))
+                text.clear()
+                if escaped:  # بک‌اسلش را sink خودش نگه می‌دارد
+                    escaped = False
+        if len(out) > MAX_SKELETON_BYTES:
+            raise ParseError("حجم درخواست بیش از حد مجاز است.")
+
+    if in_str:
+        raise ParseError("JSON parse error - unterminated string")
+    return bytes(out), files
+
+
+def _substitute(value, files: List[UploadedFile]):
+    if isinstance(value, str) and value.startswith("\x00spooled:"):
+        return files[int(value.split(":", 1)[1])]
+    if isinstance(value, list):
+        return [_substitute(v, files) for v in value]
+    if isinstance(value, dict):
+        return {k: _substitute(v, files) for k, v in value.items()}
+    return value
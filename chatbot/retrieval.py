@@ -0,0 +1,229 @@
+# chatbot/retrieval.py
+# بازیابی نوبت‌های مرتبط از گذشتهٔ کاربر با BM25 روی ایندکس واژگانی محلی (در کش).
+# هر «نوبت» = پیام کاربر + پاسخ بعدی بات در همان سشن؛ شناسهٔ نوبت = id پیام کاربر.
+# ایندکس در اولین نیاز از روی search_text ساخته و با هر bulk_create افزایشی به‌روز می‌شود؛
+# ساخت و به‌روزرسانی با قفل هر کاربر (cache.add) انجام می‌شود تا نوبت‌های هم‌زمان هم را بازنویسی نکنند.
+from __future__ import annotations
+
+import logging
+import math
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from django.conf import settings
+from django.core.cache import cache
+
+from chatbot.models import ChatMessage
+from chatbot.utils.normalize import search_tokens
+
+logger = logging.getLogger(__name__)
+
+INDEX_TTL = 60 * 60 * 24
+LOCK_TTL = 10                    # قفل رهاشده (پروسهٔ مرده) پس از این مدت خودبه‌خود آزاد می‌شود
+LOCK_WAIT_SEC = 2.0
+LOOKBACK = 4                     # پیام‌های قبلی سشن که برای جفت کردن پاسخ بات با سؤالش دوباره خوانده می‌شوند
+MAX_TURNS = 1000                 # قدیمی‌ترین نوبت‌ها از ایندکس بیرون می‌روند
+TOP_K = int(getattr(settings, "CHAT_RETRIEVAL_TOP_K", 4))
+BUDGET_CHARS = int(getattr(settings, "CHAT_RETRIEVAL_BUDGET_CHARS", 2400))
+MAX_MESSAGE_CHARS = 600
+_K1, _B = 1.2, 0.75
+
+_STOP_WORDS = frozenset(
+    "و در به از که را این آن با است هست برای تا یا هم من شما ما او یک می نمی های ها شده "
+    "شد دارم دارد کنم کنید کرد باید اگر چه چی چرا چطور خیلی سلام ممنون".split()
+)
+
+
+def _key(user_id: int) -> str:
+    return f"chat:bm25:{user_id}"
+
+
+@contextmanager
+def _user_lock(user_id: int) -> Iterator[bool]:
+    """قفل به‌روزرسانی ایندکس یک کاربر؛ True اگر در LOCK_WAIT_SEC گرفته شد."""
+    key = f"chat:bm25:lock:{user_id}"
+    deadline = time.monotonic() + LOCK_WAIT_SEC
+    acquired = cache.add(key, 1, LOCK_TTL)
+    while not acquired and time.monotonic() < deadline:
+        time.sleep(0.05)
+        acquired = cache.add(key, 1, LOCK_TTL)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(key)
+
+
+def _terms(normalized_text: str) -> Counter:
+    return Counter(t for t in search_tokens(normalized_text) if len(t) > 1 and t not in _STOP_WORDS)
+
+
+# ==============================
+# Index maintenance
+# ==============================
+def _empty() -> Dict:
+    # turns: {turn_id: [bot_message_id|None, doc_len, {term: tf}]}
+    return {"turns": {}, "df": {}, "total": 0}
+
+
+def _drop(index: Dict, tid: int) -> None:
+    _, length, tf = index["turns"].pop(tid)
+    index["total"] -= length
+    for term in tf:
+        index["df"][term] -= 1
+        if not index["df"][term]:
+            del index["df"][term]
+
+
+def _add(index: Dict, tid: int, bot_id: Optional[int], tf: Counter) -> None:
+    if tid in index["turns"]:  # پاسخ بات بعداً به همان نوبت اضافه می‌شود
+        old_bot, _, old_tf = index["turns"][tid]
+        bot_id = bot_id or old_bot
+        tf = Counter(old_tf) + tf
+        _drop(index, tid)
+    for term in tf:
+        index["df"][term] = index["df"].get(term, 0) + 1
+    length = sum(tf.values())
+    index["turns"][tid] = [bot_id, length, dict(tf)]
+    index["total"] += length
+    while len(index["turns"]) > MAX_TURNS:
+        _drop(index, min(index["turns"]))
+
+
+def _fold(index: Dict, messages: Iterable) -> None:
+    """
+    پیام‌ها (به ترتیب id) را به نوبت‌ها تبدیل و در ایندکس ادغام می‌کند. پیامی که قبلاً ادغام شده
+    نادیده گرفته می‌شود، پس خواندن دوبارهٔ پیام‌های اخیر بی‌خطر است.
+    """
+    open_turn: Dict[int, int] = {}  # session_id → id آخرین پیام کاربر
+    turns = index["turns"]
+    for m in messages:
+        if not m.is_bot:
+            open_turn[m.session_id] = m.id
+            if m.id in turns or (len(turns) >= MAX_TURNS and m.id < min(turns)):
+                continue
+            _add(index, m.id, None, _terms(m.search_text))
+        elif m.session_id in open_turn:
+            tid = open_turn.pop(m.session_id)
+            if tid in turns and turns[tid][0] is None:
+                _add(index, tid, m.id, _terms(m.search_text))
+
+
+def _build(user_id: int) -> Dict:
+    index = _empty()
+    recent = (
+        ChatMessage.objects.filter(user_id=user_id)
+        .order_by("-id")
+        .only("id", "session_id", "is_bot", "search_text")[: MAX_TURNS * 2]
+    )
+    _fold(index, reversed(list(recent)))
+    return index
+
+
+def _load(user_id: int) -> Dict:
+    index = cache.get(_key(user_id))
+    if index is not None:
+        return index
+    with _user_lock(user_id) as locked:
+        index = cache.get(_key(user_id))
+        if index is None:
+            index = _build(user_id)
+            if locked:  # بدون قفل ممکن است ایندکس کهنه روی به‌روزرسانی هم‌زمان بنشیند
+                cache.set(_key(user_id), index, INDEX_TTL)
+    return index
+
+
+def index_messages(messages: Iterable[ChatMessage]) -> None:
+    """
+    به‌روزرسانی افزایشی ایندکس کاربرانی که ایندکسشان در کش هست (پس از commit یک bulk_create).
+    پیام‌های جدید با کوئری از آخرین پیام‌های همان سشن‌ها خوانده می‌شوند، چون bulk_create روی MySQL
+    id برنمی‌گرداند.
+    """
+    sessions: Dict[int, Set[int]] = {}
+    counts: Counter = Counter()
+    for m in messages:
+        sessions.setdefault(m.user_id, set()).add(m.session_id)
+        counts[m.user_id] += 1
+    for user_id, session_ids in sessions.items():
+        with _user_lock(user_id) as locked:
+            if not locked:
+                logger.warning("BM25 index of user %s is locked; skipping incremental update", user_id)
+                continue
+            index = cache.get(_key(user_id))
+            if index is None:
+                continue
+            recent = (
+                ChatMessage.objects.filter(user_id=user_id, session_id__in=session_ids)
+                .order_by("-id")
+                .only("id", "session_id", "is_bot", "search_text")[: counts[user_id] + LOOKBACK]
+            )
+            _fold(index, reversed(list(recent)))
+            cache.set(_key(user_id), index, INDEX_TTL)
+
+
+# ==============================
+# Query
+# ==============================
+def _score(index: Dict, terms: Iterable[str]) -> Dict[int, float]:
+    n = len(index["turns"])
+    avg = index["total"] / n if n else 0
+    scores: Dict[int, float] = {}
+    for term in set(terms):
+        df = index["df"].get(term)
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for tid, (_, length, tf) in index["turns"].items():
+            f = tf.get(term)
+            if f:
+                norm = f + _K1 * (1 - _B + _B * length / avg)
+                scores[tid] = scores.get(tid, 0.0) + idf * f * (_K1 + 1) / norm
+    return scores
+
+
+def relevant_turns(user, query: str, *, exclude_ids=(), k: int = TOP_K, budget_chars: int = BUDGET_CHARS):
+    """
+    پیام‌های (کاربر/بات) مرتبط‌ترین نوبت‌های گذشته با query، به ترتیب زمانی و در سقف budget_chars.
+    نوبت‌هایی که پیامشان در exclude_ids است (مثلاً تاریخچهٔ اخیر) کنار گذاشته می‌شوند.
+    """
+    terms = _terms(query or "")
+    if not terms:
+        return []
+    index = _load(user.pk)
+    exclude = set(exclude_ids)
+    ranked = sorted(_score(index, terms).items(), key=lambda kv: (-kv[1], -kv[0]))
+
+    picked: List[int] = []
+    for tid, _ in ranked:
+        if len(picked) >= k * 2:
+            break
+        bot_id = index["turns"][tid][0]
+        if tid in exclude or bot_id in exclude:
+            continue
+        picked += [tid] + ([bot_id] if bot_id else [])
+    if not picked:
+        return []
+
+    rows = {m.id: m for m in ChatMessage.objects.filter(id__in=picked, user=user).only("id", "is_bot", "message", "created_at")}
+    out, used = [], 0
+    for mid in picked:  # به ترتیب امتیاز، تا پر شدن بودجه
+        m = rows.get(mid)
+        if m is None:
+            continue
+        size = min(len(m.message), MAX_MESSAGE_CHARS)
+        if out and used + size > budget_chars:
+            break
+        out.append(m)
+        used += size
+    return sorted(out, key=lambda m: m.id)
+
+
+def format_turns(messages) -> str:
+    lines = []
+    for m in messages:
+        role = "ASSISTANT" if m.is_bot else "USER"
+        text = m.message if len(m.message) <= MAX_MESSAGE_CHARS else m.message[: MAX_MESSAGE_CHARS - 1] + "…"
+        lines.append(f"[{m.created_at:%Y-%m-%d %H:%M}] {role}: {text}")
+    return "\n".join(lines)
@@ -1,7 +1,14 @@
 # chatbot/roots.py
 from django.urls import path
-from .views import ChatView
+from .views import ChatHistoryMessagesView, ChatHistorySearchView, ChatHistorySessionsView, ChatView
 
 urlpatterns = [
     path("msg/", ChatView.as_view(), name="chat_msg"),
+    path("history/sessions/", ChatHistorySessionsView.as_view(), name="chat_history_sessions"),
+    path("history/search/", ChatHistorySearchView.as_view(), name="chat_history_search"),
+    path(
+        "history/sessions/<int:session_id>/messages/",
+        ChatHistoryMessagesView.as_view(),
+        name="chat_history_messages",
+    ),
 ]
\ No newline at end of file
@@ -0,0 +1,120 @@
+# chatbot/routing.py
+# مسیریابی مدل برای هر نوبت چت: تصویر ← مدل بینایی؛ پرامپت بلند یا پلن ویژه ← مدل قوی؛ بقیه ← مدل ارزان متنی.
+# جدول مسیرها از settings.CHAT_MODEL_ROUTES خوانده می‌شود. میانگین نمایی تأخیر هر مدل در کش نگه داشته می‌شود
+# و مسیری که مدلش کند شده (بیش از slow_ms) به fallback خود می‌رود.
+from __future__ import annotations
+
+import logging
+import time
+from typing import Dict, NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_MODEL = getattr(settings, "VISION_MODEL_NAME", "gpt-4o")
+ROUTES: Dict[str, Dict] = getattr(settings, "CHAT_MODEL_ROUTES", None) or {
+    "vision": {"model": _DEFAULT_MODEL, "max_tokens": 1500, "timeout": 60},
+    "text": {"model": _DEFAULT_MODEL, "max_tokens": 1500, "timeout": 60},
+}
+LONG_PROMPT_CHARS = int(getattr(settings, "CHAT_ROUTE_LONG_PROMPT_CHARS", 6000))
+PREMIUM_PLAN_IDS = frozenset(getattr(settings, "CHAT_ROUTE_PREMIUM_PLAN_IDS", ()))
+LATENCY_TTL = 60 * 30
+_EWMA_ALPHA = 0.3
+
+_STATS_KEYS = tuple(ROUTES) + ("forced",)
+
+
+class RouteDecision(NamedTuple):
+    route: str
+    model: str
+    max_tokens: int
+    timeout: float
+    reason: str
+
+
+def _latency_key(model: str) -> str:
+    return f"chat:route:latency:{model}"
+
+
+def model_latency_ms(model: str) -> Optional[int]:
+    """میانگین نمایی تأخیر اخیر مدل (میلی‌ثانیه) یا None اگر داده‌ای نیست."""
+    value = cache.get(_latency_key(model))
+    return int(value) if value is not None else None
+
+
+def record_latency(model: str, latency_ms: int) -> None:
+    prev = cache.get(_latency_key(model))
+    value = latency_ms if prev is None else _EWMA_ALPHA * latency_ms + (1 - _EWMA_ALPHA) * prev
+    cache.set(_latency_key(model), value, LATENCY_TTL)
+
+
+def _premium(user) -> bool:
+    if not PREMIUM_PLAN_IDS:
+        return False
+    from sub.models import Subscription
+
+    plan_id = Subscription.objects.filter(user=user).values_list("plan_id", flat=True).first()
+    return plan_id in PREMIUM_PLAN_IDS
+
+
+def _decision(route: str, reason: str) -> RouteDecision:
+    cfg = ROUTES[route]
+    return RouteDecision(
+        route, cfg["model"], int(cfg.get("max_tokens", 1500)), float(cfg.get("timeout", 60)), reason
+    )
+
+
+def choose_route(user, *, has_images: bool, prompt_chars: int, force_model: Optional[str] = None) -> RouteDecision:
+    """مدل، سقف توکن و مهلت این نوبت؛ تصمیم و زمان تصمیم‌گیری لاگ و شمارش می‌شود."""
+    t0 = time.monotonic()
+    if force_model:
+        base = _decision("vision" if has_images else "text", "forced")
+        decision = base._replace(route="forced", model=force_model)
+    elif has_images:
+        decision = _decision("vision", "images")
+    elif prompt_chars > LONG_PROMPT_CHARS and "text_strong" in ROUTES:
+        decision = _decision("text_strong", f"prompt_chars={prompt_chars}")
+    elif "text_strong" in ROUTES and _premium(user):
+        decision = _decision("text_strong", "premium_plan")
+    else:
+        decision = _decision("text", "default")
+
+    # مدل کند ← fallback (فقط یک پله، تا حلقه پیش نیاید)
+    fallback = ROUTES.get(decision.route, {}).get("fallback")
+    slow_ms = ROUTES.get(decision.route, {}).get("slow_ms")
+    if fallback and slow_ms:
+        latency = model_latency_ms(decision.model)
+        if latency is not None and latency > slow_ms:
+            decision = _decision(fallback, f"{decision.reason}; {decision.model} slow ({latency}ms)")
+
+    _bump(decision.route)
+    logger.info(
+        "Model route=%s model=%s max_tokens=%s timeout=%ss reason=%s (decided in %.2fms)",
+        decision.route, decision.model, decision.max_tokens, decision.timeout, decision.reason,
+        (time.monotonic() - t0) * 1000,
+    )
+    return decision
+
+
+def _bump(route: str) -> None:
+    key = f"chat:route:stats:{route}"
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def stats() -> Dict[str, Dict]:
+    """{route: {count, model, latency_ms}} برای داشبورد/عیب‌یابی."""
+    counts = cache.get_many([f"chat:route:stats:{r}" for r in _STATS_KEYS])
+    return {
+        r: {
+            "count": int(counts.get(f"chat:route:stats:{r}", 0)),
+            "model": ROUTES[r]["model"] if r in ROUTES else None,
+            "latency_ms": model_latency_ms(ROUTES[r]["model"]) if r in ROUTES else None,
+        }
+        for r in _STATS_KEYS
+    }
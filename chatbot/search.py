@@ -0,0 +1,108 @@
+# chatbot/search.py
+# جستجوی تمام‌متن روی ChatMessage.search_text با ایندکس مخصوص هر بک‌اند:
+#   SQLite → FTS5 (جدول مجازی external-content + تریگر)
+#   MySQL  → FULLTEXT
+#   PostgreSQL → GIN روی to_tsvector('simple', ...)
+# سایر بک‌اندها به icontains روی متن یکسان‌سازی‌شده برمی‌گردند.
+from __future__ import annotations
+
+import logging
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from chatbot.models import ChatMessage
+from chatbot.utils.normalize import normalize_persian, search_tokens
+
+logger = logging.getLogger(__name__)
+
+_TABLE = ChatMessage._meta.db_table
+_FTS_TABLE = f"{_TABLE}_fts"
+_MYSQL_INDEX = "chatmsg_search_ft"
+_PG_INDEX = "chatmsg_search_gin"
+
+
+# ==============================
+# Index DDL
+# ==============================
+def _sqlite_ddl():
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {_FTS_TABLE} "
+        f"USING fts5(search_text, content='{_TABLE}', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS {_FTS_TABLE}_ai AFTER INSERT ON {_TABLE} BEGIN "
+        f"INSERT INTO {_FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END",
+        f"CREATE TRIGGER IF NOT EXISTS {_FTS_TABLE}_ad AFTER DELETE ON {_TABLE} BEGIN "
+        f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END",
+        f"CREATE TRIGGER IF NOT EXISTS {_FTS_TABLE}_au AFTER UPDATE OF search_text ON {_TABLE} BEGIN "
+        f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+        f"INSERT INTO {_FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END",
+    ]
+
+
+def ensure_search_index(conn=connection) -> bool:
+    """
+    ایندکس تمام‌متن را (در صورت نبود) می‌سازد؛ idempotent. اگر بک‌اند پشتیبانی نشود False.
+    """
+    vendor = conn.vendor
+    with conn.cursor() as cur:
+        if vendor == "sqlite":
+            cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=%s", [_FTS_TABLE])
+            existed = cur.fetchone() is not None
+            for sql in _sqlite_ddl():
+                cur.execute(sql)
+            if not existed:
+                cur.execute(f"INSERT INTO {_FTS_TABLE}({_FTS_TABLE}) VALUES ('rebuild')")
+            return True
+        if vendor == "mysql":
+            cur.execute(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+                [_TABLE, _MYSQL_INDEX],
+            )
+            if cur.fetchone() is None:
+                cur.execute(f"ALTER TABLE {_TABLE} ADD FULLTEXT INDEX {_MYSQL_INDEX} (search_text)")
+            return True
+        if vendor == "postgresql":
+            cur.execute(
+                f"CREATE INDEX IF NOT EXISTS {_PG_INDEX} ON {_TABLE} "
+                f"USING GIN (to_tsvector('simple', search_text))"
+            )
+            return True
+    logger.warning("Full-text search index not supported on %s; falling back to LIKE.", vendor)
+    return False
+
+
+# ==============================
+# Query
+# ==============================
+def _match_ids(tokens):
+    """RawSQL که id پیام‌های منطبق (همهٔ توکن‌ها) را برمی‌گرداند؛ None یعنی بک‌اند بدون ایندکس."""
+    vendor = connection.vendor
+    if vendor == "sqlite":
+        expr = " ".join('"{}"'.format(t.replace('"', "")) for t in tokens)
+        return RawSQL(f"SELECT rowid FROM {_FTS_TABLE} WHERE {_FTS_TABLE} MATCH %s", [expr])
+    if vendor == "mysql":
+        expr = " ".join(f"+{t}" for t in tokens)
+        return RawSQL(
+            f"SELECT id FROM {_TABLE} WHERE MATCH(search_text) AGAINST (%s IN BOOLEAN MODE)", [expr]
+        )
+    if vendor == "postgresql":
+        return RawSQL(
+            f"SELECT id FROM {_TABLE} WHERE to_tsvector('simple', search_text) @@ plainto_tsquery('simple', %s)",
+            [" ".join(tokens)],
+        )
+    return None
+
+
+def search_messages(queryset, query: str):
+    """
+    فیلتر queryset (مثلاً پیام‌های یک کاربر) به پیام‌هایی که همهٔ کلمات query را دارند.
+    query با همان قواعد متن ذخیره‌شده یکسان‌سازی می‌شود.
+    """
+    tokens = search_tokens(query)
+    if not tokens:
+        return queryset.none()
+    ids = _match_ids(tokens)
+    if ids is None:
+        return queryset.filter(search_text__icontains=normalize_persian(query))
+    return queryset.filter(id__in=ids)
@@ -38,6 +38,28 @@ class ChatSessionSerializer(serializers.ModelSerializer):
         read_only_fields = ("id", "user", "started_at", "ended_at")
 
 
+class ChatSessionHeaderSerializer(serializers.ModelSerializer):
+    """سشن بدون پیام‌ها؛ برای لیست تاریخچه."""
+
+    class Meta:
+        model = ChatSession
+        fields = ("id", "title", "is_open", "started_at", "ended_at")
+        read_only_fields = fields
+
+
+class ChatHistoryMessageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatMessage
+        fields = ("id", "is_bot", "message", "created_at")
+        read_only_fields = fields
+
+
+class ChatSearchResultSerializer(ChatHistoryMessageSerializer):
+    class Meta(ChatHistoryMessageSerializer.Meta):
+        fields = ("id", "session", "is_bot", "message", "created_at")
+        read_only_fields = fields
+
+
 class ChatSummarySerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatSummary
@@ -46,7 +68,10 @@ class ChatSummarySerializer(serializers.ModelSerializer):
             "user",
             "session",
             "model_used",
-            "raw_text",
+            "first_message_id",
+            "last_message_id",
+            "raw_chars",
+            "raw_sha256",
             "rewritten_text",
             "structured_json",
             "created_at",
@@ -0,0 +1,59 @@
+# chatbot/signals.py
+import logging
+
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_migrate
+from django.dispatch import Signal, receiver
+
+logger = logging.getLogger(__name__)
+
+# پس از بسته شدن یک یا چند سشن ارسال می‌شود؛ kwargs: session_ids
+sessions_closed = Signal()
+
+
+@receiver(sessions_closed)
+def summarize_closed_sessions_on_commit(sender, session_ids, **kwargs):
+    """
+    خلاصهٔ نهایی سشن‌ها و به‌روزرسانی افزایشی خلاصهٔ سراسری را پس از commit
+    به Celery می‌سپارد تا درخواست/کامندِ بستن منتظر LLM نماند.
+    """
+    from medogram_tasks import summarize_closed_sessions_task
+
+    ids = list(session_ids)
+    if not ids:
+        return
+
+    def _queue():
+        # در autocommit همین‌جا اجرا می‌شود؛ قطعی broker نباید نوبت چت کاربر را خراب کند.
+        # سشن‌های جامانده را جاروب شبانهٔ summarize_chats --sessions خلاصه می‌کند.
+        try:
+            summarize_closed_sessions_task.delay(ids)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Could not queue summaries for closed sessions %s: %s", ids, exc)
+
+    transaction.on_commit(_queue)
+
+
+@receiver(sessions_closed)
+def forget_closed_session_headers(sender, session_ids, **kwargs):
+    """هدر کش‌شدهٔ سشن (is_open/ended_at) پس از بسته شدن کهنه است."""
+    from chatbot.history import forget_session_headers
+
+    forget_session_headers(session_ids)
+
+
+@receiver(post_migrate)
+def ensure_chat_search_index(sender, using="default", **kwargs):
+    """ایندکس تمام‌متن پیام‌ها (بسته به بک‌اند) پس از مایگریشن اپ chatbot ساخته می‌شود."""
+    if getattr(sender, "name", "") != "chatbot":
+        return
+    from chatbot.search import ensure_search_index
+
+    ensure_search_index(connections[using])
+
+
+@receiver(post_delete, sender="chatbot.ChatArchive")
+def delete_archive_blob(sender, instance, **kwargs):
+    """فایل بایگانی پس از حذف ردیف (مثلاً با حذف کاربر) باقی نماند."""
+    if instance.blob:
+        transaction.on_commit(lambda: instance.blob.delete(save=False))
@@ -0,0 +1,37 @@
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from chatbot.utils import text_summary
+from sub.models import SubscriptionPlan
+
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    # شمارنده‌ها و پرچم قطعی خلاصه‌ساز نباید بین آزمون‌ها نشت کنند
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def user(db):
+    # سیگنال grant_welcome_subscription پلن شمارهٔ ۵ را لازم دارد
+    SubscriptionPlan.objects.get_or_create(id=5, defaults={"name": "هدیه", "days": 7, "price": 0})
+    return User.objects.create_user(phone_number="09120000000", password="x")
+
+
+@pytest.fixture
+def fake_summarizer(monkeypatch):
+    calls = []
+
+    def _fake(text, previous=""):
+        calls.append((text, previous))
+        return f"summary #{len(calls)}", {"history": "", "symptoms": "", "medications": "", "recommendations": ""}
+
+    monkeypatch.setattr(text_summary, "_call_summarizer", _fake)
+    # متن‌های آزمون کوتاه‌اند؛ بدون این، همه به خلاصه‌ساز محلی می‌روند
+    monkeypatch.setattr(text_summary, "LOCAL_SUMMARY_MAX_CHARS", 0)
+    return calls
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from chatbot import answer_cache, generateresponse
+from chatbot.models import ChatMessage
+
+
+class _CountingClient:
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=f"پاسخ {self.calls}"))],
+            usage=SimpleNamespace(total_tokens=120),
+        )
+
+
+@pytest.fixture
+def client(monkeypatch):
+    cache.clear()
+    c = _CountingClient()
+    monkeypatch.setattr(generateresponse, "_get_client", lambda: c)
+    return c
+
+
+@pytest.mark.django_db
+def test_first_turns_share_cached_answer_but_history_bypasses(user, client):
+    other = get_user_model().objects.create_user(phone_number="09120000004", password="x")
+    first = generateresponse.generate_gpt_response(user, "سردرد دارم چه کنم؟")
+    again = generateresponse.generate_gpt_response(other, "سردرد دارم چه کنم")
+
+    assert first == again == "پاسخ 1" and client.calls == 1
+    assert answer_cache.stats()["hits"] == 1 and answer_cache.stats()["saved_tokens"] == 120
+    assert ChatMessage.objects.filter(user=other, is_bot=True).count() == 1
+
+    # سشن باز تاریخچه دارد و پاسخ را عوض می‌کند → کش دور زده می‌شود
+    generateresponse.generate_gpt_response(user, "سردرد دارم چه کنم؟")
+    assert client.calls == 2
+
+
+def test_near_duplicates_differ_only_in_stop_words(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(answer_cache, "NEAR_DUP_ENABLED", True)
+    kw = {"model": "m", "system_prompt": "p"}
+    answer_cache.store("از دیروز سردرد شدید و تب دارم چه کنم", "استراحت", latency_ms=900, **kw)
+
+    assert answer_cache.lookup("از دیروز سردرد شدید و تب دارم چه باید بکنم", **kw) == "استراحت"
+    assert answer_cache.lookup("کمرم درد می‌کند", **kw) is None
+    assert answer_cache.lookup("از دیروز سردرد شدید و تب دارم چه کنم", model="other", system_prompt="p") is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("دوز استامینوفن برای کودک 2 ساله چقدر است", "دوز استامینوفن برای کودک ۱۰ ساله چقدر است"),
+    ("مصرف ایبوپروفن در دوران بارداری مجاز است", "مصرف ایبوپروفن در دوران شیردهی مجاز است"),
+])
+def test_near_duplicates_never_cross_numbers_or_content_words(monkeypatch, cached, asked):
+    cache.clear()
+    monkeypatch.setattr(answer_cache, "NEAR_DUP_ENABLED", True)
+    kw = {"model": "m", "system_prompt": "p"}
+    answer_cache.store(cached, "پاسخ اول", latency_ms=900, **kw)
+
+    assert answer_cache.lookup(asked, **kw) is None
+    assert answer_cache.lookup("آیا " + cached + "؟", **kw) == "پاسخ اول"  # فقط واژهٔ دستوری فرق دارد
@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+import pytest
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chatbot import archive as archive_mod
+from chatbot.archive import archivable_sessions, archive_sessions, archive_user_sessions
+from chatbot.models import ChatArchive, ChatMessage, ChatSession
+from chatbot.utils import text_summary
+from chatbot.utils.text_summary import summarize_user_chats
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+def _session(user, *, ended_days_ago, texts):
+    now = timezone.now()
+    s = ChatSession.objects.create(
+        user=user, is_open=False, started_at=now - timedelta(days=ended_days_ago, hours=1),
+        ended_at=now - timedelta(days=ended_days_ago),
+    )
+    for i, t in enumerate(texts):
+        ChatMessage.objects.create(
+            session=s, user=user, message=t, is_bot=bool(i % 2), created_at=s.started_at + timedelta(minutes=i)
+        )
+    return s
+
+
+@pytest.mark.django_db
+def test_old_sessions_move_to_archive_and_stay_readable(user):
+    old = _session(user, ended_days_ago=120, texts=["سردرد دارم", "استراحت کنید", "تب هم دارم"])
+    recent = _session(user, ended_days_ago=1, texts=["سرفه"])
+
+    stats = archive_sessions(archivable_sessions(90))
+
+    assert stats == {"archives": 1, "sessions": 1, "messages": 3}
+    assert not ChatMessage.objects.filter(session=old).exists()
+    assert ChatMessage.objects.filter(session=recent).count() == 1
+    old.refresh_from_db()
+    assert old.archive.message_count == 3
+
+    client = APIClient()
+    client.force_authenticate(user)
+    url = reverse("chat_history_messages", args=[old.pk]) + "?limit=2"
+    texts = []
+    while url:
+        resp = client.get(url)
+        assert resp.status_code == 200
+        texts += [row["message"] for row in resp.data["results"]]
+        url = resp.data["next"]
+    assert texts == ["تب هم دارم", "استراحت کنید", "سردرد دارم"]
+
+
+@pytest.mark.django_db
+def test_full_rebuild_reads_archived_messages(user, fake_summarizer):
+    _session(user, ended_days_ago=120, texts=["سابقهٔ دیابت دارم"])
+    _session(user, ended_days_ago=1, texts=["قند خونم بالاست"])
+    archive_sessions(archivable_sessions(90))
+
+    summarize_user_chats(user, full=True)
+
+    text = fake_summarizer[-1][0]
+    assert text.index("سابقهٔ دیابت") < text.index("قند خونم")
+
+
+@pytest.mark.django_db
+def test_serialize_opens_only_archives_needed_for_budget(user, monkeypatch):
+    sessions = [_session(user, ended_days_ago=200 - i * 10, texts=[f"پیام قدیمی {i}"] * 3) for i in range(3)]
+    for s in sessions:  # هر سشن در فایل جداگانه
+        archive_user_sessions(user.pk, [s.pk])
+    _session(user, ended_days_ago=1, texts=["پیام تازه"])
+
+    opened = []
+    real = archive_mod.load_archive
+    monkeypatch.setattr(archive_mod, "load_archive", lambda a: opened.append(a.pk) or real(a))
+    monkeypatch.setattr(text_summary, "RAW_CLIP_CHARS", 120)
+
+    text, _, _ = text_summary._serialize_conversation(ChatSession.objects.filter(user=user))
+
+    newest = ChatArchive.objects.order_by("-last_message_id").first()
+    assert opened == [newest.pk]
+    assert "پیام قدیمی 2" in text and "پیام قدیمی 0" not in text and text.endswith("پیام تازه")
+    # بدون سقف، همهٔ فایل‌ها به ترتیب جدید به قدیم خوانده و ادغام می‌شوند
+    ids = [m.id for m in archive_mod.iter_archived_messages_desc(ChatSession.objects.filter(user=user))]
+    assert len(ids) == 9 and ids == sorted(ids, reverse=True)
+
+
+@pytest.mark.django_db
+def test_deleting_archive_removes_blob(user, django_capture_on_commit_callbacks):
+    _session(user, ended_days_ago=120, texts=["سلام"])
+    archive_sessions(archivable_sessions(90))
+    archive = ChatArchive.objects.get()
+    storage, name = archive.blob.storage, archive.blob.name
+
+    with django_capture_on_commit_callbacks(execute=True):
+        archive.delete()
+
+    assert not storage.exists(name)
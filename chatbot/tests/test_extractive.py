@@ -0,0 +1,88 @@
+import pytest
+from django.core.cache import cache
+
+from chatbot.models import ChatMessage, ChatSession, ChatSummary
+from chatbot.utils import text_summary
+from chatbot.utils.extractive import summarize_extractive
+
+CONVERSATION = "\n".join([
+    "[2025-01-01 10:00] USER: از دیروز سردرد شدید و تب دارم. سابقهٔ میگرن هم دارم.",
+    "[2025-01-01 10:01] ASSISTANT: تب و سردرد می‌تواند نشانهٔ عفونت ویروسی باشد. قرص استامینوفن ۵۰۰ میلی‌گرم هر شش ساعت مصرف کنید.",
+    "[2025-01-01 10:02] USER: سرفه هم دارم. تب شب‌ها بیشتر می‌شود.",
+    "[2025-01-01 10:03] ASSISTANT: استراحت کنید و مایعات زیاد بنوشید. اگر تب بیش از سه روز ماند به پزشک مراجعه کنید.",
+])
+
+
+def test_extractive_summary_fills_sections():
+    summary, sections = summarize_extractive(CONVERSATION)
+
+    assert summary and len(summary) < len(CONVERSATION)
+    assert "میگرن" in sections["history"]
+    assert "تب" in sections["symptoms"]
+    assert "استامینوفن" in sections["medications"]
+    assert "مراجعه" in sections["recommendations"]
+    assert "USER:" not in summary
+
+
+def test_section_keywords_match_whole_tokens():
+    text = "\n".join([
+        "[2025-01-01 10:00] USER: کارت اعتبار من مرتب خطا می‌دهد.",
+        "[2025-01-01 10:01] USER: دردم از دیشب بیشتر شده است.",
+    ])
+    _, sections = summarize_extractive(text)
+
+    assert "اعتبار" not in sections["symptoms"]  # «تب» داخل «مرتب»/«اعتبار» نیست
+    assert "دردم" in sections["symptoms"]
+
+
+@pytest.mark.django_db
+def test_short_sessions_skip_llm_and_outage_falls_back_locally(user, monkeypatch):
+    cache.clear()
+    calls = []
+
+    def _down(text, previous=""):
+        calls.append(text)
+        raise text_summary.SummarizerUnavailable("boom") from ConnectionError("gateway down")
+
+    monkeypatch.setattr(text_summary, "_call_summarizer", _down)
+    session = ChatSession.objects.create(user=user, is_open=False)
+    ChatMessage.objects.create(session=session, user=user, message="سردرد و تب دارم")
+
+    stats = text_summary.summarize_sessions_batch([session.pk])
+    assert stats["local"] == 1 and not calls
+    assert ChatSummary.objects.get(session=session).model_used == text_summary.LOCAL_MODEL_NAME
+
+    monkeypatch.setattr(text_summary, "LOCAL_SUMMARY_MAX_CHARS", 0)
+    summary = text_summary.summarize_user_chats(user)
+    assert len(calls) == 1 and summary.model_used == text_summary.LOCAL_MODEL_NAME
+    assert "تب" in summary.structured_json["symptoms"]
+
+    text_summary.summarize_user_chats(user, full=True)
+    assert len(calls) == 1  # در دورهٔ قطعی دوباره تلاش نمی‌شود
+
+
+class _BadRequest(Exception):
+    status_code = 400
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("cause", [None, RuntimeError("GAPGPT_API_KEY is missing"), _BadRequest("bad prompt")])
+def test_non_outage_failures_do_not_trip_cooldown(user, monkeypatch, cause):
+    cache.clear()
+    calls = []
+
+    def _fail(text, previous=""):
+        calls.append(text)
+        if cause is None:
+            raise text_summary.SummarizerUnavailable("empty content")
+        raise text_summary.SummarizerUnavailable(str(cause)) from cause
+
+    monkeypatch.setattr(text_summary, "_call_summarizer", _fail)
+    monkeypatch.setattr(text_summary, "LOCAL_SUMMARY_MAX_CHARS", 0)
+    session = ChatSession.objects.create(user=user)
+    ChatMessage.objects.create(session=session, user=user, message="سردرد و تب دارم")
+
+    assert text_summary.summarize_user_chats(user).model_used == text_summary.LOCAL_MODEL_NAME
+    assert not text_summary._llm_down()
+    text_summary.summarize_user_chats(user, full=True)
+    assert len(calls) == 2
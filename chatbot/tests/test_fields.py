@@ -0,0 +1,74 @@
+import pytest
+from django.core.management import call_command
+from django.db import connection
+
+from chatbot.fields import MAGIC, compress_text, decompress_text
+from chatbot.models import ChatMessage, ChatSession, ChatSummary
+
+LONG = "بیمار از سردرد مزمن و تهوع صبحگاهی شکایت دارد؛ فشار خون ۱۴۰/۹۰ است. " * 20
+
+
+def _stored(model, column, pk):
+    with connection.cursor() as cur:
+        cur.execute(f"SELECT {column} FROM {model._meta.db_table} WHERE id = %s", [pk])
+        return cur.fetchone()[0]
+
+
+def test_compress_text_roundtrip_and_header():
+    packed = compress_text(LONG)
+    assert packed.startswith(MAGIC) and len(packed) < len(LONG.encode("utf-8")) / 3
+    assert decompress_text(packed) == LONG
+    # متن کوتاه بدون هدر ذخیره می‌شود؛ مقادیر قدیمی (bytes/str خام) همان‌طور خوانده می‌شوند
+    assert compress_text("سلام") == "سلام".encode("utf-8")
+    assert decompress_text("سلام".encode("utf-8")) == decompress_text("سلام") == "سلام"
+
+
+@pytest.mark.django_db
+def test_summary_column_is_compressed_and_legacy_rows_convert(user):
+    summary = ChatSummary.objects.create(user=user, rewritten_text=LONG)
+    assert bytes(_stored(ChatSummary, "rewritten_text", summary.pk)).startswith(MAGIC)
+    assert ChatSummary.objects.get(pk=summary.pk).rewritten_text == LONG
+
+    with connection.cursor() as cur:  # ردیف قدیمی: UTF-8 خام
+        cur.execute(
+            f"UPDATE {ChatSummary._meta.db_table} SET rewritten_text = %s WHERE id = %s",
+            [LONG.encode("utf-8"), summary.pk],
+        )
+    assert ChatSummary.objects.get(pk=summary.pk).rewritten_text == LONG
+
+    call_command("compress_chat_text", "--batch-size", "1")
+
+    assert bytes(_stored(ChatSummary, "rewritten_text", summary.pk)).startswith(MAGIC)
+    assert ChatSummary.objects.get(pk=summary.pk).rewritten_text == LONG
+
+
+@pytest.mark.django_db
+def test_messages_stay_plain_text_and_compressed_rows_restore(user):
+    session = ChatSession.objects.create(user=user)
+    msg = ChatMessage.objects.create(session=session, user=user, message=LONG)
+    assert _stored(ChatMessage, "message", msg.pk) == LONG
+
+    with connection.cursor() as cur:  # ردیفی که پیش‌تر فشرده ذخیره شده
+        cur.execute(
+            f"UPDATE {ChatMessage._meta.db_table} SET message = %s WHERE id = %s", [compress_text(LONG), msg.pk]
+        )
+    call_command("compress_chat_text", "--restore-messages", "--batch-size", "1")
+
+    assert _stored(ChatMessage, "message", msg.pk) == LONG
+
+
+@pytest.mark.django_db
+def test_benchmark_reports_whole_row_including_structured_json(user):
+    import json
+    from io import StringIO
+
+    sections = {"symptoms": "سردرد و تب"}
+    ChatSummary.objects.create(user=user, rewritten_text=LONG, structured_json=sections)
+
+    out = StringIO()
+    call_command("compress_chat_text", "--benchmark", stdout=out)
+    line = next(l for l in out.getvalue().splitlines() if l.startswith("ChatSummary row text:"))
+
+    raw = len(LONG.encode("utf-8")) + len(json.dumps(sections, ensure_ascii=False).encode("utf-8"))
+    assert f"uncompressed={raw}B" in line
+    assert "structured_json" in line
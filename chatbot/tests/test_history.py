@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from chatbot.models import ChatMessage, ChatSession
+
+User = get_user_model()
+
+
+@pytest.fixture
+def api_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def _walk(client, url):
+    pages = []
+    while url:
+        resp = client.get(url)
+        assert resp.status_code == 200
+        pages.append(resp.data)
+        url = resp.data["next"]
+    return pages
+
+
+@pytest.mark.django_db
+def test_sessions_are_paged_by_keyset_without_messages(user, api_client):
+    t0 = timezone.now()
+    # دو سشن با started_at یکسان تا tie-break روی id هم پوشش داده شود
+    sessions = [ChatSession.objects.create(user=user, started_at=t0 - timedelta(minutes=i // 2)) for i in range(5)]
+
+    pages = _walk(api_client, reverse("chat_history_sessions") + "?limit=2")
+
+    ids = [row["id"] for page in pages for row in page["results"]]
+    expected = [s.pk for s in sorted(sessions, key=lambda s: (s.started_at, s.pk), reverse=True)]
+    assert ids == expected
+    assert [len(p["results"]) for p in pages] == [2, 2, 1]
+    assert "messages" not in pages[0]["results"][0]
+
+
+@pytest.mark.django_db
+def test_messages_endpoint_is_scoped_to_owner(user, api_client):
+    session = ChatSession.objects.create(user=user)
+    msgs = [ChatMessage.objects.create(session=session, user=user, message=f"m{i}") for i in range(3)]
+    url = reverse("chat_history_messages", args=[session.pk]) + "?limit=2"
+
+    pages = _walk(api_client, url)
+    assert pages[0]["session"]["id"] == session.pk
+    assert [r["message"] for p in pages for r in p["results"]] == [m.message for m in reversed(msgs)]
+
+    other = User.objects.create_user(phone_number="09120000002", password="x")
+    stranger = APIClient()
+    stranger.force_authenticate(other)
+    assert stranger.get(url).status_code == 404
+
+
+@pytest.mark.django_db
+def test_invalid_cursor_is_rejected(user, api_client):
+    resp = api_client.get(reverse("chat_history_sessions") + "?cursor=!!!")
+    assert resp.status_code == 400
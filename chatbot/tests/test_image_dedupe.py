@@ -0,0 +1,73 @@
+import base64
+import io
+from types import SimpleNamespace
+
+import pytest
+from django.core.cache import cache
+from PIL import Image, ImageDraw
+
+from chatbot import generateresponse
+
+
+def _jpeg_b64(size=(640, 480), quality=90, shift=0):
+    im = Image.new("RGB", size, (240, 240, 240))
+    draw = ImageDraw.Draw(im)
+    w, h = size
+    draw.rectangle((w // 8 + shift, h // 6, w // 2 + shift, h // 2), fill=(30, 60, 200))
+    draw.ellipse((w // 2, h // 2, w - w // 8, h - h // 8), fill=(200, 40, 40))
+    buf = io.BytesIO()
+    im.save(buf, "JPEG", quality=quality)
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def _other_b64():
+    im = Image.linear_gradient("L").convert("RGB").resize((400, 300))
+    buf = io.BytesIO()
+    im.save(buf, "PNG")
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def _images(parts):
+    return [p for p in parts if p["type"] == "image_url"]
+
+
+def test_near_duplicates_in_one_request_are_sent_once():
+    sent = []
+    parts = generateresponse._build_user_content_with_images(
+        "این زخم چیه؟",
+        image_b64_list=[_jpeg_b64(), _jpeg_b64(size=(1280, 960), quality=60), _other_b64()],
+        image_files=None,
+        image_urls=["https://x/a.jpg", "https://x/a.jpg "],
+        sent_hashes=sent,
+    )
+    assert len(_images(parts)) == 3  # دو عکس متفاوت + یک URL
+    assert len(sent) == 2
+    assert parts[-1] == {"type": "text", "text": "این زخم چیه؟"}
+
+
+class _VisionClient:
+    def __init__(self):
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.requests.append(kwargs["messages"][-1]["content"])
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="احتمالاً درماتیت تماسی است."))],
+            usage=SimpleNamespace(total_tokens=900),
+        )
+
+
+@pytest.mark.django_db
+def test_image_resent_in_session_is_replaced_by_reference(user, monkeypatch):
+    cache.clear()
+    client = _VisionClient()
+    monkeypatch.setattr(generateresponse, "_get_client", lambda: client)
+
+    generateresponse.generate_gpt_response(user, "این چیه؟", image_b64_list=[_jpeg_b64()])
+    generateresponse.generate_gpt_response(user, "بهتر نشده", image_b64_list=[_jpeg_b64(quality=70)])
+
+    first, second = client.requests
+    assert len(_images(first)) == 1
+    assert _images(second) == []
+    assert "قبلاً" in second[-1]["text"] and "درماتیت تماسی" in second[-1]["text"]
@@ -0,0 +1,58 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from chatbot import generateresponse
+from chatbot.intents import detect_intent
+from chatbot.models import ChatMessage
+from sub.models import Subscription, SubscriptionPlan
+from telemedicine.models import BoxMoney
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("موجودی کیف پولم چقدره؟", "wallet_balance"),
+    ("اشتراكم تا كي فعاله؟", "subscription_status"),
+    ("چطور نوبت ویزیت بگیرم", "book_visit"),
+    ("آپدیت جدید اومده؟", "app_update"),
+    ("پلنم کی تموم میشه", "subscription_status"),
+    ("سرم درد میکنه و تب دارم چیکار کنم", None),
+    ("این قرص رو تا کی مصرف کنم؟", None),
+    # سؤال‌های پزشکی که قبلاً به پاسخ آمادهٔ اپ می‌رفتند
+    ("قرص رو روزی چند نوبت بخورم؟ چطور مصرف کنم", None),
+    ("نوبت دوم واکسن کی باید تزریق بشه و کجا", None),
+    ("میخوام با پزشک صحبت کنم درباره سردردم", None),
+    ("بعد از ورزش فعالیت قلبم تند میشه تا کی طول میکشه", None),
+    ("داروخانه کشیک نزدیک کجاست", None),
+    ("پزشک کشیک هلسا کیه", "oncall_doctor"),
+    # لنگر اپ در کنار محتوای پزشکی، شکایت یا نفی ← LLM
+    ("آخرین نسخه برنامه غذایی دیابت", None),
+    ("پسرم آپدیت واکسیناسیونش رو داره؟", None),
+    ("آپدیت کردم ولی برنامه باز نمیشه", None),
+    ("کیف پول شارژ کردم ولی موجودی اضافه نشد", None),
+    ("اشتراک همسرم تا کی فعاله", None),
+])
+def test_detect_intent(message, intent):
+    assert detect_intent(message) == intent
+
+
+@pytest.mark.django_db
+def test_operational_question_is_answered_without_llm_and_logged(user, monkeypatch):
+    def _no_llm():
+        raise AssertionError("LLM must not be called")
+
+    monkeypatch.setattr(generateresponse, "_get_client", _no_llm)
+    BoxMoney.objects.update_or_create(user=user, defaults={"amount": 250000})
+    plan = SubscriptionPlan.objects.create(name="ماهانه", days=31, price=100)
+    Subscription.objects.update_or_create(
+        user=user, defaults={"plan": plan, "end_date": timezone.now() + timedelta(days=10)}
+    )
+
+    wallet = generateresponse.generate_gpt_response(user, "موجودی کیف پولم چقدره؟")
+    sub = generateresponse.generate_gpt_response(user, "اشتراکم تا کی فعاله؟")
+
+    assert "250,000" in wallet
+    assert "ماهانه" in sub
+    assert list(ChatMessage.objects.filter(user=user).order_by("id").values_list("is_bot", flat=True)) == [
+        False, True, False, True,
+    ]
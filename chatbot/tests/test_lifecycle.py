@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from chatbot import lifecycle
+from chatbot.models import ChatMessage, ChatSession, ChatSummary
+from chatbot.signals import sessions_closed
+from chatbot.utils import text_summary
+
+
+@pytest.fixture
+def closed_events():
+    events = []
+
+    def _listener(sender, session_ids, **kwargs):
+        events.append(list(session_ids))
+
+    sessions_closed.connect(_listener)
+    yield events
+    sessions_closed.disconnect(_listener)
+
+
+@pytest.mark.django_db
+def test_idle_sessions_are_closed_by_last_message_time(user, closed_events):
+    now = timezone.now()
+    old_start = now - timedelta(hours=5)
+
+    # قدیمی ولی هنوز فعال: نباید بسته شود
+    active = ChatSession.objects.create(user=user, started_at=old_start)
+    ChatMessage.objects.create(session=active, user=user, message="الان", created_at=now - timedelta(minutes=5))
+
+    idle = ChatSession.objects.create(user=user, started_at=old_start)
+    last = ChatMessage.objects.create(session=idle, user=user, message="قبلاً", created_at=now - timedelta(hours=2))
+
+    empty = ChatSession.objects.create(user=user, started_at=old_start)
+
+    closed = lifecycle.close_idle_sessions(60, now=now)
+
+    assert sorted(closed) == sorted([idle.pk, empty.pk])
+    assert closed_events == [closed]
+    idle.refresh_from_db()
+    empty.refresh_from_db()
+    active.refresh_from_db()
+    assert not idle.is_open and idle.ended_at == last.created_at
+    assert not empty.is_open and empty.ended_at == old_start
+    assert active.is_open
+
+
+@pytest.mark.django_db
+def test_close_event_schedules_summary_on_commit(user, monkeypatch, django_capture_on_commit_callbacks):
+    import medogram_tasks
+
+    scheduled = []
+    monkeypatch.setattr(medogram_tasks.summarize_closed_sessions_task, "delay", scheduled.append)
+    session = ChatSession.objects.create(user=user)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        lifecycle.close_sessions(ChatSession.objects.filter(pk=session.pk))
+
+    assert scheduled == [[session.pk]]
+
+
+@pytest.mark.django_db
+def test_summarize_closed_sessions_builds_session_and_global_summaries(user, fake_summarizer):
+    session = ChatSession.objects.create(user=user, is_open=False)
+    ChatMessage.objects.create(session=session, user=user, message="گلودرد")
+
+    stats = text_summary.summarize_closed_sessions([session.pk])
+
+    assert stats["users"] == 1
+    assert ChatSummary.objects.filter(user=user, session=session).exists()
+    assert ChatSummary.objects.filter(user=user, session=None).exists()
+
+
+@pytest.mark.django_db
+def test_broker_outage_does_not_fail_session_close(user, monkeypatch, django_capture_on_commit_callbacks):
+    import medogram_tasks
+
+    def _broker_down(*args, **kwargs):
+        raise ConnectionError("broker unreachable")
+
+    monkeypatch.setattr(medogram_tasks.summarize_closed_sessions_task, "delay", _broker_down)
+    session = ChatSession.objects.create(user=user)
+
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        sessions_closed.send(sender=None, session_ids=[session.pk])
+
+    assert len(callbacks) == 1
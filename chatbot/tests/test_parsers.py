@@ -0,0 +1,107 @@
+import base64
+import io
+import json
+import os
+import tracemalloc
+
+import pytest
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from rest_framework.exceptions import ParseError
+
+from chatbot import parsers
+from chatbot.parsers import StreamingJSONParser
+
+
+def _parse(payload: bytes):
+    return StreamingJSONParser().parse(io.BytesIO(payload))
+
+
+def test_large_base64_is_spooled_to_disk_with_bounded_memory():
+    raw = os.urandom(10 * 1024 * 1024)
+    b64 = base64.b64encode(raw).decode().replace("/", "\\/")  # بعضی کلاینت‌ها / را escape می‌کنند
+    payload = ('{"message": "عکس \\"پوست\\"", "images": [{"image": "data:image/png;base64,%s"}]}' % b64).encode()
+
+    tracemalloc.start()
+    data = _parse(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    f = data["images"][0]["image"]
+    assert isinstance(f, TemporaryUploadedFile) and f.content_type == "image/png"
+    assert f.size == len(raw) and f.read() == raw
+    assert data["message"] == 'عکس "پوست"'
+    assert peak < 4 * 1024 * 1024  # بدنه ۱۴ مگابایت است؛ JSONParser چند برابرش را نگه می‌دارد
+
+
+def test_small_strings_and_structure_are_unchanged():
+    small = base64.b64encode(b"x" * 100).decode()
+    payload = {"message": "سلام\\n", "images": [small], "new_session": True, "n": [1, 2.5, None]}
+    assert _parse(json.dumps(payload).encode()) == payload
+
+
+def test_medium_image_stays_in_memory():
+    raw = os.urandom(64 * 1024)
+    data = _parse(json.dumps({"images": [base64.b64encode(raw).decode()]}).encode())
+    f = data["images"][0]
+    assert isinstance(f, UploadedFile) and not isinstance(f, TemporaryUploadedFile)
+    assert f.read() == raw
+
+
+def test_long_text_outside_image_keys_is_not_spooled():
+    finglish = "salam doktor man sardard daram " * 2400  # فقط حروف لاتین و فاصله، مثل base64
+    b64 = base64.b64encode(os.urandom(64 * 1024)).decode()
+    payload = {"message": finglish, "meta": {"note": b64, "data": [b64]}, "images": [{"b64": b64}]}
+
+    data = _parse(json.dumps(payload).encode())
+
+    assert data["message"] == finglish
+    assert data["meta"] == {"note": b64, "data": [b64]}  # data فقط زیر images آبجکت تصویر است
+    assert isinstance(data["images"][0]["b64"], UploadedFile)
+
+
+def test_rejects_bad_payloads(monkeypatch):
+    with pytest.raises(ParseError):
+        _parse(b'{"images": ["' + b"A" * 70_000 + b'!"]}')
+    with pytest.raises(ParseError):
+        _parse(b'{"message": "x')
+    monkeypatch.setattr(parsers, "MAX_BODY_BYTES", 1000)
+    with pytest.raises(ParseError):
+        _parse(json.dumps({"images": ["A" * 2000]}).encode())
+
+
+@pytest.mark.django_db
+def test_chat_view_reads_spooled_json_image_from_disk(user, settings, monkeypatch):
+    from types import SimpleNamespace
+
+    from django.core.cache import cache
+    from django.urls import reverse
+    from PIL import Image
+    from rest_framework.test import APIClient
+
+    from chatbot import generateresponse
+
+    cache.clear()
+    settings.FILE_UPLOAD_MAX_MEMORY_SIZE = 32 * 1024
+    sent = []
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **kw: sent.append(kw["messages"][-1]["content"]) or SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content="خوب است"))], usage=None,
+        ),
+    )))
+    monkeypatch.setattr(generateresponse, "_get_client", lambda: fake)
+    read_sizes = []
+    monkeypatch.setattr(TemporaryUploadedFile, "read", lambda self, *a: read_sizes.append(a) or b"")
+
+    buf = io.BytesIO()
+    Image.effect_noise((800, 600), 64).convert("RGB").save(buf, "JPEG", quality=95)
+    client = APIClient()
+    client.force_authenticate(user)
+    resp = client.post(
+        reverse("chat_msg"),
+        {"message": "این چیه؟", "images": ["data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode()]},
+        format="json",
+    )
+
+    assert resp.status_code == 200, resp.content
+    assert [p["type"] for p in sent[0]] == ["image_url", "text"]
+    assert read_sizes == []  # فایل موقت با مسیرش پردازش شد، نه با read() در پروسهٔ وب
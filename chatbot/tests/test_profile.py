@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+from chatbot.generateresponse import _patient_context
+from chatbot.utils.profile import build_patient_profile
+
+
+def test_profile_is_terse_deduplicated_and_bounded():
+    structured = {
+        "history": "سابقهٔ دیابت نوع ۲\nسابقه دیابت نوع 2.\nحساسیت به پنی‌سیلین",
+        "symptoms": ["سردرد", "سردرد شدید صبحگاهی", "سردرد", "تب"],
+        "medications": "متفورمین ۵۰۰؛ متفورمین 500 میلی‌گرم؛ آسپرین",
+        "recommendations": "",
+    }
+
+    profile = build_patient_profile(structured, max_items=2)
+
+    assert profile.splitlines() == [
+        "history: سابقهٔ دیابت نوع ۲; حساسیت به پنی‌سیلین",
+        "symptoms: سردرد شدید صبحگاهی; تب",
+        "medications: متفورمین 500 میلی‌گرم; آسپرین",
+    ]
+
+
+def test_patient_context_falls_back_to_prose_for_legacy_rows():
+    legacy = SimpleNamespace(structured_json={}, rewritten_text="بیمار با سابقهٔ میگرن که به‌تازگی سردرد شدید دارد.")
+
+    assert _patient_context(legacy).startswith("[GLOBAL SUMMARY]\n")
+    assert _patient_context(None) == ""
@@ -0,0 +1,75 @@
+import pytest
+from django.core.cache import cache
+
+from chatbot import retrieval
+from chatbot.models import ChatMessage, ChatSession
+
+
+def _turn(session, question, answer):
+    return ChatMessage.objects.bulk_create([
+        ChatMessage(session=session, user=session.user, message=question),
+        ChatMessage(session=session, user=session.user, message=answer, is_bot=True),
+    ])
+
+
+@pytest.mark.django_db
+def test_relevant_turns_pick_matching_past_turn(user):
+    session = ChatSession.objects.create(user=user)
+    q, a = _turn(session, "به پنی‌سيلين حساسیت دارم", "در نسخه‌ها ذکر شود")
+    _turn(session, "سرما خورده‌ام", "مایعات بنوشید")
+    _turn(session, "کمردرد دارم", "ورزش سبک انجام دهید")
+
+    hits = retrieval.relevant_turns(user, "آیا آموکسی سیلین با حساسیت به پنی سیلین مشکلی دارد؟")
+
+    assert [m.id for m in hits] == [q.id, a.id]
+
+
+@pytest.mark.django_db
+def test_bulk_create_updates_cached_index(user, django_capture_on_commit_callbacks):
+    session = ChatSession.objects.create(user=user)
+    _turn(session, "سرفهٔ خشک دارم", "شربت بخورید")
+    assert retrieval.relevant_turns(user, "میگرن") == []  # ایندکس ساخته و کش می‌شود
+
+    with django_capture_on_commit_callbacks(execute=True):
+        q, a = _turn(session, "میگرن شدید دارم", "سوماتریپتان")
+
+    index = cache.get(retrieval._key(user.pk))
+    assert index["turns"][q.id][0] == a.id
+    hits = retrieval.relevant_turns(user, "میگرن", exclude_ids=[])
+    assert [m.id for m in hits] == [q.id, a.id]
+    assert retrieval.relevant_turns(user, "میگرن", exclude_ids=[a.id]) == []
+
+
+@pytest.mark.django_db
+def test_index_update_without_returned_pks_is_incremental_and_idempotent(user, django_assert_num_queries):
+    session = ChatSession.objects.create(user=user)
+    _turn(session, "سرفهٔ خشک دارم", "شربت بخورید")
+    retrieval.relevant_turns(user, "میگرن")
+    q, a = _turn(session, "میگرن شدید دارم", "سوماتریپتان")
+    # MySQL: bulk_create شناسه برنمی‌گرداند
+    unsaved = [ChatMessage(session=session, user=user, message=m.message, is_bot=m.is_bot) for m in (q, a)]
+
+    for _ in range(2):
+        with django_assert_num_queries(1):  # فقط پیام‌های اخیر سشن، نه بازسازی کل ایندکس
+            retrieval.index_messages(unsaved)
+
+    index = cache.get(retrieval._key(user.pk))
+    assert len(index["turns"]) == 2 and index["turns"][q.id][0] == a.id
+    assert index["df"]["میگرن"] == 1 and index["turns"][q.id][2]["میگرن"] == 1
+
+
+@pytest.mark.django_db
+def test_index_is_not_overwritten_while_another_update_holds_the_lock(user, monkeypatch):
+    session = ChatSession.objects.create(user=user)
+    _turn(session, "سرفهٔ خشک دارم", "شربت بخورید")
+    retrieval.relevant_turns(user, "سرفه")
+    new = _turn(session, "میگرن شدید دارم", "سوماتریپتان")
+    monkeypatch.setattr(retrieval, "LOCK_WAIT_SEC", 0)
+    cache.add(f"chat:bm25:lock:{user.pk}", 1)
+
+    retrieval.index_messages(new)
+    assert "میگرن" not in cache.get(retrieval._key(user.pk))["df"]
+
+    cache.delete(f"chat:bm25:lock:{user.pk}")
+    retrieval.index_messages(new)
+    assert cache.get(retrieval._key(user.pk))["df"]["میگرن"] == 1
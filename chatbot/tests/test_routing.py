@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+from django.core.cache import cache
+
+from chatbot import generateresponse, routing
+from chatbot.routing import choose_route, record_latency
+from sub.models import Subscription
+
+ROUTES = {
+    "vision": {"model": "vision-m", "max_tokens": 1500, "timeout": 60},
+    "text_strong": {"model": "strong-m", "max_tokens": 1500, "timeout": 45, "slow_ms": 5000, "fallback": "text"},
+    "text": {"model": "cheap-m", "max_tokens": 800, "timeout": 20},
+}
+
+
+@pytest.fixture(autouse=True)
+def routes(monkeypatch):
+    cache.clear()
+    monkeypatch.setattr(routing, "ROUTES", ROUTES)
+    monkeypatch.setattr(routing, "LONG_PROMPT_CHARS", 1000)
+
+
+@pytest.mark.django_db
+def test_routes_by_request_features(user, monkeypatch):
+    assert choose_route(user, has_images=True, prompt_chars=10).model == "vision-m"
+    assert choose_route(user, has_images=False, prompt_chars=10)[:4] == ("text", "cheap-m", 800, 20.0)
+    assert choose_route(user, has_images=False, prompt_chars=5000).route == "text_strong"
+    assert choose_route(user, has_images=False, prompt_chars=10, force_model="x").model == "x"
+
+    monkeypatch.setattr(routing, "PREMIUM_PLAN_IDS", frozenset({Subscription.objects.get(user=user).plan_id}))
+    assert choose_route(user, has_images=False, prompt_chars=10).route == "text_strong"
+
+    for _ in range(5):
+        record_latency("strong-m", 30_000)
+    slow = choose_route(user, has_images=False, prompt_chars=5000)
+    assert slow.route == "text" and "slow" in slow.reason
+    assert routing.stats()["text"]["count"] == 2
+
+
+@pytest.mark.django_db
+def test_text_turn_uses_text_route(user, monkeypatch):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="استراحت کنید"))], usage=None)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(generateresponse, "_get_client", lambda: client)
+    generateresponse.generate_gpt_response(user, "گلو درد دارم")
+
+    assert (calls[0]["model"], calls[0]["max_tokens"], calls[0]["timeout"]) == ("cheap-m", 800, 20.0)
+    assert routing.model_latency_ms("cheap-m") is not None
@@ -0,0 +1,43 @@
+import pytest
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from chatbot.models import ChatMessage, ChatSession
+from chatbot.search import search_messages
+from chatbot.utils.normalize import normalize_persian
+
+
+def test_normalize_persian_unifies_letters_digits_and_zwnj():
+    assert normalize_persian("مي‌خواهم كتاب ۱۲۳ دَرد") == "می خواهم کتاب 123 درد"
+
+
+@pytest.mark.django_db
+def test_search_matches_arabic_letters_and_persian_digits(user):
+    session = ChatSession.objects.create(user=user)
+    ChatMessage.objects.bulk_create([
+        ChatMessage(session=session, user=user, message="دوز آموكسي‌سيلين ۵۰۰ ميلي‌گرم هر ۸ ساعت", is_bot=True),
+        ChatMessage(session=session, user=user, message="سرما خوردگی دارم"),
+    ])
+    qs = ChatMessage.objects.filter(user=user)
+
+    hits = list(search_messages(qs, "آموکسی سیلین 500"))
+    assert [m.is_bot for m in hits] == [True]
+    assert not search_messages(qs, "پنی‌سیلین").exists()
+
+
+@pytest.mark.django_db
+def test_search_api_is_user_scoped(user):
+    from django.contrib.auth import get_user_model
+
+    other = get_user_model().objects.create_user(phone_number="09120000003", password="x")
+    for u in (user, other):
+        s = ChatSession.objects.create(user=u)
+        ChatMessage.objects.create(session=s, user=u, message="سردرد شدید")
+
+    client = APIClient()
+    client.force_authenticate(user)
+    resp = client.get(reverse("chat_history_search"), {"q": "سردرد"})
+
+    assert resp.status_code == 200
+    assert len(resp.data["results"]) == 1
+    assert ChatMessage.objects.get(pk=resp.data["results"][0]["id"]).user_id == user.pk
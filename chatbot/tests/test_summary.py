@@ -0,0 +1,292 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from django.contrib.auth import get_user_model
+
+from chatbot.models import ChatMessage, ChatSession, ChatSummary
+from chatbot.utils import text_summary
+
+User = get_user_model()
+
+
+@pytest.mark.django_db
+def test_global_summary_upsert_keeps_single_row(user, fake_summarizer):
+    session = ChatSession.objects.create(user=user)
+    ChatMessage.objects.create(session=session, user=user, message="سردرد دارم")
+
+    first = text_summary.summarize_user_chats(user)
+    second = text_summary.summarize_user_chats(user, full=True)
+
+    assert first.pk == second.pk
+    assert second.rewritten_text == "summary #2"
+    assert ChatSummary.objects.filter(user=user, session=None).count() == 1
+
+
+@pytest.mark.django_db
+def test_global_summary_uniqueness_is_enforced_without_partial_index(user):
+    from django.db import IntegrityError, transaction
+
+    ChatSummary.objects.create(user=user, rewritten_text="a")
+    session = ChatSession.objects.create(user=user)
+    assert ChatSummary.objects.create(user=user, session=session, rewritten_text="b").scope == session.pk
+    with pytest.raises(IntegrityError), transaction.atomic():
+        ChatSummary.objects.create(user=user, rewritten_text="c")
+    assert all(c.condition is None for c in ChatSummary._meta.constraints)
+
+
+@pytest.mark.django_db
+def test_session_summary_is_reused_within_ttl(user, fake_summarizer):
+    session = ChatSession.objects.create(user=user)
+    ChatMessage.objects.create(session=session, user=user, message="تب دارم")
+
+    a = text_summary.get_or_update_session_summary(session)
+    b = text_summary.get_or_update_session_summary(session)
+
+    assert a.pk == b.pk
+    assert len(fake_summarizer) == 1
+    assert ChatSummary.objects.filter(user=user, session=session).count() == 1
+
+
+@pytest.mark.django_db
+def test_stale_refresh_loses_to_concurrent_writer(user, fake_summarizer):
+    session = ChatSession.objects.create(user=user)
+    ChatMessage.objects.create(session=session, user=user, message="سرفه دارم")
+    base = text_summary.get_or_update_session_summary(session)
+
+    # رفرش‌کنندهٔ دیگری زودتر نوشته است
+    ChatSummary.objects.filter(pk=base.pk).update(rewritten_text="winner", version=base.version + 1)
+
+    result = text_summary._write_summary(user, session, base, {"rewritten_text": "loser"})
+    assert result.rewritten_text == "winner"
+    assert ChatSummary.objects.get(pk=base.pk).rewritten_text == "winner"
+
+
+@pytest.mark.django_db
+def test_global_refresh_sends_only_new_messages(user, fake_summarizer):
+    session = ChatSession.objects.create(user=user)
+    ChatMessage.objects.create(session=session, user=user, message="قدیمی")
+    first = text_summary.summarize_user_chats(user)
+
+    newer = ChatMessage.objects.create(session=session, user=user, message="جدید")
+    second = text_summary.summarize_user_chats(user)
+
+    text, previous = fake_summarizer[-1]
+    assert "جدید" in text and "قدیمی" not in text
+    assert previous == first.rewritten_text
+    assert second.last_message_id == newer.id
+
+    # بدون پیام جدید، خلاصه‌ساز فراخوانی نمی‌شود
+    text_summary.summarize_user_chats(user)
+    assert len(fake_summarizer) == 2
+
+    # بازسازی کامل همهٔ تاریخچه را می‌فرستد
+    text_summary.summarize_user_chats(user, full=True)
+    text, previous = fake_summarizer[-1]
+    assert "قدیمی" in text and previous == ""
+
+
+@pytest.mark.django_db
+def test_serialize_conversation_keeps_newest_within_budget(user, monkeypatch, django_assert_num_queries):
+    monkeypatch.setattr(text_summary, "RAW_CLIP_CHARS", 120)
+    sessions = [ChatSession.objects.create(user=user) for _ in range(3)]
+    msgs = [
+        ChatMessage.objects.create(session=s, user=user, message=f"پیام {i}-{j}")
+        for i, s in enumerate(sessions)
+        for j in range(5)
+    ]
+
+    with django_assert_num_queries(1):
+        text, _, newest_id = text_summary._serialize_conversation(sessions)
+
+    assert newest_id == msgs[-1].id
+    assert len(text) <= 120
+    assert text.endswith("پیام 2-4")
+    assert "پیام 0-0" not in text
+
+
+@pytest.mark.django_db
+def test_summary_stores_pointers_and_rebuilds_raw_text(user, fake_summarizer):
+    session = ChatSession.objects.create(user=user)
+    first = ChatMessage.objects.create(session=session, user=user, message="درد شکم")
+    last = ChatMessage.objects.create(session=session, user=user, message="استراحت کنید", is_bot=True)
+
+    summary = text_summary.get_or_update_session_summary(session)
+    sent_text, _ = fake_summarizer[-1]
+
+    assert summary.raw_text == ""
+    assert (summary.first_message_id, summary.last_message_id) == (first.id, last.id)
+    assert summary.raw_chars == len(sent_text)
+    rebuilt = text_summary.rebuild_raw_text(summary)
+    assert rebuilt == sent_text
+    assert text_summary.raw_text_digest(rebuilt) == summary.raw_sha256
+
+
+@pytest.mark.django_db
+def test_shrink_command_keeps_legacy_raw_text_reconstructable(user):
+    from datetime import timedelta
+    from io import StringIO
+
+    from django.core.management import call_command
+    from django.utils import timezone
+
+    session = ChatSession.objects.create(user=user)
+    ChatMessage.objects.create(session=session, user=user, message="پیام قبلی سشن دیگر",
+                               created_at=timezone.now() - timedelta(hours=1))
+    first = ChatMessage.objects.create(session=session, user=user, message="سرفه دارم")
+    last = ChatMessage.objects.create(session=session, user=user, message="شربت بخورید", is_bot=True)
+    # متن خام قدیمی از پیام‌های دوم و سوم ساخته شده بود
+    old_text = "\n".join(text_summary._format_message(m) for m in (first, last))
+    legacy = ChatSummary.objects.create(user=user, session=session, raw_text=old_text, rewritten_text="x")
+    # پیام بعد از خلاصه نباید وارد بازه شود
+    ChatMessage.objects.create(session=session, user=user, message="بعدی",
+                               created_at=timezone.now() + timedelta(hours=1))
+    orphan = ChatSummary.objects.create(user=user, raw_text="متن قدیمی", rewritten_text="y")
+
+    out = StringIO()
+    call_command("shrink_summary_raw_text", "--batch-size", "1", stdout=out)
+
+    legacy.refresh_from_db()
+    assert legacy.raw_text == ""
+    assert (legacy.first_message_id, legacy.last_message_id) == (first.id, last.id)
+    assert legacy.raw_chars == len(old_text)
+    assert text_summary.rebuild_raw_text(legacy) == old_text
+    assert legacy.raw_sha256 == text_summary.raw_text_digest(old_text)
+
+    orphan.refresh_from_db()
+    assert orphan.raw_text == "متن قدیمی"
+    assert f"could not be determined: {orphan.pk}" in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_nightly_all_skips_users_without_new_messages(user, fake_summarizer):
+    from django.core.management import call_command
+
+    idle = User.objects.create_user(phone_number="09120000001", password="x")
+    ChatMessage.objects.create(session=ChatSession.objects.create(user=idle), user=idle, message="قبلاً خلاصه شده")
+    text_summary.summarize_user_chats(idle)
+
+    ChatMessage.objects.create(session=ChatSession.objects.create(user=user), user=user, message="جدید")
+    fake_summarizer.clear()
+
+    assert [u.pk for u in text_summary.users_with_new_messages()] == [user.pk]
+    call_command("summarize_chats", "--all", "--workers", "1")
+    assert len(fake_summarizer) == 1
+    assert not text_summary.users_with_new_messages().exists()
+
+
+class _FakeClient:
+    """شبیه‌ساز حداقلی client.chat.completions.create که پاسخ ثابت برمی‌گرداند."""
+
+    def __init__(self, content):
+        self.requests = []
+        self._content = content
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self._content))])
+
+
+def _short_sessions(user, n):
+    sessions = []
+    for i in range(n):
+        s = ChatSession.objects.create(user=user, is_open=False)
+        ChatMessage.objects.create(session=s, user=user, message=f"سؤال کوتاه {i}")
+        sessions.append(s)
+    return sessions
+
+
+@pytest.mark.django_db
+def test_batch_packs_short_sessions_into_one_request(user, fake_summarizer, monkeypatch):
+    sessions = _short_sessions(user, 3)
+    payload = [{"id": s.pk, "summary": f"خلاصه {s.pk}", "symptoms": "سردرد"} for s in sessions]
+    client = _FakeClient(json.dumps(payload, ensure_ascii=False))
+    monkeypatch.setattr(text_summary, "_get_client", lambda: client)
+
+    stats = text_summary.summarize_sessions_batch([s.pk for s in sessions])
+
+    assert stats == {"local": 0, "packed": 3, "single": 0, "requests": 1}
+    assert len(client.requests) == 1 and not fake_summarizer
+    for s in sessions:
+        summary = ChatSummary.objects.get(session=s)
+        assert summary.rewritten_text == f"خلاصه {s.pk}"
+        assert summary.structured_json["symptoms"] == "سردرد"
+    assert not text_summary.sessions_needing_summary().exists()
+
+
+@pytest.mark.django_db
+def test_batch_falls_back_per_session_on_unparseable_reply(user, fake_summarizer, monkeypatch):
+    sessions = _short_sessions(user, 2)
+    monkeypatch.setattr(text_summary, "_get_client", lambda: _FakeClient("not json"))
+
+    stats = text_summary.summarize_sessions_batch([s.pk for s in sessions])
+
+    assert stats["packed"] == 0 and stats["single"] == 2
+    assert len(fake_summarizer) == 2
+    assert ChatSummary.objects.filter(session__in=sessions).count() == 2
+
+
+@pytest.mark.django_db
+def test_malformed_batch_json_falls_back_to_llm_without_outage(user, fake_summarizer, monkeypatch):
+    sessions = _short_sessions(user, 2)
+    reply = '[{"id": %d, "summary": "x",}]' % sessions[0].pk  # ویرگول اضافه ← JSON نامعتبر
+    monkeypatch.setattr(text_summary, "_get_client", lambda: _FakeClient(reply))
+
+    stats = text_summary.summarize_sessions_batch([s.pk for s in sessions])
+
+    assert stats["single"] == 2 and len(fake_summarizer) == 2
+    assert not text_summary._llm_down()
+    assert set(ChatSummary.objects.filter(session__in=sessions).values_list("model_used", flat=True)) != {
+        text_summary.LOCAL_MODEL_NAME
+    }
+
+
+@pytest.mark.django_db
+def test_batch_transport_error_marks_outage(user, fake_summarizer, monkeypatch):
+    class _Down(_FakeClient):
+        def _create(self, **kwargs):
+            raise ConnectionError("reset by peer")
+
+    sessions = _short_sessions(user, 2)
+    monkeypatch.setattr(text_summary, "_get_client", lambda: _Down(""))
+
+    text_summary.summarize_sessions_batch([s.pk for s in sessions])
+
+    assert text_summary._llm_down()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("clip", [False, True])
+def test_shrink_command_handles_legacy_global_order(user, monkeypatch, clip):
+    from datetime import timedelta
+    from io import StringIO
+
+    from django.core.management import call_command
+    from django.utils import timezone
+
+    now = timezone.now()
+    older = ChatSession.objects.create(user=user, started_at=now - timedelta(days=2))
+    newer = ChatSession.objects.create(user=user, started_at=now - timedelta(days=1))
+    msgs = {}
+    for session, texts, age in ((older, ("سرفه دارم", "شربت بخورید"), 2), (newer, ("تب دارم", "استراحت کنید"), 1)):
+        msgs[session.pk] = [
+            ChatMessage.objects.create(session=session, user=user, message=t, is_bot=bool(i),
+                                       created_at=now - timedelta(days=age) + timedelta(minutes=i))
+            for i, t in enumerate(texts)
+        ]
+    # قالب قدیمی summarize_user_chats: سشن‌ها به ترتیب -started_at و بریدن با «…»
+    lines = [text_summary._format_message(m) for m in msgs[newer.pk] + msgs[older.pk]]
+    if clip:  # بریدن وسط پیام اول سشن قدیمی‌تر
+        monkeypatch.setattr(text_summary, "RAW_CLIP_CHARS", len("\n".join(lines[:3])) - 5)
+    old_text = text_summary._clip("\n".join(lines), text_summary.RAW_CLIP_CHARS)
+    legacy = ChatSummary.objects.create(user=user, raw_text=old_text, rewritten_text="x")
+
+    out = StringIO()
+    call_command("shrink_summary_raw_text", stdout=out)
+
+    assert "Shrunk 1 " in out.getvalue() and "Skipped" not in out.getvalue()
+    legacy.refresh_from_db()
+    assert legacy.raw_text == "" and legacy.raw_layout == ChatSummary.LAYOUT_SESSIONS
+    assert text_summary.rebuild_raw_text(legacy) == old_text
+    assert legacy.raw_sha256 == text_summary.raw_text_digest(old_text)
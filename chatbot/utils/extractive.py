@@ -0,0 +1,134 @@
+# chatbot/utils/extractive.py
+# خلاصه‌ساز استخراجی محلی (TextRank روی جمله‌های فارسی) برای سشن‌های کوتاه
+# و به‌عنوان حالت تنزل‌یافته هنگام قطعی سرویس LLM.
+from __future__ import annotations
+
+import math
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from chatbot.utils.normalize import search_tokens
+
+SUMMARY_SECTIONS = ("history", "symptoms", "medications", "recommendations")
+MAX_SENTENCES = 300          # جمله‌های جدیدتر نگه داشته می‌شوند (هزینهٔ TextRank درجهٔ دو است)
+MAX_SUMMARY_SENTENCES = 8
+MAX_SECTION_SENTENCES = 3
+_DAMPING = 0.85
+_ITERATIONS = 30
+
+_LINE_RE = re.compile(r"^\[[^\]]*\]\s*(USER|ASSISTANT):\s*(.*)$")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?؟؛])\s+")
+
+# کلیدواژه‌ها روی توکن‌های کامل متن یکسان‌سازی‌شده تطبیق داده می‌شوند (نه زیررشته: «تب» با «مرتب»
+# یا «اعتبار» جور نمی‌شود)؛ آخرین کلمه فقط پسوندهای _SUFFIXES را می‌پذیرد (دردم، داروهای، تبش).
+_SECTION_KEYWORDS = {
+    "history": ("سابقه", "تاریخچه", "زمینه ای", "جراحی", "عمل کرده", "حساسیت", "آلرژی", "دیابت",
+                "فشار خون", "بیماری قلبی", "آسم", "بارداری", "باردار"),
+    "symptoms": ("درد", "تب", "سرفه", "تهوع", "استفراغ", "سرگیجه", "خارش", "اسهال", "یبوست",
+                 "تنگی نفس", "خستگی", "بی خوابی", "ورم", "التهاب", "خونریزی", "سوزش", "علائم"),
+    "medications": ("دارو", "قرص", "کپسول", "شربت", "آمپول", "پماد", "قطره", "mg", "میلی گرم",
+                    "دوز", "مصرف"),
+    "recommendations": ("پیشنهاد", "توصیه", "درمان", "ارجاع", "مراجعه", "استراحت", "ویزیت",
+                        "آزمایش", "بنوشید", "پرهیز", "بهتر است"),
+}
+_SUFFIXES = frozenset(("", "م", "ت", "ش", "ی", "ه", "ها", "های", "ام", "ای", "ات", "اش", "مان", "تان", "شان", "ناک"))
+
+
+def _has_keyword(words: List[str], phrase: str) -> bool:
+    parts = phrase.split()
+    n = len(parts)
+    for i in range(len(words) - n + 1):
+        if words[i:i + n - 1] != parts[:-1]:
+            continue
+        last = words[i + n - 1]
+        if last.startswith(parts[-1]) and last[len(parts[-1]):] in _SUFFIXES:
+            return True
+    return False
+
+
+class _Sentence:
+    __slots__ = ("text", "role", "tokens", "words")
+
+    def __init__(self, text: str, role: Optional[str]):
+        self.text = text
+        self.role = role
+        self.words = search_tokens(text)
+        self.tokens = set(self.words)
+
+
+def _sentences(text: str) -> List[_Sentence]:
+    out: List[_Sentence] = []
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        m = _LINE_RE.match(line)
+        role, body = (m.group(1), m.group(2)) if m else (None, line)
+        for part in _SENTENCE_SPLIT_RE.split(body):
+            part = part.strip()
+            if part:
+                s = _Sentence(part, role)
+                if len(s.tokens) >= 2:
+                    out.append(s)
+    return out[-MAX_SENTENCES:]
+
+
+def _textrank(sentences: List[_Sentence]) -> List[float]:
+    """وزن یال = هم‌پوشانی واژه‌ها / (log|A| + log|B|)، مثل مقالهٔ اصلی TextRank."""
+    n = len(sentences)
+    postings: Dict[str, List[int]] = defaultdict(list)
+    for i, s in enumerate(sentences):
+        for t in s.tokens:
+            postings[t].append(i)
+
+    overlap: Dict[Tuple[int, int], int] = defaultdict(int)
+    for ids in postings.values():
+        for a in range(len(ids)):
+            for b in range(a + 1, len(ids)):
+                overlap[(ids[a], ids[b])] += 1
+
+    edges: List[Dict[int, float]] = [dict() for _ in range(n)]
+    for (i, j), common in overlap.items():
+        w = common / (math.log(len(sentences[i].tokens) + 1) + math.log(len(sentences[j].tokens) + 1))
+        edges[i][j] = edges[j][i] = w
+    out_weight = [sum(e.values()) for e in edges]
+
+    scores = [1.0] * n
+    for _ in range(_ITERATIONS):
+        scores = [
+            (1 - _DAMPING) + _DAMPING * sum(w * scores[j] / out_weight[j] for j, w in edges[i].items())
+            for i in range(n)
+        ]
+    return scores
+
+
+def _section_of(s: _Sentence) -> List[str]:
+    hits = [k for k, words in _SECTION_KEYWORDS.items() if any(_has_keyword(s.words, w) for w in words)]
+    if s.role == "USER" and "recommendations" in hits:
+        hits.remove("recommendations")  # توصیه از طرف پزشک/دستیار معنا دارد
+    return hits
+
+
+def summarize_extractive(text: str, *, previous: str = "") -> Tuple[str, Dict[str, str]]:
+    """
+    خلاصهٔ استخراجی: (متن خلاصه، {history, symptoms, medications, recommendations}).
+    در حالت افزایشی، جمله‌های خلاصهٔ قبلی هم در رتبه‌بندی شرکت می‌کنند.
+    """
+    sentences = _sentences(f"{previous}\n{text}" if previous else text)
+    if not sentences:
+        return "", {k: "" for k in SUMMARY_SECTIONS}
+
+    scores = _textrank(sentences)
+    ranked = sorted(range(len(sentences)), key=lambda i: -scores[i])
+
+    n_summary = max(2, min(MAX_SUMMARY_SENTENCES, math.ceil(len(sentences) * 0.25)))
+    summary = "\n".join(sentences[i].text for i in sorted(ranked[:n_summary]))
+
+    picked: Dict[str, List[int]] = {k: [] for k in SUMMARY_SECTIONS}
+    for i in ranked:
+        for section in _section_of(sentences[i]):
+            if len(picked[section]) < MAX_SECTION_SENTENCES:
+                picked[section].append(i)
+    sections = {k: "\n".join(sentences[i].text for i in sorted(ids)) for k, ids in picked.items()}
+    return summary, sections
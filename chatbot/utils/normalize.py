@@ -0,0 +1,37 @@
+# chatbot/utils/normalize.py
+# یکسان‌سازی متن فارسی برای ایندکس/جستجو
+from __future__ import annotations
+
+import re
+from typing import List
+
+_CHAR_MAP = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی",
+    "ك": "ک",
+    "ۀ": "ه", "ة": "ه",
+    "أ": "ا", "إ": "ا", "ٱ": "ا",
+    "ؤ": "و",
+    "\u200c": " ",  # ZWNJ (نیم‌فاصله)
+    "\u200f": None, "\u200e": None,  # RLM / LRM
+    "\u0640": None,  # کشیده
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # ارقام فارسی
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # ارقام عربی
+})
+
+_DIACRITICS_RE = re.compile("[\u064b-\u065f\u0670]")  # اعراب
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_persian(text: str) -> str:
+    """
+    ي/ك عربی ← ی/ک فارسی، حذف اعراب و کشیده، نیم‌فاصله ← فاصله، ارقام ← ASCII، حروف کوچک.
+    """
+    if not text:
+        return ""
+    text = _DIACRITICS_RE.sub("", text.translate(_CHAR_MAP))
+    return _SPACE_RE.sub(" ", text).strip().lower()
+
+
+def search_tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(normalize_persian(text))
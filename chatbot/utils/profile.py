@@ -0,0 +1,66 @@
+# chatbot/utils/profile.py
+# پروفایل فشردهٔ بیمار از structured_json خلاصه‌ها برای تزریق در پرامپت (به‌جای متن خلاصهٔ بلند)
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional, Set
+
+from chatbot.utils.extractive import SUMMARY_SECTIONS
+from chatbot.utils.normalize import search_tokens
+
+MAX_ITEMS_PER_SECTION = 5
+MAX_ITEM_CHARS = 80
+
+_ITEM_SPLIT_RE = re.compile(r"[\n;؛،•]+|(?:^|\s)[-*]\s+")
+_EDGE_PUNCT = " \t.,:،؛;-–*•"
+
+
+def _items(value) -> List[str]:
+    if isinstance(value, (list, tuple)):
+        parts = [str(v) for v in value]
+    elif isinstance(value, str):
+        parts = _ITEM_SPLIT_RE.split(value)
+    else:
+        return []
+    out = []
+    for p in parts:
+        p = p.strip(_EDGE_PUNCT)
+        if p:
+            out.append(p if len(p) <= MAX_ITEM_CHARS else p[: MAX_ITEM_CHARS - 1] + "…")
+    return out
+
+
+def _dedupe(items: List[str], limit: int) -> List[str]:
+    """
+    تکراری‌ها (پس از یکسان‌سازی) حذف می‌شوند؛ از دو مورد که واژه‌های یکی زیرمجموعهٔ دیگری است،
+    مورد دقیق‌تر (بلندتر) در جای اولی می‌ماند.
+    """
+    kept: List[str] = []
+    seen: List[Set[str]] = []
+    for item in items:
+        tokens = set(search_tokens(item))
+        if not tokens or any(tokens <= s for s in seen):
+            continue
+        wider = next((i for i, s in enumerate(seen) if s < tokens), None)
+        if wider is not None:
+            kept[wider], seen[wider] = item, tokens
+            continue
+        if len(kept) < limit:
+            kept.append(item)
+            seen.append(tokens)
+    return kept
+
+
+def build_patient_profile(structured: Optional[Dict], *, max_items: int = MAX_ITEMS_PER_SECTION) -> str:
+    """
+    structured_json (history/symptoms/medications/recommendations) → چند خط «کلید: مورد؛ مورد».
+    بخش‌های خالی حذف می‌شوند؛ اگر هیچ داده‌ای نباشد رشتهٔ خالی.
+    """
+    if not isinstance(structured, dict):
+        return ""
+    lines = []
+    for section in SUMMARY_SECTIONS:
+        items = _dedupe(_items(structured.get(section)), max_items)
+        if items:
+            lines.append(f"{section}: " + "; ".join(items))
+    return "\n".join(lines)
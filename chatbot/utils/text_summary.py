@@ -2,6 +2,8 @@
 # خلاصه مکالمات با OpenAI-compatible SDK (GapGPT) - مدل پیش‌فرض: o3-mini
 from __future__ import annotations
 
+import hashlib
+import heapq
 import json
 import logging
 import re
@@ -9,12 +11,19 @@ from datetime import timedelta
 from typing import Dict, List, Optional, Tuple
 
 from django.conf import settings
-from django.db import transaction
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Length
 from django.utils import timezone
 
-from chatbot.models import ChatSession, ChatSummary
+from chatbot.archive import archived_messages, iter_archived_messages_desc
+from chatbot.models import ChatMessage, ChatSession, ChatSummary
+from chatbot.utils.extractive import SUMMARY_SECTIONS, summarize_extractive
 
 logger = logging.getLogger(__name__)
+User = get_user_model()
 
 try:
     from openai import OpenAI
@@ -42,6 +51,19 @@ SESSION_TTL_MIN = 30
 RAW_CLIP_CHARS = 50_000
 SUMMARY_CLIP_CHARS = int(getattr(settings, "SUMMARY_CLIP_CHARS", 4_000))
 
+# بسته‌بندی چند سشن کوتاه در یک درخواست خلاصه‌ساز (حالت batch)
+PACK_SESSION_MAX_CHARS = int(getattr(settings, "SUMMARY_PACK_SESSION_MAX_CHARS", 3_000))
+PACK_MAX_CHARS = int(getattr(settings, "SUMMARY_PACK_MAX_CHARS", 16_000))
+PACK_MAX_SESSIONS = int(getattr(settings, "SUMMARY_PACK_MAX_SESSIONS", 12))
+
+# متن‌های کوتاه‌تر از این فقط با خلاصه‌ساز استخراجی محلی خلاصه می‌شوند (بدون فراخوانی LLM)
+LOCAL_SUMMARY_MAX_CHARS = int(getattr(settings, "SUMMARY_LOCAL_MAX_CHARS", 1_500))
+LOCAL_MODEL_NAME = "local-textrank"
+# پس از خطای سرویس، تا این مدت (ثانیه) همهٔ خلاصه‌ها محلی ساخته می‌شوند
+OUTAGE_COOLDOWN_SEC = int(getattr(settings, "SUMMARY_OUTAGE_COOLDOWN_SEC", 120))
+_OUTAGE_KEY = "chat:summarizer:down"
+
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.S)
 _JSON_BLOCK_RE = re.compile(r"\{(?:[^{}]|(?:\{[^{}]*\}))*\}", re.S)
 
 def _ensure_text(x) -> str:
@@ -60,15 +82,152 @@ def _clip(s: str, n: int) -> str:
         return s
     return s[: max(0, n - 1)] + "…"
 
-def _serialize_conversation(sessions: List[ChatSession]) -> str:
+def _format_message(m) -> str:
+    role = "USER" if not m.is_bot else "ASSISTANT"
+    ts = m.created_at.strftime("%Y-%m-%d %H:%M")
+    return f"[{ts}] {role}: {m.message}"
+
+# فقط ستون‌های لازم برای سریال‌سازی؛ chunk کوچک تا پس از پر شدن بودجه خواندن زود متوقف شود
+_MESSAGE_FIELDS = ("id", "session_id", "is_bot", "message", "created_at")
+_ITER_CHUNK = 200
+
+def _take_within_budget(messages) -> Tuple[List[str], Optional[int], Optional[int]]:
+    """
+    خطوط را تا سقف RAW_CLIP_CHARS برمی‌دارد و همان‌جا خواندن از cursor را قطع می‌کند.
+    id اولین و آخرین پیامِ برداشته‌شده (به ترتیب پیمایش) را هم برمی‌گرداند.
+    """
     lines: List[str] = []
-    for s in sessions:
-        for m in s.messages.select_related("user").order_by("created_at"):
-            role = "USER" if not m.is_bot else "ASSISTANT"
-            ts = m.created_at.strftime("%Y-%m-%d %H:%M")
-            lines.append(f"[{ts}] {role}: {m.message}")
+    size = 0
+    first_id = last_id = None
+    for m in messages:
+        line = _format_message(m)
+        if lines and size + len(line) + 1 > RAW_CLIP_CHARS:
+            break
+        lines.append(line)
+        size += len(line) + 1
+        if first_id is None:
+            first_id = m.id
+        last_id = m.id
+    return lines, first_id, last_id
+
+def _iter_messages(qs):
+    return qs.only(*_MESSAGE_FIELDS).iterator(chunk_size=_ITER_CHUNK)
+
+def _serialize_conversation(sessions) -> Tuple[str, Optional[int], Optional[int]]:
+    """
+    جدیدترین پیام‌های سشن‌های داده‌شده (لیست یا QuerySet) را با یک کوئری و تا سقف
+    RAW_CLIP_CHARS برمی‌دارد و به ترتیب زمانی برمی‌گرداند؛ همراه با بازهٔ (قدیمی‌ترین، جدیدترین) id.
+    """
+    qs = ChatMessage.objects.filter(session__in=sessions).order_by("-id")
+    # پیام‌های سشن‌های بایگانی‌شده (chatbot.archive) هم به ترتیب id وارد می‌شوند؛ فایل‌ها تنبل
+    # و از جدید به قدیم باز می‌شوند تا با پر شدن سقف، فایل‌های قدیمی‌تر اصلاً خوانده نشوند
+    archived = iter_archived_messages_desc(sessions)
+    messages = heapq.merge(_iter_messages(qs), archived, key=lambda m: -m.id)
+    lines, newest_id, oldest_id = _take_within_budget(messages)
+    lines.reverse()
+    return _clip("\n".join(lines), RAW_CLIP_CHARS), oldest_id, newest_id
+
+def _serialize_new_messages(qs) -> Tuple[str, Optional[int], Optional[int]]:
+    """
+    پیام‌های جدید (به ترتیب id) را تا سقف RAW_CLIP_CHARS سریال می‌کند و بازهٔ id پیام‌های
+    واردشده را برمی‌گرداند؛ مازاد در رفرش بعدی برداشته می‌شود.
+    """
+    lines, first_id, last_id = _take_within_budget(_iter_messages(qs.order_by("id")))
+    return _clip("\n".join(lines), RAW_CLIP_CHARS), first_id, last_id
+
+def _summary_sessions(summary: ChatSummary):
+    return ChatSession.objects.filter(
+        **({"pk": summary.session_id} if summary.session_id else {"user_id": summary.user_id})
+    )
+
+def _legacy_order(messages: List[ChatMessage], sessions) -> List[ChatMessage]:
+    """ترتیب متن خام قدیمی: سشن‌ها از جدید به قدیم (started_at)، پیام‌های هر سشن به ترتیب زمان."""
+    started = dict(sessions.values_list("id", "started_at"))
+    ordered = sorted(messages, key=lambda m: (m.created_at, m.id))
+    ordered.sort(key=lambda m: (started.get(m.session_id) or m.created_at, m.session_id or 0), reverse=True)
+    return ordered
+
+def rebuild_raw_text(summary: ChatSummary) -> str:
+    """
+    متن ورودی خلاصه‌ساز را از روی بازهٔ پیام‌های ذخیره‌شده بازسازی می‌کند (با ترتیب raw_layout).
+    صحت آن را می‌توان با summary.raw_sha256 سنجید.
+    """
+    if summary.raw_text:  # ردیف‌های قدیمی که هنوز کوچک نشده‌اند
+        return summary.raw_text
+    if summary.first_message_id is None or summary.last_message_id is None:
+        return ""
+    scope = {"session_id": summary.session_id} if summary.session_id else {"user_id": summary.user_id}
+    lo, hi = summary.first_message_id, summary.last_message_id
+    qs = ChatMessage.objects.filter(id__gte=lo, id__lte=hi, **scope).order_by("id")
+    sessions = _summary_sessions(summary)
+    archived = [m for m in archived_messages(sessions) if lo <= m.id <= hi]
+    messages = heapq.merge(archived, _iter_messages(qs), key=lambda m: m.id)
+    if summary.raw_layout == ChatSummary.LAYOUT_SESSIONS:
+        messages = _legacy_order(list(messages), sessions)
+    lines = [_format_message(m) for m in messages]
     return _clip("\n".join(lines), RAW_CLIP_CHARS)
 
+def _match_prefix(text: str, lines: List[str]) -> Optional[int]:
+    """
+    کوچک‌ترین j که _clip(lines[:j+1]) دقیقاً text شود (متن قدیمی ممکن است با «…» بریده شده باشد)؛
+    وگرنه None.
+    """
+    body = text[:-1] if text.endswith("…") else text
+    joined = ""
+    for j, line in enumerate(lines):
+        joined = f"{joined}\n{line}" if j else line
+        n = min(len(joined), len(body))
+        if joined[:n] != body[:n]:
+            return None
+        if len(joined) >= len(body) and _clip(joined, RAW_CLIP_CHARS) == text:
+            return j
+        if len(joined) > RAW_CLIP_CHARS:
+            return None
+    return None
+
+def infer_message_range(summary: ChatSummary) -> Optional[Tuple[int, int, str]]:
+    """
+    برای ردیف‌های قدیمی که فقط raw_text دارند: (first_message_id, last_message_id, raw_layout) را از
+    پیام‌های سشن/کاربر تا updated_at پیدا می‌کند، به شرطی که rebuild_raw_text دقیقاً همان متن را بسازد.
+    هر دو ترتیب امتحان می‌شود: به ترتیب id، و ترتیب خلاصه‌های سراسری قدیمی (جدیدترین سشن اول) —
+    با در نظر گرفتن بریدن متن با «…» در RAW_CLIP_CHARS.
+    اگر چنین بازه‌ای پیدا نشود (پیام حذف/ویرایش شده یا قالب ناشناخته) None.
+    """
+    text = summary.raw_text
+    if not text:
+        return None
+    scope = {"session_id": summary.session_id} if summary.session_id else {"user_id": summary.user_id}
+    sessions = _summary_sessions(summary)
+    live = ChatMessage.objects.filter(created_at__lte=summary.updated_at, **scope).order_by("id")
+    archived = [m for m in archived_messages(sessions) if m.created_at <= summary.updated_at]
+    messages = list(heapq.merge(archived, _iter_messages(live), key=lambda m: m.id))
+
+    candidates = []
+    lines = [_format_message(m) for m in messages]
+    for i, line in enumerate(lines):
+        if text.startswith(line):
+            j = _match_prefix(text, lines[i:])
+            if j is not None:
+                candidates.append((messages[i].id, messages[i + j].id, ChatSummary.LAYOUT_BY_ID))
+    if not summary.session_id:
+        legacy = _legacy_order(messages, sessions)
+        j = _match_prefix(text, [_format_message(m) for m in legacy])
+        if j is not None:
+            taken = [m.id for m in legacy[:j + 1]]
+            candidates.append((min(taken), max(taken), ChatSummary.LAYOUT_SESSIONS))
+
+    for lo, hi, layout in candidates:
+        probe = ChatSummary(
+            user_id=summary.user_id, session_id=summary.session_id,
+            first_message_id=lo, last_message_id=hi, raw_layout=layout,
+        )
+        if rebuild_raw_text(probe) == text:
+            return lo, hi, layout
+    return None
+
+def raw_text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
 def _extract_text_from_resp(resp) -> str:
     try:
         # openai-python SDK object
@@ -85,35 +244,51 @@ def _find_json_in_text(text: str) -> Optional[dict]:
     except Exception:
         return None
 
-def _simple_medical_extract(text: str) -> Dict:
-    sections = {"history": [], "symptoms": [], "medications": [], "recommendations": []}
-    for line in (text or "").splitlines():
-        t = line.strip()
-        if any(k in t for k in ("سابقه", "تاریخچه")):
-            sections["history"].append(t)
-        if any(k in t for k in ("دارو", "mg", "میلی‌گرم", "قرص")):
-            sections["medications"].append(t)
-        if any(k in t for k in ("درد", "تب", "سرفه", "تهوع", "استفراغ")):
-            sections["symptoms"].append(t)
-        if any(k in t for k in ("پیشنهاد", "توصیه", "درمان", "ارجاع")):
-            sections["recommendations"].append(t)
-    return {k: "\n".join(v) for k, v in sections.items()}
-
-def _build_summary_prompt() -> str:
+class SummarizerUnavailable(Exception):
+    """سرویس خلاصه‌ساز خطا داد یا پاسخ خالی برگرداند؛ خطای اصلی SDK در __cause__ است."""
+
+def _llm_down() -> bool:
+    return bool(cache.get(_OUTAGE_KEY))
+
+def _mark_llm_down() -> None:
+    cache.set(_OUTAGE_KEY, 1, OUTAGE_COOLDOWN_SEC)
+
+def _is_outage(exc: Exception) -> bool:
+    """فقط خطای انتقال/timeout یا 5xx سرویس قطعی حساب می‌شود (نه پاسخ بدشکل یا خطای 4xx)."""
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return int(status) >= 500
+    if OpenAI is not None:
+        import openai
+        if isinstance(exc, openai.APIConnectionError):  # شامل APITimeoutError
+            return True
+    return isinstance(exc, (TimeoutError, ConnectionError))
+
+def _build_summary_prompt(*, merge: bool = False) -> str:
+    head = "تو یک پزشک باتجربه هستی. مکالمهٔ بیمار/دستیار را خلاصه کن.\n"
+    if merge:
+        head = (
+            "تو یک پزشک باتجربه هستی. خلاصهٔ قبلی و پیام‌های جدید بیمار/دستیار داده شده؛ "
+            "یک خلاصهٔ ادغام‌شده و به‌روز بنویس.\n"
+        )
     return (
-        "تو یک پزشک باتجربه هستی. مکالمهٔ بیمار/دستیار را خلاصه کن.\n"
-        "- فارسی، دقیق، کوتاه.\n"
+        head
+        + "- فارسی، دقیق، کوتاه.\n"
         "- در پایان فقط یک JSON با کلیدهای history/symptoms/medications/recommendations بده.\n"
         "- اگر داده‌ای نیست، مقدار هر کلید خالی باشد. توضیح اضافه نده."
     )
 
-def _call_summarizer(text: str) -> Tuple[str, Dict]:
+def _call_summarizer(text: str, *, previous: str = "") -> Tuple[str, Dict]:
+    """SummarizerUnavailable در صورت خطا/پاسخ خالی؛ fallback با _summarize است."""
     model = getattr(settings, "SUMMARY_MODEL_NAME", "o3-mini")
     max_tokens = int(getattr(settings, "SUMMARY_MAX_TOKENS", 900))
     try:
         client = _get_client()
-        system_prompt = _build_summary_prompt()
-        user_content = f"Conversation:\n{text}"
+        system_prompt = _build_summary_prompt(merge=bool(previous))
+        if previous:
+            user_content = f"Previous summary:\n{previous}\n\nNew messages:\n{text}"
+        else:
+            user_content = f"Conversation:\n{text}"
         resp = client.chat.completions.create(
             model=model,
             messages=[
@@ -125,88 +300,335 @@ def _call_summarizer(text: str) -> Tuple[str, Dict]:
             top_p=0.9,
         )
         content = _extract_text_from_resp(resp)
-        if not content:
-            logger.warning("Summarizer empty content.")
-            return _clip(text, SUMMARY_CLIP_CHARS), _simple_medical_extract(text)
-        js = _find_json_in_text(content) or _simple_medical_extract(content)
-        return _clip(content, SUMMARY_CLIP_CHARS), js
     except Exception as exc:
         logger.exception("Summarizer failed: %s", exc)
-        return _clip(text, SUMMARY_CLIP_CHARS), _simple_medical_extract(text)
+        raise SummarizerUnavailable(str(exc)) from exc
+    if not content:
+        raise SummarizerUnavailable("empty content")
+    js = _find_json_in_text(content) or summarize_extractive(content)[1]
+    return _clip(content, SUMMARY_CLIP_CHARS), js
+
+def _summarize_locally(text: str, *, previous: str = "") -> Tuple[str, Dict, str]:
+    summary_text, sections = summarize_extractive(text, previous=previous)
+    return _clip(summary_text, SUMMARY_CLIP_CHARS), sections, LOCAL_MODEL_NAME
+
+def _summarize(text: str, *, previous: str = "") -> Tuple[str, Dict, str]:
+    """
+    (متن خلاصه، structured_json، model_used). متن کوتاه و زمان قطعی سرویس با موتور
+    استخراجی محلی؛ بقیه با LLM. فقط قطعی واقعی (_is_outage روی خطای اصلی) سرویس را برای
+    OUTAGE_COOLDOWN_SEC «قطع» علامت می‌زند؛ پاسخ خالی، 4xx یا نبود کلید فقط همین نوبت را محلی می‌کند.
+    """
+    if len(text) + len(previous) <= LOCAL_SUMMARY_MAX_CHARS or _llm_down():
+        return _summarize_locally(text, previous=previous)
+    try:
+        summary_text, js = _call_summarizer(text, previous=previous)
+    except SummarizerUnavailable as exc:
+        if exc.__cause__ is not None and _is_outage(exc.__cause__):
+            _mark_llm_down()
+        logger.warning("Summarizer unavailable (%s); using local extractive summary.", exc)
+        return _summarize_locally(text, previous=previous)
+    return summary_text, js, getattr(settings, "SUMMARY_MODEL_NAME", "o3-mini")
+
+def _build_batch_summary_prompt() -> str:
+    return (
+        "تو یک پزشک باتجربه هستی. چند مکالمهٔ مستقل بیمار/دستیار داده شده که هرکدام با "
+        "«### SESSION <id>» شروع می‌شود. هر مکالمه را جداگانه خلاصه کن.\n"
+        "- فارسی، دقیق، کوتاه.\n"
+        "- فقط یک آرایهٔ JSON برگردان؛ برای هر مکالمه یک شیء با کلیدهای "
+        "id/summary/history/symptoms/medications/recommendations.\n"
+        "- اگر داده‌ای نیست، مقدار هر کلید خالی باشد. توضیح اضافه نده."
+    )
+
+def _call_batch_summarizer(items: List[Tuple[int, str]]) -> Dict[int, Tuple[str, Dict]]:
+    """
+    چند سشن را در یک درخواست خلاصه می‌کند: {session_id: (summary_text, structured_json)}.
+    سشن‌هایی که در پاسخ نیامده‌اند یا پاسخ قابل parse نیست، در خروجی حذف می‌شوند
+    تا فراخواننده آن‌ها را تک‌به‌تک خلاصه کند.
+    """
+    model = getattr(settings, "SUMMARY_MODEL_NAME", "o3-mini")
+    max_tokens = int(getattr(settings, "SUMMARY_BATCH_MAX_TOKENS", 2500))
+    wanted = {sid for sid, _ in items}
+    if _llm_down():
+        return {}
+    try:
+        client = _get_client()
+        user_content = "\n\n".join(f"### SESSION {sid}\n{text}" for sid, text in items)
+        resp = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": _build_batch_summary_prompt()},
+                {"role": "user", "content": user_content},
+            ],
+            max_tokens=max_tokens,
+            temperature=0.2,
+            top_p=0.9,
+        )
+    except Exception as exc:
+        logger.warning("Batch summarizer failed (%s sessions): %s", len(items), exc)
+        if _is_outage(exc):
+            _mark_llm_down()
+        return {}
+
+    # پاسخ بدشکل فقط این batch را به خلاصهٔ تک‌به‌تک (LLM) می‌فرستد؛ سرویس «قطع» علامت نمی‌خورد
+    content = _extract_text_from_resp(resp)
+    m = _JSON_ARRAY_RE.search(content)
+    if not m:
+        logger.warning("Batch summarizer returned no JSON array (%s sessions).", len(items))
+        return {}
+    try:
+        parsed = json.loads(m.group(0))
+    except ValueError as exc:
+        logger.warning("Batch summarizer returned malformed JSON (%s sessions): %s", len(items), exc)
+        return {}
+    out: Dict[int, Tuple[str, Dict]] = {}
+    for item in parsed if isinstance(parsed, list) else ():
+        if not isinstance(item, dict):
+            continue
+        try:
+            sid = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        summary = _ensure_text(item.get("summary")).strip()
+        if sid not in wanted or not summary:
+            continue
+        out[sid] = (
+            _clip(summary, SUMMARY_CLIP_CHARS),
+            {k: _ensure_text(item.get(k, "")) for k in SUMMARY_SECTIONS},
+        )
+    return out
 
 def _is_expired(obj: ChatSummary, ttl_minutes: int) -> bool:
     return (timezone.now() - obj.updated_at) > timedelta(minutes=ttl_minutes)
 
-def _dedup_keep_latest(user, session) -> Optional[ChatSummary]:
-    qs = ChatSummary.objects.filter(user=user, session=session).order_by("-updated_at")
-    items = list(qs)
-    if not items:
-        return None
-    keep = items[0]
-    if len(items) > 1:
-        ChatSummary.objects.filter(id__in=[x.id for x in items[1:]]).delete()
-        logger.warning("Dedup summaries for user=%s session=%s kept=%s deleted=%s",
-                       user.id, getattr(session, "id", None), keep.id, [x.id for x in items[1:]])
-    return keep
+def _get_summary(user, session) -> Optional[ChatSummary]:
+    # (user, scope) یکتاست؛ یک lookup ایندکس‌دار کافی است.
+    return ChatSummary.objects.filter(user=user, scope=ChatSummary.scope_for(session)).first()
+
+def _write_summary(user, session, base: Optional[ChatSummary], fields: Dict) -> ChatSummary:
+    """
+    نوشتن خوش‌بینانه: فقط اگر version از زمان خواندن base عوض نشده باشد.
+    اگر رفرش‌کنندهٔ هم‌زمان زودتر نوشته باشد، نتیجهٔ او را برمی‌گردانیم.
+    """
+    if base is None:
+        try:
+            with transaction.atomic():
+                return ChatSummary.objects.create(user=user, session=session, **fields)
+        except IntegrityError:
+            logger.info("Summary insert lost race user=%s session=%s", user.id, getattr(session, "id", None))
+            return _get_summary(user, session)
+
+    now = timezone.now()
+    updated = ChatSummary.objects.filter(pk=base.pk, version=base.version).update(
+        version=F("version") + 1, updated_at=now, **fields
+    )
+    if not updated:
+        logger.info("Summary refresh lost race user=%s session=%s", user.id, getattr(session, "id", None))
+        return _get_summary(user, session) or base
+
+    for k, v in fields.items():
+        setattr(base, k, v)
+    base.version += 1
+    base.updated_at = now
+    return base
+
+def _summary_fields(
+    raw: str, summary_text: str, json_struct: Dict, first_id: Optional[int], last_id: Optional[int],
+    model: Optional[str] = None,
+) -> Dict:
+    # متن خام ذخیره نمی‌شود؛ فقط بازهٔ پیام‌ها، طول و هش آن (rebuild_raw_text)
+    return {
+        "model_used": model or getattr(settings, "SUMMARY_MODEL_NAME", "o3-mini"),
+        "raw_text": "",
+        "raw_chars": len(raw),
+        "raw_sha256": raw_text_digest(raw),
+        "first_message_id": first_id,
+        "last_message_id": last_id,
+        "rewritten_text": summary_text,
+        "structured_json": json_struct,
+    }
+
+def _refresh_incremental(user, session, base: ChatSummary, scope: Dict) -> ChatSummary:
+    """فقط پیام‌های بعد از base.last_message_id به‌همراه خلاصهٔ قبلی ارسال می‌شوند."""
+    new_msgs = ChatMessage.objects.filter(id__gt=base.last_message_id, **scope)
+    raw, first_id, last_id = _serialize_new_messages(new_msgs)
+    if last_id is None:
+        # پیام تازه‌ای نیست؛ فقط TTL را تمدید کن
+        return _write_summary(user, session, base, {})
+    summary_text, json_struct, model = _summarize(raw, previous=base.rewritten_text)
+    return _write_summary(
+        user, session, base, _summary_fields(raw, summary_text, json_struct, first_id, last_id, model)
+    )
+
+def _refresh_full(user, session, base: Optional[ChatSummary], sessions) -> ChatSummary:
+    raw, first_id, last_id = _serialize_conversation(sessions)
+    summary_text, json_struct, model = _summarize(raw)
+    return _write_summary(
+        user, session, base, _summary_fields(raw, summary_text, json_struct, first_id, last_id, model)
+    )
+
+def _refresh_session(session, base: Optional[ChatSummary]) -> ChatSummary:
+    if base and base.last_message_id:
+        return _refresh_incremental(session.user, session, base, {"session": session})
+    return _refresh_full(session.user, session, base, [session])
+
+def _serialize_short_sessions(session_ids: List[int]) -> Dict[int, Tuple[str, int, int]]:
+    """متن کامل چند سشن کوتاه با یک کوئری: {session_id: (text, first_id, last_id)}."""
+    lines: Dict[int, List[str]] = {}
+    bounds: Dict[int, List[int]] = {}
+    qs = ChatMessage.objects.filter(session_id__in=session_ids).order_by("session_id", "id")
+    for m in qs.only("session_id", *_MESSAGE_FIELDS).iterator(chunk_size=_ITER_CHUNK):
+        lines.setdefault(m.session_id, []).append(_format_message(m))
+        bounds.setdefault(m.session_id, [m.id, m.id])[1] = m.id
+    return {sid: ("\n".join(ls), *bounds[sid]) for sid, ls in lines.items()}
+
+def _pack(items: List[Tuple[int, str]]):
+    batch: List[Tuple[int, str]] = []
+    size = 0
+    for sid, text in items:
+        if batch and (size + len(text) > PACK_MAX_CHARS or len(batch) >= PACK_MAX_SESSIONS):
+            yield batch
+            batch, size = [], 0
+        batch.append((sid, text))
+        size += len(text)
+    if batch:
+        yield batch
 
 # -------- Public API --------
-def summarize_user_chats(user, *, limit_sessions: int | None = None) -> ChatSummary:
-    qs = ChatSession.objects.filter(user=user).order_by("-started_at")
+# هیچ‌کدام از توابع زیر تراکنش را روی فراخوانی LLM باز نگه نمی‌دارند:
+# خواندن ← محاسبه بیرون از تراکنش ← نوشتن خوش‌بینانه بر اساس version.
+def summarize_user_chats(user, *, limit_sessions: int | None = None, full: bool = False) -> ChatSummary:
+    """
+    به‌روزرسانی خلاصهٔ سراسری. به‌طور پیش‌فرض افزایشی است (خلاصهٔ قبلی + پیام‌های جدید)؛
+    full=True یا limit_sessions بازسازی کامل از روی سشن‌ها را اجبار می‌کند.
+    """
+    base = _get_summary(user, None)
+    if base and base.last_message_id and not (full or limit_sessions):
+        return _refresh_incremental(user, None, base, {"user": user})
+
+    sessions = ChatSession.objects.filter(user=user)
     if limit_sessions:
-        qs = qs[:limit_sessions]
-    sessions = list(qs)
-    if not sessions:
+        sessions = list(sessions.order_by("-started_at").values_list("id", flat=True)[:limit_sessions])
+        if not sessions:
+            raise ValueError("No chat sessions found for user.")
+    elif not sessions.exists():
         raise ValueError("No chat sessions found for user.")
+    return _refresh_full(user, None, base, sessions)
 
-    raw = _serialize_conversation(sessions)
-    summary_text, json_struct = _call_summarizer(raw)
-
-    with transaction.atomic():
-        keep = _dedup_keep_latest(user, None)
-        if keep:
-            keep.model_used = getattr(settings, "SUMMARY_MODEL_NAME", "o3-mini")
-            keep.raw_text = raw
-            keep.rewritten_text = summary_text
-            keep.structured_json = json_struct
-            keep.save(update_fields=["model_used","raw_text","rewritten_text","structured_json","updated_at"])
-            return keep
-        return ChatSummary.objects.create(
-            user=user,
-            session=None,
-            model_used=getattr(settings, "SUMMARY_MODEL_NAME", "o3-mini"),
-            raw_text=raw,
-            rewritten_text=summary_text,
-            structured_json=json_struct,
+def users_with_new_messages():
+    """
+    کاربران فعالی که پیامی جدیدتر از last_message_id خلاصهٔ سراسری‌شان دارند؛
+    به ترتیب جدیدترین فعالیت (newest_msg نزولی).
+    """
+    summarized_upto = ChatSummary.objects.filter(
+        user=OuterRef("pk"), session__isnull=True
+    ).values("last_message_id")[:1]
+    return (
+        User.objects.filter(is_active=True)
+        .annotate(
+            newest_msg=Max("chatmessage__id"),
+            summarized_upto=Coalesce(Subquery(summarized_upto), Value(0)),
         )
+        .filter(newest_msg__gt=F("summarized_upto"))
+        .order_by("-newest_msg")
+    )
+
+def get_global_summary(user) -> Optional[ChatSummary]:
+    """فقط خواندن؛ خلاصه‌ها هنگام بسته شدن سشن ساخته می‌شوند (summarize_closed_sessions)."""
+    return _get_summary(user, None)
 
 def get_or_create_global_summary(user) -> ChatSummary:
-    keep = _dedup_keep_latest(user, None)
+    keep = _get_summary(user, None)
     if keep and not _is_expired(keep, GLOBAL_TTL_MIN):
         return keep
     return summarize_user_chats(user)
 
 def get_or_update_session_summary(session) -> ChatSummary:
     user = session.user
-    with transaction.atomic():
-        keep = _dedup_keep_latest(user, session)
-        if keep and not _is_expired(keep, SESSION_TTL_MIN):
-            return keep
-
-        raw = _serialize_conversation([session])
-        summary_text, json_struct = _call_summarizer(raw)
-
-        if keep:
-            keep.model_used = getattr(settings, "SUMMARY_MODEL_NAME", "o3-mini")
-            keep.raw_text = raw
-            keep.rewritten_text = summary_text
-            keep.structured_json = json_struct
-            keep.save(update_fields=["model_used","raw_text","rewritten_text","structured_json","updated_at"])
-            return keep
-        return ChatSummary.objects.create(
-            user=user,
-            session=session,
-            model_used=getattr(settings, "SUMMARY_MODEL_NAME", "o3-mini"),
-            raw_text=raw,
-            rewritten_text=summary_text,
-            structured_json=json_struct,
-        )
\ No newline at end of file
+    keep = _get_summary(user, session)
+    if keep and not _is_expired(keep, SESSION_TTL_MIN):
+        return keep
+    return _refresh_session(session, keep)
+
+def sessions_needing_summary(qs=None):
+    """سشن‌هایی که خلاصه ندارند یا پیامی جدیدتر از خلاصه‌شان دارند."""
+    summarized_upto = ChatSummary.objects.filter(session=OuterRef("pk")).values("last_message_id")[:1]
+    qs = qs if qs is not None else ChatSession.objects.all()
+    return (
+        qs.annotate(
+            newest_msg=Max("messages__id"),
+            summarized_upto=Coalesce(Subquery(summarized_upto), Value(0)),
+        )
+        .filter(newest_msg__gt=F("summarized_upto"))
+    )
+
+def summarize_sessions_batch(session_ids) -> Dict[str, int]:
+    """
+    خلاصهٔ سشن‌ها در حالت batch: سشن‌های کوتاه (تا PACK_SESSION_MAX_CHARS) چندتا‌چندتا در
+    یک درخواست با پاسخ آرایهٔ JSON خلاصه می‌شوند؛ سشن‌های بلند و هر سشنی که پاسخش parse
+    نشد، تک‌به‌تک. سشن‌های زیر LOCAL_SUMMARY_MAX_CHARS اصلاً به LLM نمی‌روند.
+    خروجی: {"local": l, "packed": n, "single": m, "requests": k}.
+    """
+    stats = {"local": 0, "packed": 0, "single": 0, "requests": 0}
+    session_ids = list(session_ids)
+    for i in range(0, len(session_ids), 500):
+        chunk = session_ids[i:i + 500]
+        sessions = {
+            s.pk: s
+            for s in ChatSession.objects.filter(pk__in=chunk)
+            .select_related("user")
+            .annotate(n_chars=Sum(Length("messages__message")))
+        }
+        bases = {b.session_id: b for b in ChatSummary.objects.filter(session_id__in=sessions)}
+
+        short_ids = [sid for sid, s in sessions.items() if (s.n_chars or 0) <= PACK_SESSION_MAX_CHARS]
+        texts = _serialize_short_sessions(short_ids)
+        single = [sid for sid in sessions if sid not in texts]
+
+        for sid in [sid for sid in short_ids if sid in texts and len(texts[sid][0]) <= LOCAL_SUMMARY_MAX_CHARS]:
+            raw, first_id, last_id = texts.pop(sid)
+            summary_text, json_struct, model = _summarize_locally(raw)
+            _write_summary(
+                sessions[sid].user, sessions[sid], bases.get(sid),
+                _summary_fields(raw, summary_text, json_struct, first_id, last_id, model),
+            )
+            stats["local"] += 1
+
+        for batch in _pack([(sid, texts[sid][0]) for sid in short_ids if sid in texts]):
+            results = _call_batch_summarizer(batch) if len(batch) > 1 else {}
+            if len(batch) > 1:
+                stats["requests"] += 1
+            for sid, raw in batch:
+                if sid not in results:
+                    single.append(sid)
+                    continue
+                s = sessions[sid]
+                summary_text, json_struct = results[sid]
+                _, first_id, last_id = texts[sid]
+                _write_summary(
+                    s.user, s, bases.get(sid),
+                    _summary_fields(raw, summary_text, json_struct, first_id, last_id),
+                )
+                stats["packed"] += 1
+
+        for sid in single:
+            _refresh_session(sessions[sid], bases.get(sid))
+            stats["single"] += 1
+            stats["requests"] += 1
+    return stats
+
+def summarize_closed_sessions(session_ids) -> Dict[str, int]:
+    """
+    یک بار در پایان سشن: خلاصهٔ نهایی سشن‌ها (batch) و سپس به‌روزرسانی افزایشی
+    خلاصهٔ سراسری کاربرانِ همان سشن‌ها.
+    """
+    session_ids = list(session_ids)
+    stats = summarize_sessions_batch(session_ids)
+    user_ids = set(ChatSession.objects.filter(pk__in=session_ids).values_list("user_id", flat=True))
+    stats["users"] = 0
+    for user in User.objects.filter(pk__in=user_ids):
+        try:
+            summarize_user_chats(user)
+            stats["users"] += 1
+        except ValueError:
+            continue
+    return stats
@@ -2,17 +2,30 @@
 from __future__ import annotations
 
 import logging
-from typing import List, Optional, Sequence
+import resource
+from typing import List, Optional, Sequence, Tuple
 
+from django.core.files.uploadedfile import UploadedFile
 from django.utils.encoding import force_str
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.parsers import JSONParser, FormParser, MultiPartParser
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.utils.urls import replace_query_param
 
+from chatbot.archive import archived_messages
+from chatbot.history import get_session_header, keyset_page, keyset_page_rows, page_size
+from chatbot.models import ChatMessage, ChatSession
 from chatbot.permissions import HasActiveSubscription
 from chatbot.generateresponse import generate_gpt_response
+from chatbot.parsers import StreamingJSONParser
+from chatbot.search import search_messages
+from chatbot.serializers import (
+    ChatHistoryMessageSerializer,
+    ChatSearchResultSerializer,
+    ChatSessionHeaderSerializer,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -35,7 +48,7 @@ class ChatView(APIView):
       - Multipart:  message=..., images=@file1  (همچنین images[] پشتیبانی می‌شود)
     """
     permission_classes = [IsAuthenticated, HasActiveSubscription]
-    parser_classes = (JSONParser, FormParser, MultiPartParser)
+    parser_classes = (StreamingJSONParser, FormParser, MultiPartParser)
 
     # ---- helpers -------------------------------------------------------------
     @staticmethod
@@ -59,11 +72,13 @@ class ChatView(APIView):
         return [v]
 
     @staticmethod
-    def _collect_b64(data) -> List[str]:
+    def _collect_b64(data) -> Tuple[List[str], List[UploadedFile]]:
         """
         تمام مسیرهای ممکن برای دریافت base64 را تجمیع می‌کند.
+        base64های بزرگ را StreamingJSONParser از قبل به فایل (UploadedFile) تبدیل کرده است.
         """
         b64_list: List[str] = []
+        spooled: List[UploadedFile] = []
         candidates: List = []
 
         # تصاویر در JSON: images یا images[]
@@ -71,15 +86,13 @@ class ChatView(APIView):
         candidates += ChatView._getlist(data, "images[]")
         # برخی فرانت‌ها آبجکت می‌فرستند: {image: <b64>} یا {b64: <b64>} یا {data: <b64>}
         for item in candidates:
-            if isinstance(item, str) and item.strip():
+            if isinstance(item, dict):
+                item = next((item[k] for k in ("image", "b64", "data") if item.get(k)), None)
+            if isinstance(item, UploadedFile):
+                spooled.append(item)
+            elif isinstance(item, str) and item.strip():
                 b64_list.append(item.strip())
-            elif isinstance(item, dict):
-                for k in ("image", "b64", "data"):
-                    val = item.get(k)
-                    if isinstance(val, str) and val.strip():
-                        b64_list.append(val.strip())
-                        break
-        return b64_list
+        return b64_list, spooled
 
     @staticmethod
     def _collect_urls(data) -> List[str]:
@@ -108,6 +121,7 @@ class ChatView(APIView):
 
     # ---- POST ---------------------------------------------------------------
     def post(self, request):
+        peak_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
         user = request.user
         data = request.data if hasattr(request, "data") else {}
 
@@ -119,8 +133,8 @@ class ChatView(APIView):
         new_session = _to_bool(data.get("new_session"))
 
         # inputs: images (b64 / files / urls)
-        b64_list = self._collect_b64(data)
-        file_list = self._collect_files(request)
+        b64_list, spooled = self._collect_b64(data)
+        file_list = (self._collect_files(request) or []) + spooled or None
         url_list = self._collect_urls(data)
 
         # force_model (optional – فعلاً نادیده گرفته می‌شود در generate_gpt_response)
@@ -161,6 +175,12 @@ class ChatView(APIView):
                 image_urls=url_list or None,
                 force_model=force_model,
             )
+            # اوج RSS پروسه (کیلوبایت روی لینوکس)؛ رشد آن یعنی این درخواست سقف تازه‌ای از حافظه گرفت
+            peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            logger.info(
+                "ChatView done | user=%s peak_rss_kb=%s grew_kb=%s",
+                getattr(user, "id", None), peak_kb, peak_kb - peak_before_kb,
+            )
             return Response({"answer": answer}, status=status.HTTP_200_OK)
 
         except Exception as exc:
@@ -169,4 +189,77 @@ class ChatView(APIView):
             return Response(
                 {"detail": "خطای غیرمنتظره‌ای رخ داد. لطفاً دوباره تلاش کنید."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            )
\ No newline at end of file
+            )
+
+
+# ==============================
+# History (keyset pagination)
+# ==============================
+class _KeysetHistoryMixin:
+    """پاسخ صفحه‌بندی‌شده: {results, next}؛ next با ?cursor=... صفحهٔ قدیمی‌تر را می‌دهد."""
+
+    def _page(self, request, qs, ts_field, pager=keyset_page):
+        try:
+            rows, cursor = pager(
+                qs, ts_field, request.query_params.get("cursor"), page_size(request.query_params.get("limit"))
+            )
+        except ValueError:
+            return None, None
+        next_url = replace_query_param(request.build_absolute_uri(), "cursor", cursor) if cursor else None
+        return rows, next_url
+
+
+class ChatHistorySessionsView(_KeysetHistoryMixin, APIView):
+    """لیست سشن‌های کاربر (جدیدترین اول) بدون پیام‌ها."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        qs = ChatSession.objects.filter(user=request.user).only(
+            "id", "title", "is_open", "started_at", "ended_at"
+        )
+        rows, next_url = self._page(request, qs, "started_at")
+        if rows is None:
+            return Response({"detail": "cursor نامعتبر است."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": ChatSessionHeaderSerializer(rows, many=True).data, "next": next_url})
+
+
+class ChatHistoryMessagesView(_KeysetHistoryMixin, APIView):
+    """پیام‌های یک سشن (جدیدترین اول)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, session_id: int):
+        header = get_session_header(session_id)
+        if header is None or header["user_id"] != request.user.id:
+            return Response({"detail": "سشن یافت نشد."}, status=status.HTTP_404_NOT_FOUND)
+
+        if header["archive_id"]:
+            # سشن بایگانی‌شده: پیام‌ها از فایل بایگانی خوانده و در حافظه صفحه‌بندی می‌شوند
+            rows, next_url = self._page(request, archived_messages([session_id]), "created_at", keyset_page_rows)
+        else:
+            qs = ChatMessage.objects.filter(session_id=session_id).only("id", "is_bot", "message", "created_at")
+            rows, next_url = self._page(request, qs, "created_at")
+        if rows is None:
+            return Response({"detail": "cursor نامعتبر است."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "session": ChatSessionHeaderSerializer(header).data,
+            "results": ChatHistoryMessageSerializer(rows, many=True).data,
+            "next": next_url,
+        })
+
+
+class ChatHistorySearchView(_KeysetHistoryMixin, APIView):
+    """جستجوی تمام‌متن در پیام‌های خودِ کاربر: ?q=...  (جدیدترین اول)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        q = (request.query_params.get("q") or "").strip()
+        if not q:
+            return Response({"detail": "پارامتر q لازم است."}, status=status.HTTP_400_BAD_REQUEST)
+
+        qs = search_messages(ChatMessage.objects.filter(user=request.user), q).only(
+            "id", "session_id", "is_bot", "message", "created_at"
+        )
+        rows, next_url = self._page(request, qs, "created_at")
+        if rows is None:
+            return Response({"detail": "cursor نامعتبر است."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"results": ChatSearchResultSerializer(rows, many=True).data, "next": next_url})
@@ -246,14 +246,24 @@ MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
 # Maximum upload file size (10MB)
 MAX_UPLOAD_SIZE = 10485760
+# سقف بدنهٔ JSON چت (تصاویر base64 به‌صورت جریانی در فایل موقت decode می‌شوند)
+CHAT_UPLOAD_MAX_BYTES = int(os.getenv('CHAT_UPLOAD_MAX_BYTES', str(MAX_UPLOAD_SIZE * 4)))
 
 # Image upload settings
 IMAGE_UPLOAD_SETTINGS = {
     'quality': 85,
-    'formats': ['JPEG', 'PNG', 'HEIC', 'HEIF'],  
+    'formats': ['JPEG', 'PNG', 'WEBP', 'HEIC', 'HEIF'],
     'max_image_dimension': 4000,
     'min_image_dimension': 300,
 }
+# تصاویر بزرگ‌تر از این (پیکسل) فقط با خواندن هدر رد می‌شوند؛ سقف حافظهٔ decode تصاویر هر درخواست (مگابایت)
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', '40000000'))
+IMAGE_MEMORY_BUDGET_MB = int(os.getenv('IMAGE_MEMORY_BUDGET_MB', '256'))
+# استخر پروسهٔ decode/encode تصویر (به ازای هر پروسهٔ وب؛ 0 = اجرای درجا)، سقف کارهای در صف و مهلت هر کار (ثانیه).
+# سقف‌ها برای هر worker وب جداست: کل هم‌زمانی = تعداد worker های gunicorn × IMAGE_POOL_WORKERS
+IMAGE_POOL_WORKERS = int(os.getenv('IMAGE_POOL_WORKERS', '2'))
+IMAGE_POOL_MAX_PENDING = int(os.getenv('IMAGE_POOL_MAX_PENDING', '8'))
+IMAGE_JOB_TIMEOUT_SEC = int(os.getenv('IMAGE_JOB_TIMEOUT_SEC', '20'))
 
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', default=None)
 EMAIL_HOST = os.getenv('EMAIL_HOST', default=None)
@@ -271,6 +281,20 @@ TALKBOT_API_KEY = os.getenv('TALKBOT_API_KEY', default='sk-your-api-key-here')
 TALKBOT_BASE_URL = os.getenv('TALKBOT_BASE_URL', default='https://api.talkbot.ir/v1/')
 BITPAY_API_KEY = os.getenv('BITPAY_API_KEY', default='your-bitpay-api-key-here')
 KAVEH_NEGAR_API_KEY = os.getenv('KAVEH_NEGAR_API_KEY', default='your-kaveh-negar-api-key-here')
+# درگاه پیامک (telemedicine.sms): کلاس درگاه، اندازهٔ pool اتصال، هم‌زمانی و سقف پیام در ثانیهٔ ارسال انبوه
+SMS_BACKEND = os.getenv('SMS_BACKEND', 'telemedicine.sms.KavenegarBackend')
+SMS_POOL_SIZE = int(os.getenv('SMS_POOL_SIZE', '10'))
+SMS_TIMEOUT_SEC = int(os.getenv('SMS_TIMEOUT_SEC', '10'))
+SMS_BULK_CONCURRENCY = int(os.getenv('SMS_BULK_CONCURRENCY', '8'))
+SMS_RATE_PER_SEC = int(os.getenv('SMS_RATE_PER_SEC', '20'))
+# پیامک کمپین که پس از این مدت (ساعت) گزارش تحویل نهایی نگرفته، دیگر استعلام نمی‌شود
+SMS_STATUS_EXPIRE_HOURS = int(os.getenv('SMS_STATUS_EXPIRE_HOURS', '72'))
+# صندوق خروجی پیامک/ایمیل: بعد از این تعداد تلاش ناموفق پیام dead می‌شود
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '6'))
+# کد ورود (OTP) در Redis: اعتبار، سقف تلاش اشتباه و فاصلهٔ حداقلی ارسال مجدد
+OTP_TTL_SEC = int(os.getenv('OTP_TTL_SEC', '120'))
+OTP_MAX_ATTEMPTS = int(os.getenv('OTP_MAX_ATTEMPTS', '5'))
+OTP_RESEND_COOLDOWN_SEC = int(os.getenv('OTP_RESEND_COOLDOWN_SEC', '60'))
 
 #gapgpt
 # ---- GapGPT / OpenAI compatible ----
@@ -280,11 +304,46 @@ GAPGPT_API_KEY  = os.getenv('GAPGPT_API_KEY') or os.getenv('OPENAI_API_KEY')
 # مدل‌ها
 VISION_MODEL_NAME   = os.getenv('VISION_MODEL_NAME', 'gpt-4o')        # برای بینایی
 SUMMARY_MODEL_NAME  = os.getenv('SUMMARY_MODEL_NAME', 'o3-mini')      # یا 'gpt-4o-mini'
+TEXT_MODEL_NAME     = os.getenv('TEXT_MODEL_NAME', 'gpt-4o-mini')     # نوبت‌های فقط‌متنی
 
 # توکن‌ها
 RESPONSE_MAX_TOKENS = int(os.getenv('RESPONSE_MAX_TOKENS', '1500'))
 SUMMARY_MAX_TOKENS  = int(os.getenv('SUMMARY_MAX_TOKENS', '900'))
 
+# جدول مسیریابی مدل چت (chatbot.routing): هر مسیر مدل، سقف توکن، مهلت (ثانیه) و آستانهٔ کندی خودش را دارد.
+# اگر میانگین تأخیر اخیر مدل یک مسیر از slow_ms بیشتر شود، مسیر fallback آن انتخاب می‌شود.
+CHAT_MODEL_ROUTES = {
+    'vision': {'model': VISION_MODEL_NAME, 'max_tokens': RESPONSE_MAX_TOKENS, 'timeout': 60},
+    'text_strong': {'model': VISION_MODEL_NAME, 'max_tokens': RESPONSE_MAX_TOKENS, 'timeout': 45,
+                    'slow_ms': 20000, 'fallback': 'text'},
+    'text': {'model': TEXT_MODEL_NAME, 'max_tokens': int(os.getenv('TEXT_MAX_TOKENS', '1000')), 'timeout': 30},
+}
+# پرامپت‌های بلندتر از این (کاراکتر) و کاربران این پلن‌ها (شناسهٔ SubscriptionPlan، با کاما) مدل قوی‌تر می‌گیرند
+CHAT_ROUTE_LONG_PROMPT_CHARS = int(os.getenv('CHAT_ROUTE_LONG_PROMPT_CHARS', '6000'))
+CHAT_ROUTE_PREMIUM_PLAN_IDS = [int(x) for x in os.getenv('CHAT_ROUTE_PREMIUM_PLAN_IDS', '').split(',') if x.strip()]
+
+# سشن چت پس از این مدت بدون پیام بسته می‌شود (دقیقه)
+CHAT_SESSION_IDLE_MINUTES = int(os.getenv('CHAT_SESSION_IDLE_MINUTES', '60'))
+
+# پیام‌های سشن‌هایی که بیش از این مدت بسته بوده‌اند به بایگانی فشرده منتقل می‌شوند (روز)
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '90'))
+
+# بازیابی نوبت‌های مرتبط گذشته (BM25) برای پرامپت: تعداد نوبت و سقف کاراکتر
+CHAT_RETRIEVAL_TOP_K = int(os.getenv('CHAT_RETRIEVAL_TOP_K', '4'))
+CHAT_RETRIEVAL_BUDGET_CHARS = int(os.getenv('CHAT_RETRIEVAL_BUDGET_CHARS', '2400'))
+
+# کش پاسخ نوبت‌های بی‌زمینه (بدون تاریخچه/خلاصه/تصویر)؛ NEAR_DUP برای سؤال‌هایی که فقط در واژه‌های دستوری فرق دارند
+CHAT_ANSWER_CACHE_ENABLED = os.getenv('CHAT_ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+CHAT_ANSWER_CACHE_TTL = int(os.getenv('CHAT_ANSWER_CACHE_TTL', str(60 * 60 * 24)))
+CHAT_ANSWER_CACHE_MAX_CHARS = int(os.getenv('CHAT_ANSWER_CACHE_MAX_CHARS', '4000'))
+CHAT_ANSWER_CACHE_NEAR_DUP = os.getenv('CHAT_ANSWER_CACHE_NEAR_DUP', 'false').lower() == 'true'
+
+# سشن‌های کوتاه‌تر از این (کاراکتر) فقط با خلاصه‌ساز استخراجی محلی خلاصه می‌شوند
+SUMMARY_LOCAL_MAX_CHARS = int(os.getenv('SUMMARY_LOCAL_MAX_CHARS', '1500'))
+
+# خلاصه‌سازی شبانه: سقف فراخوانی هم‌زمان خلاصه‌ساز
+SUMMARY_NIGHTLY_WORKERS = int(os.getenv('SUMMARY_NIGHTLY_WORKERS', '4'))
+
 
 # ================== Django Cache (Redis) ==================
 # از قبل تعریف شده‌اند:
@@ -345,18 +404,36 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_ENABLE_UTC = True
 CELERY_TIMEZONE = 'UTC'  # همانند Django
 
-# معادل 22:00 تهران = 18:30 UTC
 CELERY_BEAT_SCHEDULE = {
-    'close-open-chat-sessions-22-tehran': {
+    # بستن سشن‌های بیکار (بر اساس زمان آخرین پیام)؛ خلاصه‌سازی با سیگنال sessions_closed انجام می‌شود
+    'close-idle-chat-sessions': {
         'task': 'medogram_tasks.close_open_sessions_task',
-        'schedule': crontab(minute=30, hour=18),
+        'schedule': crontab(minute='*/15'),
         'options': {'queue': 'default'},
-        'args': [12],  # --hours=12
     },
+    # معادل 22:00 تهران = 18:30 UTC
     'summarize-chats-22-tehran': {
         'task': 'medogram_tasks.summarize_all_users_chats_task',
         'schedule': crontab(minute=30, hour=18),
         'options': {'queue': 'default'},
         'args': [None],  # limit=None
     },
+    # بایگانی سرد پیام‌های سشن‌های قدیمی؛ 03:00 تهران = 23:30 UTC
+    'archive-old-chat-sessions': {
+        'task': 'medogram_tasks.archive_chat_sessions_task',
+        'schedule': crontab(minute=30, hour=23),
+        'options': {'queue': 'default'},
+    },
+    # جاروب صندوق خروجی پیامک/ایمیل (پیام‌هایی که تسکشان به broker نرسیده)
+    'dispatch-outbox': {
+        'task': 'medogram_tasks.dispatch_pending_outbox_task',
+        'schedule': crontab(minute='*/5'),
+        'options': {'queue': 'default'},
+    },
+    # وضعیت تحویل پیامک‌های کمپین
+    'refresh-sms-delivery-status': {
+        'task': 'medogram_tasks.refresh_sms_delivery_status_task',
+        'schedule': crontab(minute=10),
+        'options': {'queue': 'default'},
+    },
 }
\ No newline at end of file
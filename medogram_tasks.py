@@ -6,30 +6,111 @@ from django.conf import settings
 User = settings.AUTH_USER_MODEL
 
 @shared_task
-def close_open_sessions_task(hours=12):
+def close_open_sessions_task(idle_minutes=None):
     """
     معادل اجرای:
-    python manage.py close_open_sessions --hours=<hours>
+    python manage.py close_open_sessions [--idle-minutes N]
     """
-    call_command('close_open_sessions', f'--hours={hours}')
+    if idle_minutes is not None:
+        call_command('close_open_sessions', '--idle-minutes', str(idle_minutes))
+    else:
+        call_command('close_open_sessions')
+
+@shared_task
+def archive_chat_sessions_task(days=None):
+    """
+    معادل اجرای:
+    python manage.py archive_chat_sessions [--days N]
+    """
+    if days is not None:
+        call_command('archive_chat_sessions', '--days', str(days))
+    else:
+        call_command('archive_chat_sessions')
+
+@shared_task
+def summarize_closed_sessions_task(session_ids):
+    """
+    خلاصهٔ نهایی سشن‌های بسته‌شده و به‌روزرسانی افزایشی خلاصهٔ سراسری کاربرانشان
+    (از سیگنال chatbot.signals.sessions_closed صدا زده می‌شود).
+    """
+    from chatbot.utils.text_summary import summarize_closed_sessions
+    summarize_closed_sessions(session_ids)
 
 @shared_task
-def summarize_chats_for_username_task(username: str, limit=None):
+def summarize_chats_for_username_task(username: str, limit=None, full=False):
     """
     معادل:
-    python manage.py summarize_chats <username> [--limit N]
+    python manage.py summarize_chats <username> [--limit N] [--full]
     """
+    args = [username]
     if limit is not None:
-        call_command('summarize_chats', username, '--limit', str(limit))
-    else:
-        call_command('summarize_chats', username)
+        args += ['--limit', str(limit)]
+    if full:
+        args.append('--full')
+    call_command('summarize_chats', *args)
 
 @shared_task
-def summarize_all_users_chats_task(limit=None):
+def summarize_all_users_chats_task(limit=None, full=False):
     """
-    برای همه کاربران فعال، کامند summarize_chats را اجرا می‌کند.
+    برای همه کاربران فعال، کامند summarize_chats را اجرا می‌کند
+    (همراه با خلاصهٔ batch سشن‌های بستهٔ عقب‌مانده).
     """
+    args = ['--all', '--sessions']
     if limit is not None:
-        call_command('summarize_chats', '--all', '--limit', str(limit))
-    else:
-        call_command('summarize_chats', '--all')
\ No newline at end of file
+        args += ['--limit', str(limit)]
+    if full:
+        args.append('--full')
+    call_command('summarize_chats', *args)
+
+@shared_task
+def dispatch_outbox_message_task(message_id):
+    """
+    یک تلاش ارسال پیام صندوق خروجی (پس از commit از telemedicine.outbox.enqueue صدا زده می‌شود).
+    """
+    from telemedicine.outbox import deliver
+    return deliver(message_id)
+
+@shared_task
+def dispatch_pending_outbox_task(limit=None):
+    """
+    جاروب پیام‌های سررسیدشدهٔ صندوق خروجی که تسکشان به صف نرسیده است.
+    """
+    from telemedicine.outbox import SWEEP_BATCH, dispatch_due
+    return dispatch_due(limit or SWEEP_BATCH)
+
+@shared_task(bind=True, max_retries=2, default_retry_delay=5)
+def send_otp_sms_task(self, phone_number):
+    """
+    ساخت کد ورود و ارسال پیامک آن (قالب users) بیرون از چرخهٔ درخواست RegisterOrLoginView.
+    کد همین‌جا ساخته و فقط هشش در Redis ذخیره می‌شود؛ آرگومان تسک فقط شماره است.
+    هر تلاش مجدد کد تازه‌ای می‌سازد که کد قبلی را باطل می‌کند.
+    """
+    from telemedicine import otp
+    from telemedicine.sms import SMSError, send_lookup
+    try:
+        send_lookup({
+            'receptor': phone_number,
+            'token': otp.issue(phone_number),
+            'template': 'users',
+        })
+    except SMSError as exc:
+        if not exc.retryable:
+            raise
+        raise self.retry(exc=exc)
+
+@shared_task
+def send_sms_campaign_task(campaign, messages, rate_per_sec=None):
+    """
+    ارسال انبوه پیامک قالبی (مثلاً یادآوری پایان اشتراک یا اطلاع‌رسانی نسخهٔ جدید اپ).
+    messages: لیست پارامترهای verify_lookup برای هر گیرنده.
+    """
+    from telemedicine.sms import send_bulk
+    return send_bulk(messages, campaign=campaign, rate_per_sec=rate_per_sec)._asdict()
+
+@shared_task
+def refresh_sms_delivery_status_task():
+    """
+    به‌روزرسانی وضعیت تحویل پیامک‌های کمپین از درگاه.
+    """
+    from telemedicine.sms import refresh_delivery_status
+    return refresh_delivery_status()
@@ -3,19 +3,21 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 from django.contrib.auth import get_user_model
 from sub.models import SubscriptionPlan, Subscription
+from telemedicine import otp
 from telemedicine.models import BoxMoney
 
 User = get_user_model()
 
 @pytest.fixture
 def user(db):
-    user = User.objects.create_user(username="testuser", auth_code= '123456', phone_number='09113078859', password="testpass")
+    user = User.objects.create_user(username="testuser", phone_number='09113078859', password="testpass")
     return user
 
 @pytest.fixture
 def api_client(user):
     client = APIClient()
-    response = client.post('/api/verify/', {'phone_number': "09113078859", 'code': 123456})
+    code = otp.issue("09113078859")
+    response = client.post('/api/verify/', {'phone_number': "09113078859", 'code': code})
     assert response.status_code == 200
     access = response.data['access']
     client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
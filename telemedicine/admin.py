@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.utils.html import format_html
 
-from telemedicine.models import  CustomUser, Visit, Transaction, Blog, Comment, BoxMoney, Order, APKDownloadStat
+from telemedicine.models import  CustomUser, Visit, Transaction, Blog, Comment, BoxMoney, Order, APKDownloadStat, OutboxMessage, SMSDelivery
+from telemedicine import outbox
                               
 
                                                    
@@ -105,4 +106,28 @@ class OrderAdmin(admin.ModelAdmin):
 class APKDownloadStatAdmin(admin.ModelAdmin):
     list_display = ("key", "total", "last_download_at")
     search_fields = ("key",)
-    readonly_fields = ("key", "total", "last_download_at")
\ No newline at end of file
+    readonly_fields = ("key", "total", "last_download_at")
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ['idempotency_key', 'kind', 'status', 'attempts', 'available_at', 'sent_at']
+    list_filter = ['kind', 'status', 'created_at']
+    search_fields = ['idempotency_key', 'last_error']
+    readonly_fields = ['created_at', 'sent_at', 'last_error']
+    list_per_page = 50
+    actions = ['retry_dead_messages']
+
+    @admin.action(description='ارسال مجدد پیام‌های ناموفق (dead)')
+    def retry_dead_messages(self, request, queryset):
+        count = outbox.retry_dead(queryset)
+        self.message_user(request, f'{count} پیام دوباره در صف قرار گرفت.')
+
+
+@admin.register(SMSDelivery)
+class SMSDeliveryAdmin(admin.ModelAdmin):
+    list_display = ['campaign', 'receptor', 'template', 'status', 'gateway_status', 'created_at']
+    list_filter = ['status', 'campaign', 'created_at']
+    search_fields = ['receptor', 'campaign', 'message_id']
+    readonly_fields = ['created_at', 'updated_at', 'status_checked_at']
+    list_per_page = 50
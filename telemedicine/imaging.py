@@ -0,0 +1,327 @@
+# telemedicine/imaging.py
+# بررسی تصویر فقط از روی هدر فایل (فرمت، ابعاد، چرخش EXIF) پیش از decode کامل؛
+# رد زودهنگام تصاویر خیلی بزرگ / بمب فشرده‌سازی / فرمت غیرمجاز، و decode از ارزان‌ترین مسیر:
+# JPEG با draft (مقیاس‌دهی DCT هنگام decode) و HEIC با thumbnail داخلی فایل (draft در pillow_heif).
+from __future__ import annotations
+
+import io
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, NamedTuple, Optional
+
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+from pillow_heif import register_heif_opener
+
+register_heif_opener()
+
+logger = logging.getLogger(__name__)
+
+_UPLOAD = getattr(settings, "IMAGE_UPLOAD_SETTINGS", {})
+_FORMAT_ALIASES = {"HEIC": "HEIF", "MPO": "JPEG"}
+
+ALLOWED_FORMATS = frozenset(
+    _FORMAT_ALIASES.get(f.upper(), f.upper()) for f in _UPLOAD.get("formats", ("JPEG", "PNG", "HEIF"))
+)
+MAX_PIXELS = int(getattr(settings, "IMAGE_MAX_PIXELS", 40_000_000))
+# سقف بایت پیکسل decodeشده در یک درخواست (Pillow برای هر پیکسل RGB چهار بایت نگه می‌دارد)
+MEMORY_BUDGET_BYTES = int(getattr(settings, "IMAGE_MEMORY_BUDGET_MB", 256)) * 1024 * 1024
+_BYTES_PER_PIXEL = 4
+
+_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class ImageRejected(ValueError):
+    """تصویر پیش از decode رد شد؛ پیام برای نمایش به کاربر مناسب است."""
+
+
+class ImageInfo(NamedTuple):
+    format: str
+    width: int
+    height: int
+    mode: str
+    orientation: int
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+
+class ImageBudget:
+    """بودجهٔ حافظهٔ decode تصاویر یک درخواست؛ مجموع پیکسل‌های decodeشده از سقف عبور نمی‌کند."""
+
+    def __init__(self, limit_bytes: int = MEMORY_BUDGET_BYTES):
+        self.limit_bytes = limit_bytes
+        self.used_bytes = 0
+
+    def reserve(self, width: int, height: int) -> None:
+        need = width * height * _BYTES_PER_PIXEL
+        if self.used_bytes + need > self.limit_bytes:
+            raise ImageRejected("حجم کل تصاویر این درخواست بیش از حد مجاز است.")
+        self.used_bytes += need
+
+
+def _as_file(source):
+    """bytes ← BytesIO؛ مسیر فایل (str) و file-like همان‌طور به Image.open داده می‌شوند."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def job_source(f):
+    """
+    ورودی قابل pickle برای کار استخر: مسیر فایل موقتِ آپلود (TemporaryUploadedFile، بدون کپی در حافظه)
+    یا بایت‌های فایل کوچک درون حافظه.
+    """
+    path = getattr(f, "temporary_file_path", None)
+    if callable(path):
+        return path()
+    f.seek(0)
+    return f.read()
+
+
+def _open(fp) -> Image.Image:
+    try:
+        return Image.open(fp)  # تنبل: فقط هدر خوانده می‌شود
+    except Image.DecompressionBombError:
+        raise ImageRejected("ابعاد تصویر بیش از حد مجاز است.")
+    except (UnidentifiedImageError, OSError, ValueError, SyntaxError):
+        raise ImageRejected("فایل ارسالی یک تصویر معتبر نیست.")
+
+
+def _info(im: Image.Image) -> ImageInfo:
+    fmt = _FORMAT_ALIASES.get(im.format or "", im.format or "")
+    # getexif در PNG ممکن است کل تصویر را load کند؛ چرخش فقط برای JPEG معنا دارد
+    orientation = int(im.getexif().get(0x0112, 1) or 1) if fmt == "JPEG" else 1
+    info = ImageInfo(fmt, im.width, im.height, im.mode, orientation)
+    if fmt not in ALLOWED_FORMATS:
+        raise ImageRejected(f"فرمت تصویر ({fmt or 'نامشخص'}) پشتیبانی نمی‌شود.")
+    if info.pixels > MAX_PIXELS:
+        raise ImageRejected(f"ابعاد تصویر ({info.width}×{info.height}) بیش از حد مجاز است.")
+    return info
+
+
+def probe_image(source) -> ImageInfo:
+    """اطلاعات تصویر فقط از روی هدر؛ ImageRejected برای فرمت غیرمجاز یا ابعاد بیش از MAX_PIXELS."""
+    fp = _as_file(source)
+    pos = fp.tell() if hasattr(fp, "tell") else None
+    try:
+        with _open(fp) as im:
+            return _info(im)
+    finally:
+        if pos is not None:
+            fp.seek(pos)
+
+
+def target_size(info: ImageInfo, *, max_pixels: Optional[float] = None, max_side: Optional[int] = None):
+    """ابعاد خروجی برای سقف max_pixels و ضلع max_side (بدون بزرگ‌نمایی)."""
+    scale = 1.0
+    if max_pixels and info.pixels > max_pixels:
+        scale = math.sqrt(max_pixels / info.pixels)
+    if max_side and max(info.width, info.height) * scale > max_side:
+        scale = max_side / max(info.width, info.height)
+    return max(1, math.ceil(info.width * scale)), max(1, math.ceil(info.height * scale))
+
+
+def decoded_size(info: ImageInfo, target) -> tuple:
+    """
+    ابعادی که واقعاً decode می‌شود: برای JPEG مثل draft در Pillow (کاهش ۱/۲، ۱/۴ یا ۱/۸ در DCT)،
+    برای بقیه (و HEIC که thumbnail آن از روی هدر معلوم نیست) ابعاد کامل.
+    """
+    if info.format != "JPEG":
+        return info.width, info.height
+    ratio = min(info.width // target[0], info.height // target[1])
+    reduce = next(r for r in (8, 4, 2, 1) if ratio >= r)
+    return math.ceil(info.width / reduce), math.ceil(info.height / reduce)
+
+
+def decode_image(
+    source,
+    *,
+    max_pixels: Optional[float] = None,
+    max_side: Optional[int] = None,
+    budget: Optional[ImageBudget] = None,
+) -> Image.Image:
+    """
+    تصویر RGB/L با حداکثر max_pixels پیکسل و ضلع max_side، با چرخش EXIF اعمال‌شده.
+    پیش از decode، اندازهٔ قابل‌دستیابی با draft محاسبه و از budget کسر می‌شود.
+    """
+    fp = _as_file(source)
+    pos = fp.tell() if hasattr(fp, "tell") else None
+    try:
+        with _open(fp) as im:
+            info = _info(im)
+            target = target_size(info, max_pixels=max_pixels, max_side=max_side)
+            if target != im.size:
+                im.draft("RGB" if info.mode not in ("L", "1") else "L", target)
+            if budget is not None:
+                budget.reserve(*im.size)
+            im.load()
+            out = im if im.mode in ("RGB", "L") else im.convert("RGB")
+            if out.width > target[0] or out.height > target[1]:
+                out = out.resize(target, Image.LANCZOS, reducing_gap=3.0)
+            if info.orientation in _TRANSPOSE:
+                out = out.transpose(_TRANSPOSE[info.orientation])
+            return out
+    except Image.DecompressionBombError:
+        raise ImageRejected("ابعاد تصویر بیش از حد مجاز است.")
+    finally:
+        if pos is not None:
+            fp.seek(pos)
+
+
+def encode_jpeg(im: Image.Image, quality: int = 85) -> bytes:
+    buf = io.BytesIO()
+    im.convert("RGB").save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def heic_to_jpeg(data: bytes, max_side: Optional[int] = None, quality: int = 85) -> bytes:
+    """تبدیل HEIC/HEIF به JPEG (کار استخر پروسه؛ ورودی و خروجی بایت خام است)."""
+    with decode_image(data, max_side=max_side) as im:
+        return encode_jpeg(im, quality)
+
+
+# ==============================
+# Process pool
+# ==============================
+# decode/resize/encode تصویر CPU-bound است و روی ترد درخواست، کل worker وب را قفل می‌کند؛
+# این کارها در یک استخر پروسهٔ محدود (به ازای هر پروسهٔ وب) اجرا می‌شوند.
+# سقف‌ها برای هر پروسهٔ وب جداست: روی سرور، هم‌زمانی واقعی decode برابر
+# (تعداد worker های gunicorn) × POOL_WORKERS و صف برابر (worker ها) × POOL_MAX_PENDING است؛
+# حافظه و هسته‌های CPU را با همین حاصل‌ضرب تنظیم کنید.
+# POOL_WORKERS=0 یعنی اجرای درجا (توسعه/آزمون).
+POOL_WORKERS = int(getattr(settings, "IMAGE_POOL_WORKERS", 2))
+POOL_MAX_PENDING = int(getattr(settings, "IMAGE_POOL_MAX_PENDING", 8))
+JOB_TIMEOUT_SEC = float(getattr(settings, "IMAGE_JOB_TIMEOUT_SEC", 20))
+QUEUE_WAIT_SEC = 2.0
+_MAX_TASKS_PER_CHILD = 200
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, POOL_MAX_PENDING))
+
+
+class ImagePoolBusy(ImageRejected):
+    """صف استخر تصویر پر است یا کار از مهلت خود گذشت."""
+
+
+def _init_worker() -> None:
+    import django
+
+    django.setup()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():  # پس از fork (مثلاً gunicorn) استخر تازه
+            _pool = ProcessPoolExecutor(
+                max_workers=POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                max_tasks_per_child=_MAX_TASKS_PER_CHILD,
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _reset_pool(*, terminate: bool = False) -> None:
+    """
+    کنار گذاشتن استخر فعلی (استخر بعدی در اولین submit ساخته می‌شود). با terminate، پروسه‌های
+    استخر کشته می‌شوند: کاری که در حال اجراست با future.cancel() متوقف نمی‌شود و بدون این،
+    decode گیرکرده یک worker را برای همیشه نگه می‌دارد. کارهای دیگر همان استخر BrokenProcessPool می‌گیرند.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is None:
+        return
+    if terminate:
+        # پایتون ۳.۱۱ متد عمومی برای این کار ندارد (terminate_workers از ۳.۱۴)
+        for proc in list((getattr(pool, "_processes", None) or {}).values()):
+            proc.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _Slot:
+    """جای صف یک کار؛ آزادسازی یک‌باره (هم از callback پایان کار و هم پس از timeout)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = True
+
+    def release(self, *_args) -> None:
+        with self._lock:
+            if not self._held:
+                return
+            self._held = False
+        _slots.release()
+
+
+def submit_image_job(fn: Callable, *args) -> Future:
+    """
+    fn(*args) را در استخر تصویر صف می‌کند. fn باید تابع سطح ماژول باشد (pickle شود).
+    اگر ظرف QUEUE_WAIT_SEC جای خالی در صف (POOL_MAX_PENDING) نباشد، ImagePoolBusy می‌دهد.
+    """
+    if POOL_WORKERS <= 0:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    if not _slots.acquire(timeout=QUEUE_WAIT_SEC):
+        raise ImagePoolBusy("سرور در حال پردازش تصاویر زیادی است؛ لطفاً کمی بعد دوباره تلاش کنید.")
+    slot = _Slot()
+    try:
+        future = _get_pool().submit(fn, *args)
+    except Exception:
+        slot.release()
+        _reset_pool()
+        raise
+    # جای صف تا پایان واقعی کار (نه تا timeout منتظر) اشغال می‌ماند
+    future.image_slot = slot
+    future.add_done_callback(slot.release)
+    return future
+
+
+def image_job_result(future: Future, timeout: float = JOB_TIMEOUT_SEC):
+    """
+    نتیجهٔ کار؛ پس از timeout ImagePoolBusy داده می‌شود. کار شروع‌نشده لغو می‌شود؛ کار در حال اجرا
+    با کشتن و بازسازی استخر متوقف و جای صفش آزاد می‌شود.
+    """
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        if not future.cancel():
+            logger.error("Image job exceeded %ss; terminating the image process pool.", timeout)
+            _reset_pool(terminate=True)
+            slot = getattr(future, "image_slot", None)
+            if slot is not None:
+                slot.release()
+        raise ImagePoolBusy("پردازش تصویر بیش از حد طول کشید.")
+    except BrokenProcessPool:
+        logger.error("Image process pool broke (worker crashed); recreating.")
+        _reset_pool()
+        raise ImagePoolBusy("پردازش تصویر ناموفق بود.")
+
+
+def run_image_job(fn: Callable, *args, timeout: float = JOB_TIMEOUT_SEC):
+    return image_job_result(submit_image_job(fn, *args), timeout)
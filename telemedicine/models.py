@@ -1,8 +1,8 @@
 # telemedicine/models.py
+import logging
 import time
-from io import BytesIO
 
-from PIL import Image
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
@@ -10,9 +10,13 @@ from django.contrib.auth.models import AbstractUser
 from django.core.files.base import ContentFile
 from django.core.validators import URLValidator
 from django.db import models
-from pillow_heif import register_heif_opener
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 
+from telemedicine.imaging import ImageRejected, heic_to_jpeg, job_source, probe_image, run_image_job
+
+logger = logging.getLogger(__name__)
+
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, phone_number=None, email=None, username=None, password=None, **extra_fields):
@@ -42,7 +46,6 @@ class CustomUserManager(BaseUserManager):
 class CustomUser(AbstractBaseUser, PermissionsMixin):
     phone_number = models.CharField(max_length=15, unique=True, null=True, blank=True)
     username = models.CharField(max_length=15, unique=True, null=True, blank=True)
-    auth_code = models.IntegerField(unique=True, null=True, blank=True)
     email = models.EmailField(unique=True, null=True, blank=True)
     is_doctor = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
@@ -168,7 +171,8 @@ class Visit(models.Model):
     def save(self, *args, **kwargs):
         """
         اگر فیلد drug_images به صورت بایت خام (bytes) باشد، آن را به فایل تبدیل می‌کنیم.
-        سپس اگر فایل پسوند HEIC/HEIF داشته باشد، تلاش می‌کنیم آن را به JPEG تبدیل کنیم.
+        سپس فرمت و ابعاد فایل تازه را فقط از روی هدر بررسی می‌کنیم (تصویر خیلی بزرگ/فرمت غیرمجاز رد می‌شود)
+        و اگر HEIC/HEIF بود، آن را با ارزان‌ترین مسیر decode و به JPEG تبدیل می‌کنیم.
         در صورت خطا در تبدیل، از آن عبور می‌کنیم تا اصل ذخیره‌ی ویزیت مختل نشود.
         """
         # --- 1) اگر به صورت بایت خام آمده باشد، تبدیل به فایل می‌کنیم ---
@@ -176,22 +180,26 @@ class Visit(models.Model):
             # می‌توانید نام فایل را بسته به نیازتان تغییر دهید
             self.drug_images = ContentFile(self.drug_images, name='uploaded_image.jpg')
 
-        # --- 2) اگر فایل آپلود شده پسوند HEIC/HEIF داشت، تبدیل به JPEG می‌کنیم ---
-        if self.drug_images:
-            file_name = self.drug_images.name.lower()
-            # اگر بخواهید صرفاً براساس پسوند عمل کنید:
-            if file_name.endswith(('.heic', '.heif')):
+        # --- 2) فایل تازه آپلودشده: فقط هدر را می‌خوانیم؛ اگر HEIC/HEIF بود به JPEG تبدیل می‌کنیم ---
+        if self.drug_images and not self.drug_images._committed:
+            try:
+                info = probe_image(self.drug_images)
+            except ImageRejected as e:
+                raise ValidationError({'drug_images': [str(e)]})
+            if info.format == 'HEIF':
                 try:
-                    register_heif_opener()
-                    img = Image.open(self.drug_images)
-                    buffer = BytesIO()
-                    img.convert('RGB').save(buffer, format='JPEG', quality=85)
-                    buffer.seek(0)
-                    new_name = file_name.rsplit('.', 1)[0] + '.jpg'
-                    self.drug_images.save(new_name, ContentFile(buffer.getvalue()), save=False)
+                    # decode در استخر پروسهٔ تصویر؛ با draft، اگر thumbnail داخلی به اندازهٔ کافی بزرگ باشد همان decode می‌شود
+                    jpeg = run_image_job(
+                        heic_to_jpeg,
+                        job_source(self.drug_images.file),
+                        settings.IMAGE_UPLOAD_SETTINGS.get('max_image_dimension'),
+                        settings.IMAGE_UPLOAD_SETTINGS.get('quality', 85),
+                    )
+                    new_name = self.drug_images.name.rsplit('.', 1)[0] + '.jpg'
+                    self.drug_images.save(new_name, ContentFile(jpeg), save=False)
                 except Exception as e:
                     # خطا در تبدیل فرمت از HEIC/HEIF؛ صرفاً رد می‌شویم تا عملیات سیو مختل نشود.
-                    print(f"[WARN] تبدیل HEIC/HEIF به JPEG ناموفق بود: {e}")
+                    logger.warning("تبدیل HEIC/HEIF به JPEG ناموفق بود (%s): %s", self.drug_images.name, e)
 
         super().save(*args, **kwargs)
 
@@ -328,4 +336,70 @@ class APKDownloadStat(models.Model):
     last_download_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"{self.key} -> {self.total}"
\ No newline at end of file
+        return f"{self.key} -> {self.total}"
+
+class OutboxMessage(models.Model):
+    """
+    صندوق خروجی تراکنشی برای اثرات جانبی شبکه‌ای (پیامک، ایمیل).
+    در همان تراکنشِ رویداد ثبت و پس از commit به Celery سپرده می‌شود (telemedicine.outbox)؛
+    پس از MAX_ATTEMPTS تلاش ناموفق به وضعیت dead (dead-letter) می‌رود.
+    """
+    KIND_SMS = 'sms'
+    KIND_EMAIL = 'email'
+    KIND_CHOICES = [(KIND_SMS, 'پیامک'), (KIND_EMAIL, 'ایمیل')]
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [(STATUS_PENDING, 'در صف'), (STATUS_SENT, 'ارسال‌شده'), (STATUS_DEAD, 'ناموفق نهایی')]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    payload = models.JSONField()
+    idempotency_key = models.CharField(max_length=120, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    available_at = models.DateTimeField(default=timezone.now)  # زمان تلاش بعدی
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx')]
+
+    def __str__(self):
+        return f"{self.kind}:{self.idempotency_key} ({self.status})"
+
+
+class SMSDelivery(models.Model):
+    """نتیجهٔ ارسال هر پیامک کمپین (telemedicine.sms.send_bulk) و وضعیت تحویل گزارش‌شدهٔ درگاه."""
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_DELIVERED = 'delivered'
+    STATUS_UNDELIVERED = 'undelivered'
+    STATUS_EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (STATUS_SENT, 'ارسال‌شده'),
+        (STATUS_FAILED, 'خطا در ارسال'),
+        (STATUS_DELIVERED, 'تحویل‌شده'),
+        (STATUS_UNDELIVERED, 'تحویل‌نشده'),
+        (STATUS_EXPIRED, 'بدون گزارش تحویل (منقضی)'),
+    ]
+
+    campaign = models.CharField(max_length=100, db_index=True)
+    receptor = models.CharField(max_length=15)
+    template = models.CharField(max_length=50, blank=True, default='')
+    message_id = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES)
+    gateway_status = models.IntegerField(null=True, blank=True)  # کد وضعیت درگاه
+    error = models.CharField(max_length=500, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # آخرین استعلام وضعیت (یا زمان ارسال)؛ استعلام بعدی از قدیمی‌ترین شروع می‌شود تا ردیف‌های
+    # بی‌پاسخ جلوی ردیف‌های جدیدتر را نگیرند
+    status_checked_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'status_checked_at'], name='smsdelivery_status_idx')]
+
+    def __str__(self):
+        return f"{self.campaign}:{self.receptor} ({self.status})"
@@ -0,0 +1,80 @@
+# telemedicine/otp.py
+# نگهداری کد یکبارمصرف ورود در Redis (کش پیش‌فرض) به‌جای ستون auth_code کاربر:
+# فقط HMAC کد ذخیره می‌شود، با TTL، شمارندهٔ تلاش‌های اشتباه و فاصلهٔ حداقلی بین دو ارسال.
+from __future__ import annotations
+
+import hashlib
+import hmac
+import secrets
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+TTL_SEC = int(getattr(settings, "OTP_TTL_SEC", 120))
+MAX_ATTEMPTS = int(getattr(settings, "OTP_MAX_ATTEMPTS", 5))
+RESEND_COOLDOWN_SEC = int(getattr(settings, "OTP_RESEND_COOLDOWN_SEC", 60))
+
+
+def _code_key(phone: str) -> str:
+    return f"otp:code:{phone}"
+
+
+def _attempts_key(phone: str) -> str:
+    return f"otp:attempts:{phone}"
+
+
+def _cooldown_key(phone: str) -> str:
+    return f"otp:cooldown:{phone}"
+
+
+def _digest(phone: str, code) -> str:
+    msg = f"{phone}:{code}".encode()
+    return hmac.new(settings.SECRET_KEY.encode(), msg, hashlib.sha256).hexdigest()
+
+
+def reserve(phone: str) -> bool:
+    """
+    قفل ارسال مجدد؛ اگر از ارسال قبلی کمتر از RESEND_COOLDOWN_SEC گذشته باشد False.
+    (در view و پیش از صف کردن پیامک صدا زده می‌شود.)
+    """
+    return cache.add(_cooldown_key(phone), 1, RESEND_COOLDOWN_SEC)
+
+
+def release(phone: str) -> None:
+    """لغو reserve/issue وقتی پیامک اصلاً به صف نرسید، تا کاربر بلافاصله دوباره تلاش کند."""
+    cache.delete_many([_cooldown_key(phone), _code_key(phone), _attempts_key(phone)])
+
+
+def issue(phone: str) -> int:
+    """
+    کد جدید ۶ رقمی می‌سازد و فقط هش آن را ذخیره می‌کند (کد قبلی و شمارندهٔ تلاش باطل می‌شوند).
+    در worker ارسال پیامک صدا زده می‌شود تا کد خام هرگز وارد broker یا لاگ تسک نشود.
+    """
+    code = secrets.randbelow(900000) + 100000
+    cache.set(_code_key(phone), _digest(phone, code), TTL_SEC)
+    cache.delete(_attempts_key(phone))
+    return code
+
+
+def verify(phone: str, code) -> bool:
+    """
+    بررسی کد؛ در صورت موفقیت کد مصرف (حذف) می‌شود. پس از MAX_ATTEMPTS تلاش اشتباه کد باطل
+    می‌شود و کاربر باید کد جدید بگیرد.
+    """
+    stored = cache.get(_code_key(phone))
+    if stored is None:
+        return False
+    cache.add(_attempts_key(phone), 0, TTL_SEC)
+    try:
+        attempts = cache.incr(_attempts_key(phone))
+    except ValueError:
+        cache.set(_attempts_key(phone), 1, TTL_SEC)
+        attempts = 1
+    if attempts > MAX_ATTEMPTS:
+        cache.delete_many([_code_key(phone), _attempts_key(phone)])
+        return False
+    if not hmac.compare_digest(stored, _digest(phone, str(code).strip())):
+        return False
+    cache.delete_many([_code_key(phone), _attempts_key(phone)])
+    return True
@@ -0,0 +1,150 @@
+# telemedicine/outbox.py
+# صندوق خروجی تراکنشی: سیگنال‌ها به‌جای تماس مستقیم با کاوه‌نگار/SMTP فقط یک OutboxMessage در همان
+# تراکنش ثبت می‌کنند؛ پس از commit، ارسال به Celery سپرده می‌شود. تلاش مجدد با backoff نمایی،
+# کلید idempotency یکتا و dead-letter پس از OUTBOX_MAX_ATTEMPTS.
+from __future__ import annotations
+
+import logging
+from datetime import timedelta
+from typing import Callable, Dict
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+
+from telemedicine.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = int(getattr(settings, "OUTBOX_MAX_ATTEMPTS", 6))
+BACKOFF_BASE_SEC = 30
+BACKOFF_MAX_SEC = 60 * 60
+SWEEP_BATCH = 100
+
+
+def _send_sms(payload: Dict) -> None:
+    from telemedicine.sms import send_lookup
+
+    send_lookup(payload)
+
+
+def _send_email(payload: Dict) -> None:
+    email = EmailMessage(
+        subject=payload["subject"],
+        body=payload["body"],
+        from_email=payload.get("from_email"),
+        to=payload["to"],
+    )
+    email.content_subtype = payload.get("content_subtype", "plain")
+    email.send()
+
+
+HANDLERS: Dict[str, Callable[[Dict], None]] = {
+    OutboxMessage.KIND_SMS: _send_sms,
+    OutboxMessage.KIND_EMAIL: _send_email,
+}
+
+
+def backoff(attempts: int) -> timedelta:
+    """فاصلهٔ تلاش بعدی: 30s، 60s، 120s ... حداکثر یک ساعت."""
+    return timedelta(seconds=min(BACKOFF_BASE_SEC * 2 ** max(attempts - 1, 0), BACKOFF_MAX_SEC))
+
+
+def _schedule(message_id: int, countdown: float = 0) -> None:
+    from medogram_tasks import dispatch_outbox_message_task
+
+    try:
+        if countdown:
+            dispatch_outbox_message_task.apply_async((message_id,), countdown=countdown)
+        else:
+            dispatch_outbox_message_task.delay(message_id)
+    except Exception as exc:  # noqa: BLE001  (broker در دسترس نیست؛ جاروب دوره‌ای برمی‌دارد)
+        logger.warning("Outbox %s: could not queue dispatch task: %s", message_id, exc)
+
+
+def enqueue(kind: str, payload: Dict, *, key: str) -> OutboxMessage:
+    """
+    ثبت پیام در صندوق خروجی (داخل تراکنش جاری) و زمان‌بندی ارسال پس از commit.
+    اگر پیامی با همین key قبلاً ثبت شده باشد، همان برگردانده می‌شود و دوباره ارسال نمی‌شود.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown outbox kind: {kind}")
+    message, created = OutboxMessage.objects.get_or_create(
+        idempotency_key=key, defaults={"kind": kind, "payload": payload}
+    )
+    if created:
+        transaction.on_commit(lambda: _schedule(message.pk))
+    return message
+
+
+def deliver(message_id: int) -> str:
+    """
+    یک تلاش ارسال؛ وضعیت نهایی پیام را برمی‌گرداند. ردیف با skip_locked قفل می‌شود تا
+    دو worker هم‌زمان یک پیام را نفرستند.
+    """
+    with transaction.atomic():
+        message = (
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(pk=message_id, status=OutboxMessage.STATUS_PENDING)
+            .first()
+        )
+        if message is None:
+            return "skipped"
+        now = timezone.now()
+        if message.available_at > now:
+            return "not_due"
+
+        try:
+            HANDLERS[message.kind](message.payload)
+        except Exception as exc:  # noqa: BLE001
+            message.attempts += 1
+            message.last_error = f"{type(exc).__name__}: {exc}"[:2000]
+            # خطای قطعی درگاه (مثلاً شمارهٔ نامعتبر) تکرار نمی‌شود
+            if message.attempts >= MAX_ATTEMPTS or getattr(exc, "retryable", True) is False:
+                message.status = OutboxMessage.STATUS_DEAD
+                logger.error(
+                    "Outbox %s (%s) dead after %s attempts: %s",
+                    message.pk, message.idempotency_key, message.attempts, message.last_error,
+                )
+            else:
+                delay = backoff(message.attempts)
+                message.available_at = now + delay
+                transaction.on_commit(lambda: _schedule(message.pk, delay.total_seconds()))
+                logger.warning(
+                    "Outbox %s (%s) attempt %s failed, retry in %ss: %s",
+                    message.pk, message.idempotency_key, message.attempts, int(delay.total_seconds()),
+                    message.last_error,
+                )
+            message.save(update_fields=["attempts", "last_error", "status", "available_at"])
+            return message.status
+
+        message.status = OutboxMessage.STATUS_SENT
+        message.sent_at = now
+        message.attempts += 1
+        message.save(update_fields=["status", "sent_at", "attempts"])
+        logger.info("Outbox %s (%s) sent", message.pk, message.idempotency_key)
+        return message.status
+
+
+def dispatch_due(limit: int = SWEEP_BATCH) -> int:
+    """جاروب پیام‌های سررسیدشده‌ای که تسکشان گم شده (broker قطع بوده یا worker ری‌استارت شده)."""
+    ids = list(
+        OutboxMessage.objects.filter(status=OutboxMessage.STATUS_PENDING, available_at__lte=timezone.now())
+        .order_by("available_at")
+        .values_list("pk", flat=True)[:limit]
+    )
+    for message_id in ids:
+        deliver(message_id)
+    return len(ids)
+
+
+def retry_dead(queryset) -> int:
+    """برگرداندن پیام‌های dead به صف (اکشن ادمین)."""
+    ids = list(queryset.filter(status=OutboxMessage.STATUS_DEAD).values_list("pk", flat=True))
+    OutboxMessage.objects.filter(pk__in=ids).update(
+        status=OutboxMessage.STATUS_PENDING, attempts=0, available_at=timezone.now()
+    )
+    for message_id in ids:
+        transaction.on_commit(lambda pk=message_id: _schedule(pk))
+    return len(ids)
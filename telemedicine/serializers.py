@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from django.conf import settings
+from .imaging import ImageRejected, probe_image
 from .models import Visit, Transaction, CustomUser, Comment, Blog, BoxMoney
 
 MAX_UPLOAD_SIZE = settings.MAX_UPLOAD_SIZE
@@ -19,7 +20,7 @@ class CustomUserProfileJustUserNameSerializer(serializers.ModelSerializer):
 class CustomUserSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
-        fields = ['phone_number', 'auth_code']
+        fields = ['phone_number']
 
 
 class VisitSerializer(serializers.ModelSerializer):
@@ -51,6 +52,10 @@ class VisitSerializer(serializers.ModelSerializer):
     def validate_drug_images(self, value):
         if value:
             self.validate_image_size(value)
+            try:
+                probe_image(value)  # فقط هدر؛ تصویر خیلی بزرگ یا با فرمت غیرمجاز پیش از decode رد می‌شود
+            except ImageRejected as e:
+                raise serializers.ValidationError(str(e))
 
         return value
 
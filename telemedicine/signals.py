@@ -1,14 +1,12 @@
 # telemedicine/signals.py
 import random
 
-from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.mail import EmailMessage
 from django.db.models.signals import pre_save, post_save
 from django.dispatch import receiver, Signal
 from django.template.loader import render_to_string
-from kavenegar import KavenegarAPI
-from telemedicine.models import BoxMoney, Transaction, Visit, APKDownloadStat
+from telemedicine import outbox
+from telemedicine.models import BoxMoney, Transaction, Visit, APKDownloadStat, OutboxMessage
 from django.utils import timezone
 from django.db.models import F
 
@@ -82,14 +80,13 @@ def update_wallet_after_transaction(sender, instance, **kwargs):
 def send_visit_email(sender, instance, created, **kwargs):
     if created:
         html_content = render_to_string('visit_email.html', {'visit': instance})
-        email = EmailMessage(
-            subject=f"Visit Details: {instance.name}",
-            body=html_content,
-            from_email='info@medogram.ir',
-            to=['shabanimehran@gmail.com'],
-        )
-        email.content_subtype = "html"
-        email.send()
+        outbox.enqueue(OutboxMessage.KIND_EMAIL, {
+            "subject": f"Visit Details: {instance.name}",
+            "body": html_content,
+            "from_email": 'info@medogram.ir',
+            "to": ['shabanimehran@gmail.com'],
+            "content_subtype": "html",
+        }, key=f"visit-email:{instance.pk}")
 
 
 # ──────────────────────────────
@@ -102,15 +99,12 @@ def sms_visit_created(sender, instance, created, **kwargs):
 
     phone = getattr(instance.user, "phone_number", None)
     if phone:
-        try:
-            api = KavenegarAPI(settings.KAVEH_NEGAR_API_KEY)
-            api.verify_lookup({
-                "receptor": phone,
-                "token": random.randint(100000, 999999),
-                "template": "register-visit",
-            })
-        except Exception as exc:  # noqa: BLE001
-            print(f"[WARN] Kavenegar register-visit SMS failed: {exc}")
+        # ارسال واقعی پس از commit در worker (telemedicine.outbox)
+        outbox.enqueue(OutboxMessage.KIND_SMS, {
+            "receptor": phone,
+            "token": random.randint(100000, 999999),
+            "template": "register-visit",
+        }, key=f"visit-created-sms:{instance.pk}")
 
             
 apk_downloaded = Signal()
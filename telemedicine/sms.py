@@ -0,0 +1,290 @@
+# telemedicine/sms.py
+# لایهٔ درگاه پیامک: همهٔ ارسال‌ها (کد ورود، صندوق خروجی، کمپین‌ها) از get_backend() عبور می‌کنند.
+# KavenegarBackend یک requests.Session مشترک با pool اتصال (برای هر پروسس) دارد؛
+# FakeBackend برای تست و بار‌سنجی بدون تماس شبکه است (SMS_BACKEND=telemedicine.sms.FakeBackend).
+# send_bulk ارسال انبوه با هم‌زمانی محدود و سقف پیام در ثانیه است و نتیجهٔ هر پیام در SMSDelivery ثبت می‌شود.
+from __future__ import annotations
+
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from telemedicine.models import SMSDelivery
+
+logger = logging.getLogger(__name__)
+
+BACKEND_PATH = "telemedicine.sms.KavenegarBackend"
+POOL_SIZE = int(getattr(settings, "SMS_POOL_SIZE", 10))
+TIMEOUT_SEC = float(getattr(settings, "SMS_TIMEOUT_SEC", 10))
+BULK_CONCURRENCY = int(getattr(settings, "SMS_BULK_CONCURRENCY", 8))
+RATE_PER_SEC = float(getattr(settings, "SMS_RATE_PER_SEC", 20))
+# پیامکی که پس از این مدت هنوز گزارش تحویل نهایی ندارد دیگر استعلام نمی‌شود (expired)
+STATUS_EXPIRE_HOURS = int(getattr(settings, "SMS_STATUS_EXPIRE_HOURS", 72))
+STATUS_BATCH = 500  # سقف messageid در هر درخواست status کاوه‌نگار
+TRACK_BATCH = 500
+
+# کدهای وضعیت تحویل کاوه‌نگار
+_DELIVERED = {10}
+_UNDELIVERED = {6, 11, 13, 14, 100}
+
+
+class SMSError(Exception):
+    """خطای درگاه؛ retryable یعنی خطای شبکه/سمت سرور که تلاش دوباره معنا دارد."""
+
+    def __init__(self, message: str, status: Optional[int] = None, retryable: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class SendResult(NamedTuple):
+    receptor: str
+    message_id: Optional[int]
+    status: Optional[int]
+
+
+class RateLimiter:
+    """فاصله‌گذاری یکنواخت فراخوانی‌ها بین threadها (حداکثر rate بار در ثانیه)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class SMSBackend:
+    def verify_lookup(self, params: Dict) -> SendResult:
+        raise NotImplementedError
+
+    def status(self, message_ids: List[int]) -> Dict[int, int]:
+        """{messageid: کد وضعیت تحویل}"""
+        raise NotImplementedError
+
+
+class KavenegarBackend(SMSBackend):
+    base_url = "https://api.kavenegar.com/v1"
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or settings.KAVEH_NEGAR_API_KEY
+        self._session: Optional[requests.Session] = None
+        self._pid = None
+
+    @property
+    def session(self) -> requests.Session:
+        # Session بین پروسس‌های fork شده (worker های Celery) مشترک نمی‌شود
+        if self._session is None or self._pid != os.getpid():
+            session = requests.Session()
+            # فقط خطای اتصال تکرار می‌شود؛ تکرار درخواستِ رسیده ممکن است پیامک تکراری بفرستد
+            retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry))
+            self._session, self._pid = session, os.getpid()
+        return self._session
+
+    def _call(self, scope: str, method: str, data: Dict) -> List[Dict]:
+        url = f"{self.base_url}/{self.api_key}/{scope}/{method}.json"
+        try:
+            response = self.session.post(url, data=data, timeout=TIMEOUT_SEC)
+            body = response.json()
+        except (requests.RequestException, ValueError) as exc:
+            raise SMSError(f"Kavenegar {scope}/{method}: {exc}", retryable=True)
+        ret = body.get("return") or {}
+        code = int(ret.get("status", response.status_code))
+        if code != 200:
+            raise SMSError(
+                f"Kavenegar {scope}/{method} {code}: {ret.get('message', '')}",
+                status=code, retryable=code >= 500,
+            )
+        return body.get("entries") or []
+
+    def verify_lookup(self, params: Dict) -> SendResult:
+        entries = self._call("verify", "lookup", params)
+        entry = entries[0] if entries else {}
+        return SendResult(str(params.get("receptor")), entry.get("messageid"), entry.get("status"))
+
+    def status(self, message_ids: List[int]) -> Dict[int, int]:
+        entries = self._call("sms", "status", {"messageid": ",".join(map(str, message_ids))})
+        return {int(e["messageid"]): int(e["status"]) for e in entries}
+
+
+class FakeBackend(SMSBackend):
+    """
+    درگاه محلی: پیام‌ها در self.sent جمع می‌شوند. fail_receptors شماره‌هایی که خطا می‌دهند
+    و latency تأخیر مصنوعی هر ارسال (برای بارسنجی).
+    """
+
+    def __init__(self, latency: float = 0.0, fail_receptors: Iterable[str] = ()):
+        self.latency = latency
+        self.fail_receptors = set(fail_receptors)
+        self.sent: List[Dict] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def verify_lookup(self, params: Dict) -> SendResult:
+        if self.latency:
+            time.sleep(self.latency)
+        receptor = str(params.get("receptor"))
+        if receptor in self.fail_receptors:
+            raise SMSError(f"fake gateway rejected {receptor}", status=411)
+        with self._lock:
+            self.sent.append(dict(params))
+            message_id = next(self._ids)
+        return SendResult(receptor, message_id, 1)
+
+    def status(self, message_ids: List[int]) -> Dict[int, int]:
+        return {message_id: 10 for message_id in message_ids}
+
+
+_backend: Optional[SMSBackend] = None
+_backend_path: Optional[str] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> SMSBackend:
+    """نمونهٔ مشترک درگاه از settings.SMS_BACKEND (تا session و pool اتصال بین پیام‌ها حفظ شود)."""
+    global _backend, _backend_path
+    path = getattr(settings, "SMS_BACKEND", None) or BACKEND_PATH
+    with _backend_lock:
+        if _backend is None or _backend_path != path:
+            _backend, _backend_path = import_string(path)(), path
+        return _backend
+
+
+def send_lookup(params: Dict) -> SendResult:
+    """ارسال یک پیامک قالبی (receptor, token[, token2, token3], template)."""
+    return get_backend().verify_lookup(params)
+
+
+class BulkResult(NamedTuple):
+    sent: int
+    failed: int
+    skipped: int = 0
+
+
+def send_bulk(
+    messages: Iterable[Dict],
+    *,
+    campaign: str,
+    concurrency: Optional[int] = None,
+    rate_per_sec: Optional[float] = None,
+) -> BulkResult:
+    """
+    ارسال انبوه پیامک‌های قالبی با حداکثر concurrency درخواست هم‌زمان و rate_per_sec پیام در ثانیه.
+    نتیجهٔ هر پیام (شناسهٔ پیام یا خطا) با برچسب campaign در SMSDelivery ثبت می‌شود. گیرنده‌ای که
+    قبلاً در همین campaign ثبت شده (موفق یا ناموفق) دوباره پیامک نمی‌گیرد، پس اجرای دوبارهٔ کمپین
+    نیمه‌تمام فقط باقی‌مانده را می‌فرستد.
+    """
+    backend = get_backend()
+    limiter = RateLimiter(RATE_PER_SEC if rate_per_sec is None else rate_per_sec)
+    done = set(SMSDelivery.objects.filter(campaign=campaign).values_list("receptor", flat=True))
+    skipped = 0
+
+    def todo():
+        nonlocal skipped
+        for params in messages:
+            receptor = str(params.get("receptor"))
+            if receptor in done:
+                skipped += 1
+                continue
+            done.add(receptor)
+            yield params
+
+    def send_one(params: Dict) -> SMSDelivery:
+        limiter.acquire()
+        row = SMSDelivery(campaign=campaign, receptor=str(params.get("receptor")), template=params.get("template", ""))
+        try:
+            result = backend.verify_lookup(params)
+        except SMSError as exc:
+            row.status, row.gateway_status, row.error = SMSDelivery.STATUS_FAILED, exc.status, str(exc)[:500]
+        except Exception as exc:  # noqa: BLE001  (خطای یک پیام نباید کل کمپین را متوقف کند)
+            logger.exception("SMS campaign %s: unexpected error for %s", campaign, row.receptor)
+            row.status, row.error = SMSDelivery.STATUS_FAILED, f"{type(exc).__name__}: {exc}"[:500]
+        else:
+            row.status, row.message_id, row.gateway_status = SMSDelivery.STATUS_SENT, result.message_id, result.status
+        return row
+
+    sent = failed = 0
+    pending: List[SMSDelivery] = []
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency or BULK_CONCURRENCY) as pool:
+            for row in pool.map(send_one, todo()):
+                if row.status == SMSDelivery.STATUS_SENT:
+                    sent += 1
+                else:
+                    failed += 1
+                pending.append(row)
+                if len(pending) >= TRACK_BATCH:
+                    SMSDelivery.objects.bulk_create(pending)
+                    pending = []
+    finally:
+        # حتی اگر حلقه قطع شود، پیامک‌های فرستاده‌شده ثبت می‌شوند تا اجرای دوباره تکرارشان نکند
+        if pending:
+            SMSDelivery.objects.bulk_create(pending)
+    logger.info("SMS campaign %s: sent=%s failed=%s skipped=%s", campaign, sent, failed, skipped)
+    return BulkResult(sent, failed, skipped)
+
+
+def refresh_delivery_status(limit: int = 5000) -> int:
+    """
+    به‌روزرسانی وضعیت تحویل پیامک‌های ارسال‌شده از درگاه؛ تعداد ردیف‌های نهایی‌شده را برمی‌گرداند.
+    ردیف‌ها به ترتیب قدیمی‌ترین استعلام خوانده می‌شوند و status_checked_at همه‌شان جلو می‌رود،
+    پس کدهای غیرنهایی (در صف، ارسال به مخابرات...) دور بعد پشت ردیف‌های تازه‌تر قرار می‌گیرند.
+    ردیف‌هایی که پس از STATUS_EXPIRE_HOURS هنوز نهایی نشده‌اند expired می‌شوند.
+    """
+    backend = get_backend()
+    now = timezone.now()
+    expired = SMSDelivery.objects.filter(
+        status=SMSDelivery.STATUS_SENT, created_at__lt=now - timedelta(hours=STATUS_EXPIRE_HOURS)
+    ).update(status=SMSDelivery.STATUS_EXPIRED, updated_at=now)
+    if expired:
+        logger.info("SMS status refresh: %s deliveries expired without a final report", expired)
+
+    rows = list(
+        SMSDelivery.objects.filter(status=SMSDelivery.STATUS_SENT, message_id__isnull=False)
+        .order_by("status_checked_at", "id")
+        .only("id", "message_id")[:limit]
+    )
+    updated = 0
+    for start in range(0, len(rows), STATUS_BATCH):
+        chunk = rows[start:start + STATUS_BATCH]
+        try:
+            statuses = backend.status([r.message_id for r in chunk])
+        except SMSError as exc:
+            logger.warning("SMS status refresh failed: %s", exc)
+            break
+        now = timezone.now()
+        for row in chunk:
+            row.status_checked_at = row.updated_at = now
+            code = statuses.get(row.message_id)
+            if code in _DELIVERED:
+                row.status = SMSDelivery.STATUS_DELIVERED
+            elif code in _UNDELIVERED:
+                row.status = SMSDelivery.STATUS_UNDELIVERED
+            else:
+                row.status = SMSDelivery.STATUS_SENT
+                continue
+            row.gateway_status = code
+            updated += 1
+        SMSDelivery.objects.bulk_update(chunk, ["status", "gateway_status", "status_checked_at", "updated_at"])
+    return updated
@@ -0,0 +1,128 @@
+import io
+
+import pytest
+from PIL import Image
+
+from telemedicine import imaging
+from telemedicine.imaging import ImageBudget, ImageRejected, decode_image, probe_image
+
+
+def _encode(im, fmt, **kw):
+    buf = io.BytesIO()
+    im.save(buf, fmt, **kw)
+    return buf.getvalue()
+
+
+def test_probe_reads_header_without_decoding():
+    data = _encode(Image.new("RGB", (1600, 1200), (90, 20, 20)), "JPEG")
+    info = probe_image(data)
+    assert (info.format, info.width, info.height, info.orientation) == ("JPEG", 1600, 1200, 1)
+
+
+def test_probe_rejects_oversized_and_unsupported(monkeypatch):
+    monkeypatch.setattr(imaging, "MAX_PIXELS", 1_000_000)
+    with pytest.raises(ImageRejected):
+        probe_image(_encode(Image.new("L", (2000, 2000)), "PNG"))
+    with pytest.raises(ImageRejected):
+        probe_image(_encode(Image.new("RGB", (10, 10)), "TIFF"))
+    with pytest.raises(ImageRejected):
+        probe_image(b"not an image")
+
+
+def test_jpeg_decodes_through_draft_within_budget():
+    data = _encode(Image.new("RGB", (4000, 3000), (10, 120, 200)), "JPEG")
+    budget = ImageBudget(limit_bytes=16 * 1024 * 1024)  # کمتر از decode کامل (۴۸ مگابایت)
+    im = decode_image(data, max_pixels=1_000_000, budget=budget)
+    assert im.width * im.height <= 1_000_000 + 4000
+    assert budget.used_bytes <= 4000 * 3000 * 4 // 4  # draft با مقیاس ۱/۲ یا کمتر
+
+
+def test_budget_is_shared_across_images_of_a_request():
+    data = _encode(Image.new("RGB", (1000, 1000)), "PNG")
+    budget = ImageBudget(limit_bytes=6 * 1024 * 1024)
+    decode_image(data, budget=budget)
+    with pytest.raises(ImageRejected):
+        decode_image(data, budget=budget)
+
+
+def test_exif_orientation_is_applied():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # ۹۰ درجه
+    data = _encode(Image.new("RGB", (400, 200)), "JPEG", exif=exif)
+    assert probe_image(data).orientation == 6
+    assert decode_image(data).size == (200, 400)
+
+
+@pytest.mark.django_db
+def test_visit_converts_heic_by_content_and_rejects_bombs(settings, tmp_path, monkeypatch):
+    from django.contrib.auth import get_user_model
+    from django.core.files.base import ContentFile
+    from rest_framework.exceptions import ValidationError
+
+    from sub.models import SubscriptionPlan
+    from telemedicine.models import Visit
+
+    settings.MEDIA_ROOT = tmp_path
+    SubscriptionPlan.objects.get_or_create(id=5, defaults={"name": "هدیه", "days": 7, "price": 0})
+    user = get_user_model().objects.create_user(phone_number="09120000010", password="x")
+    fields = dict(user=user, name="v", urgency="low", general_symptoms="-")
+
+    heic = _encode(Image.new("RGB", (640, 480), (0, 128, 0)), "HEIF")
+    visit = Visit(drug_images=ContentFile(heic, name="photo.bin"), **fields)
+    visit.save()
+    assert visit.drug_images.name.endswith(".jpg")
+    with Image.open(visit.drug_images.path) as im:
+        assert im.format == "JPEG" and im.size == (640, 480)
+
+    monkeypatch.setattr(imaging, "MAX_PIXELS", 100_000)
+    with pytest.raises(ValidationError):
+        Visit(drug_images=ContentFile(heic, name="photo.heic"), **fields).save()
+
+
+def test_pool_runs_jobs_out_of_process_with_backpressure_and_timeout(monkeypatch):
+    import os
+    import threading
+    import time
+
+    from telemedicine.imaging import ImagePoolBusy, heic_to_jpeg, run_image_job, submit_image_job
+
+    monkeypatch.setattr(imaging, "POOL_WORKERS", 1)
+    heic = _encode(Image.new("RGB", (320, 240), (200, 0, 0)), "HEIF")
+    assert Image.open(io.BytesIO(run_image_job(heic_to_jpeg, heic, None, 80))).format == "JPEG"
+    assert run_image_job(os.getpid) != os.getpid()
+
+    with pytest.raises(ImagePoolBusy):
+        run_image_job(time.sleep, 1, timeout=0.05)
+
+    monkeypatch.setattr(imaging, "_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(imaging, "QUEUE_WAIT_SEC", 0.01)
+    first = submit_image_job(time.sleep, 0.5)
+    with pytest.raises(ImagePoolBusy):
+        submit_image_job(time.sleep, 0)
+    first.result()
+
+
+def test_hung_job_is_killed_and_its_slot_released(monkeypatch):
+    import os
+    import threading
+    import time
+
+    from telemedicine.imaging import ImagePoolBusy, run_image_job
+
+    monkeypatch.setattr(imaging, "POOL_WORKERS", 1)
+    monkeypatch.setattr(imaging, "_slots", threading.BoundedSemaphore(1))
+    monkeypatch.setattr(imaging, "QUEUE_WAIT_SEC", 0.01)
+    worker = run_image_job(os.getpid)
+    hung_pool = imaging._get_pool()
+    procs = list(hung_pool._processes.values())
+
+    with pytest.raises(ImagePoolBusy):
+        run_image_job(time.sleep, 60, timeout=0.2)
+
+    assert imaging._pool is not hung_pool
+    for proc in procs:
+        proc.join(5)
+        assert not proc.is_alive()
+    # جای صف آزاد شده و استخر تازه کار می‌کند
+    assert run_image_job(os.getpid) not in (os.getpid(), worker)
+    imaging._reset_pool()
@@ -0,0 +1,92 @@
+import pytest
+from django.core.cache import cache
+from rest_framework.test import APIClient
+
+import medogram_tasks
+from telemedicine import otp
+from telemedicine.models import OutboxMessage
+
+PHONE = "09120000099"
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_code_is_hashed_single_use_and_rate_limited():
+    assert otp.reserve(PHONE)
+    assert not otp.reserve(PHONE)  # فاصلهٔ حداقلی ارسال مجدد
+    code = otp.issue(PHONE)
+    assert 100000 <= code <= 999999
+    assert str(code) not in str(cache.get(otp._code_key(PHONE)))
+    assert otp.verify(PHONE, code)
+    assert not otp.verify(PHONE, code)
+
+
+def test_code_is_burned_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(otp, "MAX_ATTEMPTS", 2)
+    code = otp.issue(PHONE)
+    wrong = 100000 if code != 100000 else 100001
+    assert not otp.verify(PHONE, wrong)
+    assert not otp.verify(PHONE, wrong)
+    assert not otp.verify(PHONE, code)
+
+
+@pytest.fixture
+def fake_sms(settings, monkeypatch):
+    from telemedicine import sms
+
+    monkeypatch.setattr(sms, "_backend", None)  # نمونهٔ تازه برای هر آزمون
+    settings.SMS_BACKEND = "telemedicine.sms.FakeBackend"
+    return sms.get_backend()
+
+
+@pytest.fixture
+def plan(db):
+    from sub.models import SubscriptionPlan
+
+    SubscriptionPlan.objects.get_or_create(id=5, defaults={"name": "هدیه", "days": 7, "price": 0})
+
+
+@pytest.mark.django_db
+def test_login_flow_keeps_code_out_of_broker_and_db(plan, fake_sms, monkeypatch, django_assert_max_num_queries):
+    queued = []
+    monkeypatch.setattr(
+        medogram_tasks.send_otp_sms_task, "apply_async", lambda args, **kw: queued.append((args, kw))
+    )
+    client = APIClient()
+
+    response = client.post("/api/register/", {"phone_number": PHONE})
+    assert response.status_code == 202
+    assert queued == [((PHONE,), {"expires": otp.TTL_SEC})]  # کد خام در آرگومان تسک نیست
+    assert client.post("/api/register/", {"phone_number": PHONE}).status_code == 429
+
+    # شماره موجود: فقط یک SELECT؛ هیچ نوشتنی روی ردیف کاربر
+    cache.delete(otp._cooldown_key(PHONE))
+    with django_assert_max_num_queries(1):
+        assert client.post("/api/register/", {"phone_number": PHONE}).status_code == 202
+
+    medogram_tasks.send_otp_sms_task.run(PHONE)  # اجرای worker
+    code = fake_sms.sent[-1]["token"]
+
+    assert client.post("/api/verify/", {"phone_number": PHONE, "code": 111}).status_code == 400
+    response = client.post("/api/verify/", {"phone_number": PHONE, "code": code})
+    assert response.status_code == 200 and "access" in response.data
+    assert OutboxMessage.objects.filter(idempotency_key__startswith="first-log-sms:").count() == 1
+
+
+@pytest.mark.django_db
+def test_failed_enqueue_releases_cooldown(plan, monkeypatch):
+    def _broker_down(*args, **kwargs):
+        raise ConnectionError("broker unreachable")
+
+    monkeypatch.setattr(medogram_tasks.send_otp_sms_task, "apply_async", _broker_down)
+    client = APIClient()
+
+    assert client.post("/api/register/", {"phone_number": PHONE}).status_code == 503
+    assert cache.get(otp._cooldown_key(PHONE)) is None
+    assert cache.get(otp._code_key(PHONE)) is None
+    assert otp.reserve(PHONE)
@@ -0,0 +1,82 @@
+import pytest
+from django.db import transaction
+from django.utils import timezone
+
+from telemedicine import outbox
+from telemedicine.models import OutboxMessage
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    calls = []
+    monkeypatch.setitem(outbox.HANDLERS, OutboxMessage.KIND_SMS, calls.append)
+    return calls
+
+
+@pytest.fixture
+def scheduled(monkeypatch):
+    calls = []
+    monkeypatch.setattr(outbox, "_schedule", lambda pk, countdown=0: calls.append((pk, countdown)))
+    return calls
+
+
+def test_enqueue_schedules_only_after_commit_and_is_idempotent(django_capture_on_commit_callbacks, scheduled):
+    with django_capture_on_commit_callbacks(execute=True) as callbacks:
+        with transaction.atomic():
+            message = outbox.enqueue("sms", {"receptor": "0912"}, key="k-1")
+            assert scheduled == []
+            assert outbox.enqueue("sms", {"receptor": "other"}, key="k-1").pk == message.pk
+    assert len(callbacks) == 1
+    assert scheduled == [(message.pk, 0)]
+    assert OutboxMessage.objects.get().payload == {"receptor": "0912"}
+
+
+def test_enqueue_is_rolled_back_with_the_transaction(django_capture_on_commit_callbacks, scheduled):
+    with django_capture_on_commit_callbacks(execute=True):
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                outbox.enqueue("sms", {}, key="k-2")
+                raise RuntimeError
+    assert not OutboxMessage.objects.exists()
+    assert scheduled == []
+
+
+def test_deliver_sends_once(sent):
+    message = OutboxMessage.objects.create(kind="sms", payload={"receptor": "0912"}, idempotency_key="k-3")
+    assert outbox.deliver(message.pk) == "sent"
+    assert outbox.deliver(message.pk) == "skipped"
+    assert sent == [{"receptor": "0912"}]
+    message.refresh_from_db()
+    assert message.sent_at is not None and message.attempts == 1
+
+
+def test_failures_back_off_then_dead_letter(monkeypatch, django_capture_on_commit_callbacks, scheduled):
+    def boom(payload):
+        raise ConnectionError("gateway down")
+
+    monkeypatch.setitem(outbox.HANDLERS, OutboxMessage.KIND_SMS, boom)
+    monkeypatch.setattr(outbox, "MAX_ATTEMPTS", 3)
+    message = OutboxMessage.objects.create(kind="sms", payload={}, idempotency_key="k-4")
+
+    with django_capture_on_commit_callbacks(execute=True):
+        assert outbox.deliver(message.pk) == "pending"
+    assert scheduled == [(message.pk, 30.0)]
+    assert outbox.deliver(message.pk) == "not_due"
+
+    for expected in ("pending", "dead"):
+        OutboxMessage.objects.filter(pk=message.pk).update(available_at=timezone.now())
+        assert outbox.deliver(message.pk) == expected
+    message.refresh_from_db()
+    assert message.attempts == 3 and "gateway down" in message.last_error
+    assert outbox.dispatch_due() == 0
+
+    assert outbox.retry_dead(OutboxMessage.objects.all()) == 1
+    message.refresh_from_db()
+    assert (message.status, message.attempts) == ("pending", 0)
+
+
+def test_backoff_is_capped():
+    assert [outbox.backoff(n).total_seconds() for n in (1, 2, 3)] == [30, 60, 120]
+    assert outbox.backoff(20).total_seconds() == outbox.BACKOFF_MAX_SEC
@@ -0,0 +1,105 @@
+import time
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from telemedicine import outbox, sms
+from telemedicine.models import OutboxMessage, SMSDelivery
+
+
+@pytest.fixture
+def fake(settings, monkeypatch):
+    monkeypatch.setattr(sms, "_backend", None)  # نمونهٔ تازه برای هر آزمون
+    settings.SMS_BACKEND = "telemedicine.sms.FakeBackend"
+    backend = sms.get_backend()
+    assert isinstance(backend, sms.FakeBackend)
+    return backend
+
+
+def test_backend_instance_and_session_are_reused():
+    backend = sms.get_backend()
+    assert backend is sms.get_backend()
+    assert backend.session is backend.session
+    adapter = backend.session.get_adapter("https://api.kavenegar.com/")
+    assert adapter._pool_maxsize == sms.POOL_SIZE
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = sms.RateLimiter(50)
+    t0 = time.monotonic()
+    for _ in range(11):
+        limiter.acquire()
+    assert time.monotonic() - t0 >= 0.19
+
+
+@pytest.mark.django_db
+def test_bulk_send_tracks_results_and_delivery(fake):
+    fake.fail_receptors = {"0900"}
+    messages = [{"receptor": f"09{i:09d}", "token": "x", "template": "app-update"} for i in range(30)]
+    messages.append({"receptor": "0900", "token": "x", "template": "app-update"})
+
+    result = sms.send_bulk(messages, campaign="v2", concurrency=4, rate_per_sec=0)
+    assert result == sms.BulkResult(sent=30, failed=1)
+    assert len(fake.sent) == 30
+    failed = SMSDelivery.objects.get(status=SMSDelivery.STATUS_FAILED)
+    assert failed.receptor == "0900" and failed.gateway_status == 411
+
+    assert sms.refresh_delivery_status() == 30
+    assert SMSDelivery.objects.filter(campaign="v2", status=SMSDelivery.STATUS_DELIVERED).count() == 30
+
+
+@pytest.mark.django_db
+def test_bulk_send_survives_unexpected_errors_and_rerun_skips_recorded(fake, monkeypatch):
+    real = fake.verify_lookup
+
+    def flaky(params):
+        if params["receptor"] == "0905":
+            raise ValueError("bad template params")
+        return real(params)
+
+    monkeypatch.setattr(fake, "verify_lookup", flaky)
+    messages = [{"receptor": f"090{i}", "token": "x", "template": "t"} for i in range(10)]
+
+    assert sms.send_bulk(messages, campaign="c1", concurrency=3, rate_per_sec=0) == sms.BulkResult(9, 1)
+    failed = SMSDelivery.objects.get(campaign="c1", status=SMSDelivery.STATUS_FAILED)
+    assert failed.receptor == "0905" and failed.error.startswith("ValueError")
+
+    # اجرای دوباره (مثلاً پس از قطع worker) به گیرنده‌های ثبت‌شده دوباره پیامک نمی‌دهد
+    messages.append({"receptor": "0999", "token": "x", "template": "t"})
+    assert sms.send_bulk(messages, campaign="c1", rate_per_sec=0) == sms.BulkResult(1, 0, skipped=10)
+    assert len(fake.sent) == 10
+    assert SMSDelivery.objects.filter(campaign="c1").count() == 11
+
+
+@pytest.mark.django_db
+def test_status_refresh_rotates_pending_rows_and_expires_old_ones(fake, monkeypatch):
+    now = timezone.now()
+    SMSDelivery.objects.bulk_create([
+        SMSDelivery(campaign="c", receptor=f"09{i}", message_id=i, status=SMSDelivery.STATUS_SENT,
+                    status_checked_at=now - timedelta(minutes=10 - i))
+        for i in range(1, 5)
+    ])
+    stale = SMSDelivery.objects.create(campaign="c", receptor="0999", message_id=99, status=SMSDelivery.STATUS_SENT)
+    SMSDelivery.objects.filter(pk=stale.pk).update(created_at=now - timedelta(hours=sms.STATUS_EXPIRE_HOURS + 1))
+
+    asked = []
+
+    def status(message_ids):
+        asked.append(list(message_ids))
+        return {message_id: 1 for message_id in message_ids}  # هنوز در صف درگاه
+
+    monkeypatch.setattr(fake, "status", status)
+    assert sms.refresh_delivery_status(limit=2) == 0
+    assert sms.refresh_delivery_status(limit=2) == 0
+    # ردیف‌های بی‌پاسخ دور اول به انتهای صف رفته‌اند و نوبت به ردیف‌های بعدی رسیده
+    assert asked == [[1, 2], [3, 4]]
+    stale.refresh_from_db()
+    assert stale.status == SMSDelivery.STATUS_EXPIRED
+
+
+@pytest.mark.django_db
+def test_outbox_dead_letters_permanent_gateway_errors(fake):
+    fake.fail_receptors = {"0900"}
+    message = OutboxMessage.objects.create(kind="sms", payload={"receptor": "0900"}, idempotency_key="k-sms")
+    assert outbox.deliver(message.pk) == OutboxMessage.STATUS_DEAD
@@ -4,7 +4,6 @@ from django.db import transaction
 from django.shortcuts import get_object_or_404, render
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
-import random
 import os
 from rest_framework import status, permissions
 from django.http import FileResponse
@@ -13,9 +12,10 @@ from django.conf import settings
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from kavenegar import APIException, HTTPException, KavenegarAPI
 from medogram.settings import BITPAY_API_KEY
-from .models import APKDownloadStat, Comment, Blog, Order, Transaction, Visit, BoxMoney
+from medogram_tasks import send_otp_sms_task
+from telemedicine import otp, outbox
+from .models import APKDownloadStat, Comment, Blog, Order, Transaction, Visit, BoxMoney, OutboxMessage
 from .serializers import (CustomUserProfileSerializer, BlogSerializer, BoxMoneySerializer, VisitSerializer,
                           CommentSerializer, CustomUserProfileJustUserNameSerializer)
 from telemedicine.signals import apk_downloaded
@@ -38,32 +38,28 @@ class RegisterOrLoginView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        user, created = User.objects.get_or_create(phone_number=phone_number)
+        User.objects.get_or_create(phone_number=phone_number)
 
-        # Generate a random 6-digit authentication code
-        code = random.randint(100000, 999999)
-        user.auth_code = str(code)
-        user.save(update_fields=['auth_code'])
+        # کد در worker ساخته می‌شود و فقط هشش در Redis (با TTL) می‌ماند
+        if not otp.reserve(phone_number):
+            return Response(
+                {'error': 'کد قبلی به تازگی ارسال شده است؛ لطفاً کمی بعد دوباره تلاش کنید.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS
+            )
 
-        # Send SMS with the authentication code
         try:
-            api = KavenegarAPI(settings.KAVEH_NEGAR_API_KEY)
-            params = {
-                'receptor': user.phone_number,
-                'token': user.auth_code,
-                'template': 'users'  # Ensure this template exists in Kaveh Negar
-            }
-            api.verify_lookup(params)
-        except (APIException, HTTPException) as e:
-            logger.error(f"Failed to send SMS to {user.phone_number}: {e}")
+            send_otp_sms_task.apply_async((phone_number,), expires=otp.TTL_SEC)
+        except Exception as e:  # noqa: BLE001
+            otp.release(phone_number)
+            logger.error(f"Failed to queue OTP SMS for {phone_number}: {e}")
             return Response(
                 {'error': 'Failed to send authentication code. Please try again later.'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
 
         return Response(
             {'message': 'کد احراز هویت به شماره موبایل شما ارسال شد.'},
-            status=status.HTTP_200_OK
+            status=status.HTTP_202_ACCEPTED
         )
 
 
@@ -74,36 +70,32 @@ class VerifyOTPView(APIView):
         phone_number = request.data.get('phone_number')
         code = request.data.get('code')
 
-        try:
-            user = User.objects.get(phone_number=phone_number)
-            if user.auth_code == int(code):
-                refresh = RefreshToken.for_user(user)
-                response = Response({
-                    'refresh': str(refresh),
-                    'access': str(refresh.access_token),
-                }, status=status.HTTP_200_OK)
-                
-                
-                # ─── پیامک خوش‌آمد فقط اگر هیچ ویزیتی ندارد ───
-                if not Visit.objects.filter(user=user).exists():
-                    try:
-                        api = KavenegarAPI(settings.KAVEH_NEGAR_API_KEY)
-                        api.verify_lookup({
-                            'receptor': user.phone_number,
-                            'token'   : 300000,   # مبلغ یا مقدار دل‌خواه
-                            'template': 'first-log',
-                        })
-                    except (APIException, HTTPException) as exc:
-                        logger.warning(f"Welcome SMS failed for {user.phone_number}: {exc}")
-
-                return response
-
+        if not phone_number or code is None or not otp.verify(phone_number, code):
             return Response({'message': 'کد وارد شده صحیح نیست.'},
                             status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            user = User.objects.get(phone_number=phone_number)
         except User.DoesNotExist:
             return Response({'message': 'کاربری با این شماره موبایل پیدا نشد.'},
                             status=status.HTTP_404_NOT_FOUND)
 
+        refresh = RefreshToken.for_user(user)
+        response = Response({
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        }, status=status.HTTP_200_OK)
+
+        # ─── پیامک خوش‌آمد فقط اگر هیچ ویزیتی ندارد (یک بار برای هر کاربر، از صندوق خروجی) ───
+        if not Visit.objects.filter(user=user).exists():
+            outbox.enqueue(OutboxMessage.KIND_SMS, {
+                'receptor': user.phone_number,
+                'token'   : 300000,   # مبلغ یا مقدار دل‌خواه
+                'template': 'first-log',
+            }, key=f"first-log-sms:{user.pk}")
+
+        return response
+
 
 class CreateTransaction(APIView):
     permission_classes = [IsAuthenticated]